@@ -0,0 +1,208 @@
+"""End-to-end scrape and discovery runs against a local replay of ukclimbing.com.
+
+A corpus (synthetic by default, or one recorded with benchmarks.replay) is
+served by ReplayServer with the chosen latency and error rates. The route
+scraper's batch loop and CragFinder each run in their own interpreter, which
+reports pages/sec, CPU per page, peak RSS and database write time. Results are
+saved as benchmarks/results/<commit>.json so runs can be compared across
+commits with --compare.
+
+Usage: python -m benchmarks.bench_end_to_end [--crags N] [--corpus DIR] [--latency S]
+           [--error-rate P] [--throttle-rate P] [--compare RESULTS.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import load_corpus, make_corpus
+from benchmarks.replay import ReplayConfig, ReplayServer
+from climb_scraper.scraper.page_parser import VALID_TITLE_PREFIX, scan_title
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+FLOWS = ('scrape', 'discover')
+
+
+def _peak_rss_mib() -> float:
+    """Peak RSS of this process since exec; ru_maxrss would carry over the parent's on Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process and its reaped children"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _db_seconds(snapshot: dict, names) -> float:
+    return sum(h['sum'] for name, h in snapshot['histograms'].items() if name in names)
+
+
+def run_scrape(config: dict) -> dict:
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.metrics import METRICS
+    from climb_scraper.scraper.fetcher import FetchEngine
+    from climb_scraper.scraper.pipeline import ScrapePipeline
+    from climb_scraper.scraper.route_scraper import scrape_batch
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        db.add_crag_id_list(config['ids'])
+        engine = FetchEngine(url_template=config['url_template'], concurrency=config['concurrency'],
+                             rate=config['rate'], max_rate=config['rate'], burst=config['concurrency'])
+        pipeline = ScrapePipeline(db, engine.fetcher, parsers=config['parsers'])
+        METRICS.enable()
+        cpu_before, start = _cpu_seconds(), time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            while scrape_batch(db, engine, pipeline, 'bench', config['batch_size']) is not None:
+                pass
+            # Reaping the parser processes makes their CPU show up in RUSAGE_CHILDREN
+            pipeline.close()
+        elapsed, cpu = time.perf_counter() - start, _cpu_seconds() - cpu_before
+        engine.stop()
+        processed, _ = db.get_processing_stats()
+        db.disconnect()
+
+    snapshot = METRICS.snapshot()
+    pages = sum(count for name, count in snapshot['counters'].items() if name.startswith('http_'))
+    return {'pages': pages, 'seconds': elapsed, 'pages_per_sec': pages / elapsed,
+            'cpu_ms_per_page': cpu / pages * 1000,
+            'peak_rss_mib': _peak_rss_mib(),
+            'db_write_seconds': _db_seconds(snapshot, {'write_batch'}),
+            'crags_stored': snapshot['counters'].get('crags_stored', 0), 'crags_processed': processed}
+
+
+def run_discover(config: dict) -> dict:
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.metrics import METRICS
+    from climb_scraper.scraper.fetcher import FetchEngine
+    from climb_scraper.scraper.list_builder import CragFinder
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        db.add_crag_id_list(config['known_ids'])
+        engine = FetchEngine(url_template=config['url_template'], concurrency=config['concurrency'],
+                             rate=config['rate'], max_rate=config['rate'], burst=config['concurrency'])
+        finder = CragFinder(db, engine=engine, probe_width=config['concurrency'])
+        METRICS.enable()
+        cpu_before, start = _cpu_seconds(), time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = finder.find_new_crags()
+        elapsed, cpu = time.perf_counter() - start, _cpu_seconds() - cpu_before
+        engine.stop()
+        db.disconnect()
+
+    snapshot = METRICS.snapshot()
+    expected = set(config['expected_ids'])
+    pages = len(finder.results)
+    return {'pages': pages, 'seconds': elapsed, 'pages_per_sec': pages / elapsed,
+            'cpu_ms_per_page': cpu / pages * 1000,
+            'peak_rss_mib': _peak_rss_mib(),
+            'db_write_seconds': _db_seconds(snapshot, {'db.add_crag_id_list', 'db.commit'}),
+            'found': len(found), 'recall': len(expected & set(found)) / len(expected) if expected else 1.0,
+            'kib_read_per_probe': finder.bytes_read / pages / 1024}
+
+
+def run_flow(flow: str, config: dict) -> dict:
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_end_to_end', '--worker', flow,
+                             json.dumps(config)], capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"{flow} worker failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD', '--', 'climb_scraper'], capture_output=True)
+        return revision + ('-dirty' if dirty.returncode else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current: dict, baseline_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f"\nChange against {baseline.get('revision', baseline_path)}:")
+    for flow, results in current['flows'].items():
+        old = baseline['flows'].get(flow, {})
+        for key in ('pages_per_sec', 'cpu_ms_per_page', 'peak_rss_mib', 'db_write_seconds'):
+            if old.get(key):
+                print(f"  {flow:<9} {key:<18} {old[key]:10.3f} -> {results[key]:10.3f} "
+                      f"({(results[key] - old[key]) / old[key] * 100:+.1f}%)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        runner = run_scrape if sys.argv[2] == 'scrape' else run_discover
+        print(json.dumps(runner(json.loads(sys.argv[3]))))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='directory of <crag_id>.html pages; synthetic pages if not given')
+    parser.add_argument('--crags', type=int, default=300, help='size of the synthetic ID range')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=200.0, help='requests/sec cap for the fetcher')
+    parser.add_argument('--parsers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--flows', default=','.join(FLOWS))
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else make_corpus(args.crags)
+    ids = sorted(pages)
+    valid_ids = [crag_id for crag_id in ids if VALID_TITLE_PREFIX in scan_title(pages[crag_id])]
+    # Discovery starts a tenth of the way in and should find every crag above that
+    cut = valid_ids[len(valid_ids) // 10]
+    config = ReplayConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate)
+    print(f"Corpus: {len(ids)} pages ({len(valid_ids)} crags, "
+          f"{sum(map(len, pages.values())) / len(ids) / 1024:.0f} KiB average), IDs {ids[0]}-{ids[-1]}")
+
+    results = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'settings': dict(vars(args), pages=len(ids)), 'flows': {}}
+    with ReplayServer(pages, config) as server:
+        common = {'url_template': server.url_template, 'concurrency': args.concurrency, 'rate': args.rate,
+                  'parsers': args.parsers, 'batch_size': args.batch_size}
+        for flow in args.flows.split(','):
+            if flow == 'scrape':
+                flow_config = dict(common, ids=list(range(ids[0], ids[-1] + 1)))
+            else:
+                flow_config = dict(common, known_ids=list(range(ids[0], cut + 1)),
+                                   expected_ids=[crag_id for crag_id in valid_ids if crag_id > cut])
+            result = results['flows'][flow] = run_flow(flow, flow_config)
+            print(f"{flow:<9} {result['pages_per_sec']:8.1f} pages/sec   {result['cpu_ms_per_page']:7.2f} ms CPU/page"
+                  f"   peak RSS {result['peak_rss_mib']:6.1f} MiB   DB writes {result['db_write_seconds']:.3f} s")
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{results['revision']}.json"
+        path.write_text(json.dumps(results, indent=2))
+        print(f"Saved {path}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Start-up time of `climb-scraper status`, with a budget so heavy imports don't creep back in.
+
+Each run is a fresh interpreter, like cron or a health check starting the
+command, against a small database. The median wall time is compared with
+BUDGET_MS, and the modules the command loaded are checked against the heavy
+dependencies only scrape, discover and export need. The baseline is importing
+the scraper itself, which loads all of them. Exits non-zero on a regression,
+so it can run in CI.
+
+Usage: python -m benchmarks.bench_import_time [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from climb_scraper.data.database import ClimbingDatabase
+
+BUDGET_MS = 100
+HEAVY_MODULES = ['aiohttp', 'bs4', 'numpy', 'pandas', 'pyarrow', 'requests', 'sqlalchemy']
+
+# Runs status in-process, then reports which heavy modules it pulled in
+LOADED_SCRIPT = '''
+import sys
+from climb_scraper.cli import main
+main(sys.argv[1:])
+print(' '.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+'''
+
+
+def wall_ms(command) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def median_ms(command, runs: int) -> float:
+    wall_ms(command)  # warm the OS file cache and __pycache__
+    return statistics.median(wall_ms(command) for _ in range(runs))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'bench.db')
+        db = ClimbingDatabase(db_path)
+        db.add_crag_ids(1, 1000)
+        db.insert_crag(1, 'Stanage')
+
+        interpreter = median_ms([sys.executable, '-c', 'pass'], runs)
+        status = median_ms([sys.executable, '-m', 'climb_scraper.cli', '--db', db_path, 'status'], runs)
+        scraper = median_ms([sys.executable, '-c', 'import climb_scraper.scraper.route_scraper'], runs)
+        loaded = subprocess.run([sys.executable, '-c', LOADED_SCRIPT.format(heavy=HEAVY_MODULES),
+                                 '--db', db_path, 'status'],
+                                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        heavy = loaded.stderr.split()
+
+    print(f"{'bare interpreter':<32} {interpreter:8.1f} ms")
+    print(f"{'climb-scraper status':<32} {status:8.1f} ms   (budget {BUDGET_MS} ms)")
+    print(f"{'import route_scraper':<32} {scraper:8.1f} ms")
+    failed = False
+    if status > BUDGET_MS:
+        print(f"FAIL: status took {status:.1f} ms, over the {BUDGET_MS} ms budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: status imported {', '.join(heavy)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Rows/sec for insert_climbs: the old iterrows path against the column and JSON-list paths.
+
+Usage: python -m benchmarks.bench_insert_climbs [crags] [routes per crag]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.fixtures import make_climbs
+from climb_scraper.data.database import INSERT_CLIMB_SQL, ClimbingDatabase
+
+
+def iterrows_insert(db: ClimbingDatabase, climbs_df: pd.DataFrame, crag_id: int):
+    climbs_data = []
+    for _, row in climbs_df.iterrows():
+        climbs_data.append((row['id'], crag_id, row['name'], row['grade'], row['techgrade'],
+                            row['gradescore'], row['gradetype']))
+    db.connect().executemany(INSERT_CLIMB_SQL, climbs_data)
+    db.commit()
+
+
+def timed(label: str, rows: int, func):
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        start = time.perf_counter()
+        func(db)
+        elapsed = time.perf_counter() - start
+        db.disconnect()
+    print(f"{label:<28} {rows / elapsed:>12,.0f} rows/sec")
+
+
+def main():
+    n_crags = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_routes = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    columns = ['id', 'name', 'grade', 'techgrade', 'gradesystem', 'gradetype', 'gradescore']
+    lists = {crag_id: make_climbs(crag_id, n_routes) for crag_id in range(n_crags)}
+    frames = {crag_id: pd.DataFrame(climbs)[columns] for crag_id, climbs in lists.items()}
+    rows = n_crags * n_routes
+
+    def old(db):
+        for crag_id, df in frames.items():
+            iterrows_insert(db, df, crag_id)
+
+    def per_crag_frames(db):
+        for crag_id, df in frames.items():
+            db.insert_climbs(df, crag_id)
+
+    def per_crag_lists(db):
+        for crag_id, climbs in lists.items():
+            db.insert_climbs(climbs, crag_id)
+
+    def batched_lists(db):
+        db.insert_climbs_batch(lists.items())
+
+    print(f"{n_crags} crags x {n_routes} routes")
+    timed("iterrows (old)", rows, old)
+    timed("dataframe columns", rows, per_crag_frames)
+    timed("json list", rows, per_crag_lists)
+    timed("json list, one batch", rows, batched_lists)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Crags/sec and peak RSS per worker for the DataFrame ingest path against the lean record path.
+
+Each mode runs in its own interpreter so import cost and memory are measured
+the way a scraper worker would see them.
+
+Usage: python -m benchmarks.bench_lean_ingest [crags] [routes per crag]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import make_crag_page
+
+
+def run_worker(mode: str, n_crags: int, n_routes: int):
+    start_import = time.perf_counter()
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.scraper.page_parser import parse_crag_page
+    from climb_scraper.scraper.records import climb_records_creation
+    from climb_scraper.scraper.scraper_functions import string_processor_climbs
+    if mode == 'dataframe':
+        from climb_scraper.scraper.scraper_functions import climbs_dataframe_creation as build
+    else:
+        build = climb_records_creation
+    import_seconds = time.perf_counter() - start_import
+
+    pages = [make_crag_page(crag_id, n_routes, filler_kb=5) for crag_id in range(n_crags)]
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        start = time.perf_counter()
+        for crag_id, content in enumerate(pages):
+            page = parse_crag_page(content)
+            climbs = build(string_processor_climbs(page.table_script))
+            with db.transaction():
+                db.insert_crag(crag_id)
+                db.insert_climbs(climbs, crag_id)
+        elapsed = time.perf_counter() - start
+        db.disconnect()
+
+    # ru_maxrss is KiB on Linux
+    print(json.dumps({'mode': mode, 'crags_per_sec': n_crags / elapsed, 'import_ms': import_seconds * 1000,
+                      'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      'pandas_loaded': 'pandas' in sys.modules}))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+    n_crags = sys.argv[1] if len(sys.argv) > 1 else '200'
+    n_routes = sys.argv[2] if len(sys.argv) > 2 else '300'
+    print(f"{n_crags} crags x {n_routes} routes")
+    for mode in ('dataframe', 'lean'):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_lean_ingest', '--worker', mode,
+                                 n_crags, n_routes], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<10} {result['crags_per_sec']:8.1f} crags/sec   peak RSS {result['peak_rss_mib']:6.1f} MiB   "
+              f"imports {result['import_ms']:6.1f} ms   pandas loaded: {result['pandas_loaded']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Typeahead latency for climb names: FTS5 prefix search against LIKE '%...%' over millions of routes.
+
+Route names are made from a vocabulary of common climbing words plus a long
+tail of made-up ones, so some prefixes match hundreds of thousands of routes
+and others a handful. Queries are prefixes of real names as they would be
+typed, one keystroke at a time. The index is kept up by the climbs triggers
+while the table is filled, so the build time includes their cost.
+
+Usage: python -m benchmarks.bench_name_search [routes]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from climb_scraper.data.database import INSERT_CLIMB_SQL, ClimbingDatabase
+
+COMMON_WORDS = ['the', 'arete', 'crack', 'wall', 'corner', 'direct', 'left', 'right', 'hand', 'variation',
+                'slab', 'groove', 'chimney', 'edge', 'buttress', 'route', 'original', 'finish', 'start',
+                'black', 'green', 'red', 'flake', 'overhang', 'traverse', 'gully', 'ridge', 'pillar']
+SYLLABLES = ['ka', 'ro', 'mi', 'zen', 'tor', 'bel', 'an', 'gri', 'los', 'ven', 'dra', 'qu', 'il', 'sto',
+             'nex', 'ur', 'pho', 'lim', 'sa', 'cre']
+LIKE_SQL = "SELECT climb_id, crag_id, name, grade FROM climbs WHERE name LIKE ? LIMIT ?"
+ROUTES_PER_CRAG = 200
+
+
+def make_vocabulary(rng: random.Random, size: int):
+    words = {''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)}
+    return COMMON_WORDS, sorted(words)
+
+
+def route_name(rng: random.Random, common, rare) -> str:
+    words = [rng.choice(common) if rng.random() < 0.4 else rng.choice(rare) for _ in range(rng.randint(1, 4))]
+    return ' '.join(words).title()
+
+
+def build(db: ClimbingDatabase, n: int, rng: random.Random):
+    common, rare = make_vocabulary(rng, 50_000)
+    conn = db.connect()
+    batch = 100_000
+    with db.transaction():
+        for first in range(0, n, batch):
+            conn.executemany(INSERT_CLIMB_SQL, (
+                (climb_id, climb_id // ROUTES_PER_CRAG, route_name(rng, common, rare), 'E1', '5b', 100.0, 2)
+                for climb_id in range(first, min(first + batch, n))))
+    return common, rare
+
+
+def keystrokes(name: str, min_length: int = 2):
+    """The prefixes of name a typeahead would search for as it is typed"""
+    return [name[:end] for end in range(min_length, len(name) + 1) if not name[end - 1].isspace()]
+
+
+def latencies(func, queries) -> list:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(label: str, times: list):
+    quantiles = statistics.quantiles(times, n=100)
+    print(f"{label:<30} p50 {quantiles[49]:9.3f} ms   p95 {quantiles[94]:9.3f} ms   max {max(times):9.3f} ms")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        start = time.perf_counter()
+        build(db, n, rng)
+        elapsed = time.perf_counter() - start
+        print(f"{n:,} routes inserted with the FTS triggers in {elapsed:.1f}s ({n / elapsed:,.0f} rows/sec)")
+
+        conn = db.connect()
+        sample = [row[0] for row in conn.execute(
+            "SELECT name FROM climbs WHERE climb_id IN (SELECT abs(random()) % ? FROM climbs LIMIT 40)", (n,))]
+        typed = [prefix for name in sample for prefix in keystrokes(name.lower())]
+        by_length = {}
+        for prefix in typed:
+            by_length.setdefault(min(len(prefix), 8), []).append(prefix)
+
+        report(f"FTS5 typeahead ({len(typed)} keystrokes)", latencies(db.search_climbs, typed))
+        for length in sorted(by_length):
+            label = f"  {length}{'+' if length == 8 else ''} characters typed"
+            report(label, latencies(db.search_climbs, by_length[length]))
+        report("FTS5 crag-scoped typeahead",
+               latencies(lambda text: db.search_climbs(text, crag_id=rng.randrange(n // ROUTES_PER_CRAG)), typed))
+        # A full scan per query, so only a few of them
+        like_queries = rng.sample(typed, 20)
+        report("LIKE '%...%' (20 queries)",
+               latencies(lambda text: conn.execute(LIKE_SQL, (f'%{text}%', 10)).fetchall(), like_queries))
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
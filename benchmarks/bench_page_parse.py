@@ -0,0 +1,62 @@
+"""Per-page CPU cost of the old multi-parse BeautifulSoup path against the single byte scan.
+
+Usage: python -m benchmarks.bench_page_parse [directory of saved crag .html pages]
+"""
+import sys
+import time
+
+from bs4 import BeautifulSoup as bs
+
+from benchmarks.fixtures import default_corpus, load_pages
+from climb_scraper.scraper.page_parser import parse_crag_page
+
+
+def old_pipeline(content: bytes):
+    # is_valid_crag_url_page: one parse per encoding attempt
+    valid = False
+    for encoding in ['utf-8', 'iso-8859-1', 'windows-1252']:
+        try:
+            soup = bs(content.decode(encoding), 'html.parser')
+            if soup.title and 'UKC Logbook' in (soup.title.string or ''):
+                valid = True
+                break
+        except UnicodeDecodeError:
+            continue
+    if not valid:
+        # get_data's failure path parses again for the title
+        soup = bs(content, 'html.parser')
+        return soup.title.string if soup.title else None
+    # data_to_string parses once more to find the script
+    for script in bs(content, 'html.parser').find_all('script'):
+        if script.string and 'table_data = ' in script.string:
+            return script.string.strip()
+    return None
+
+
+def new_pipeline(content: bytes):
+    page = parse_crag_page(content)
+    return page.table_script if page.is_valid else page.title
+
+
+def cpu_per_page(func, pages, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        for page in pages:
+            func(page)
+    return (time.process_time() - start) / (repeat * len(pages))
+
+
+def main():
+    pages = load_pages(sys.argv[1]) if len(sys.argv) > 1 else default_corpus()
+    for page in pages:
+        assert old_pipeline(page) == new_pipeline(page)
+    old = cpu_per_page(old_pipeline, pages, repeat=3)
+    new = cpu_per_page(new_pipeline, pages, repeat=30)
+    print(f"pages: {len(pages)}, {sum(map(len, pages)) / len(pages) / 1024:.0f} KiB average")
+    print(f"bs4 multi-parse: {old * 1000:8.2f} ms CPU/page")
+    print(f"single scan:     {new * 1000:8.2f} ms CPU/page")
+    print(f"speedup:         {old / new:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
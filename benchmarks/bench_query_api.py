@@ -0,0 +1,122 @@
+"""Load test of the cached read API with concurrent simulated users while the scraper writes.
+
+Builds a database of synthetic crags, then runs USERS threads that each pick
+a crag (a few popular crags get most of the traffic, as on a real site) and ask
+for its summary, a grade-filtered route list or its grade histogram, with a
+short think time between requests. A writer thread meanwhile rewrites random
+crags through ClimbingDatabase, the way the scraper does, so every run also
+exercises cache invalidation. Each scenario runs once with the cache and once
+without, on the same read-only pool.
+
+Usage: python -m benchmarks.bench_query_api [--crags N] [--routes N] [--users N] [--seconds S]
+           [--write-rate CRAGS_PER_SEC] [--think MS]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.fixtures import make_climbs
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.queries import CragQueries
+
+
+def build_database(path: str, crags: int, routes: int) -> ClimbingDatabase:
+    db = ClimbingDatabase(path, persistent=True)
+    with db.transaction():
+        db.add_crag_id_list(range(1, crags + 1))
+        for crag_id in range(1, crags + 1):
+            db.insert_crag(crag_id, f'Crag {crag_id}', 50 + crag_id % 800 / 100, -5 + crag_id % 600 / 100,
+                           region=f'Region {crag_id % 20}')
+            db.insert_climbs(make_climbs(crag_id, routes), crag_id)
+    return db
+
+
+def user(queries: CragQueries, crags: int, think: float, stop: threading.Event, seed: int,
+         latencies: list):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        # Pareto-distributed popularity: low IDs are the honeypots everyone visits
+        crag_id = min(int(rng.paretovariate(1.2)), crags)
+        kind = rng.random()
+        start = time.perf_counter()
+        if kind < 0.5:
+            queries.crag_summary(crag_id)
+        elif kind < 0.8:
+            low = rng.choice((0, 200, 400, 600))
+            queries.routes(crag_id, min_score=low, max_score=low + 200)
+        else:
+            queries.grade_histogram(crag_id)
+        latencies.append(time.perf_counter() - start)
+        if think:
+            stop.wait(rng.expovariate(1 / think))
+
+
+def writer(db: ClimbingDatabase, crags: int, routes: int, rate: float, stop: threading.Event,
+           written: list):
+    rng = random.Random(1)
+    while not stop.wait(1 / rate):
+        crag_id = min(int(rng.paretovariate(1.2)), crags)
+        with db.transaction():
+            db.clear_climbs(crag_id)
+            db.insert_climbs(make_climbs(crag_id, routes, seed=rng.randrange(1000)), crag_id)
+        written.append(crag_id)
+
+
+def run(path: str, db: ClimbingDatabase, args, cached: bool) -> dict:
+    queries = CragQueries(path, pool_size=args.pool, cache_entries=args.cache_entries if cached else 0)
+    stop = threading.Event()
+    per_user = [[] for _ in range(args.users)]
+    written: list = []
+    threads = [threading.Thread(target=user, args=(queries, args.crags, args.think / 1000, stop, i, per_user[i]))
+               for i in range(args.users)]
+    if args.write_rate:
+        threads.append(threading.Thread(target=writer, args=(db, args.crags, args.routes, args.write_rate,
+                                                             stop, written)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    stats = queries.cache.stats()
+    queries.close()
+
+    latencies = sorted(latency for user_latencies in per_user for latency in user_latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {'requests': len(latencies), 'qps': len(latencies) / args.seconds,
+            'p50_ms': quantiles[49] * 1000, 'p95_ms': quantiles[94] * 1000, 'p99_ms': quantiles[98] * 1000,
+            'hit_ratio': stats['hit_ratio'], 'crags_written': len(written)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--crags', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=100, help='routes per crag')
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--think', type=float, default=5.0, help='mean think time per user in ms')
+    parser.add_argument('--write-rate', type=float, default=5.0, help='crags rewritten per second; 0 for none')
+    parser.add_argument('--pool', type=int, default=4, help='read-only connections')
+    parser.add_argument('--cache-entries', type=int, default=4096)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        start = time.perf_counter()
+        db = build_database(path, args.crags, args.routes)
+        print(f"{args.crags:,} crags, {args.crags * args.routes:,} routes built in "
+              f"{time.perf_counter() - start:.1f}s; {args.users} users, {args.write_rate:g} crag writes/sec")
+        for cached in (False, True):
+            result = run(path, db, args, cached)
+            print(f"{'cached' if cached else 'uncached':<9} {result['qps']:9.0f} req/s   "
+                  f"p50 {result['p50_ms']:6.2f} ms   p95 {result['p95_ms']:6.2f} ms   p99 {result['p99_ms']:6.2f} ms"
+                  f"   hit ratio {result['hit_ratio']:5.1%}   {result['crags_written']} crags rewritten")
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
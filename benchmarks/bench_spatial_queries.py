@@ -0,0 +1,94 @@
+"""Bounding-box and nearby-crag queries over 50k synthetic crags: R-tree against scanning every row.
+
+Crags are spread over Britain, densest around a few popular areas, like the
+real thing. Each query size is run at random centres; the scan baselines are a
+SQL BETWEEN over the crags table and haversine in Python over every row, which
+is what the website would need without the index. The index pays off for the
+zoomed-in views a map mostly shows; a box covering a large share of all crags
+reads most of the table either way and should be limited or clustered.
+
+Usage: python -m benchmarks.bench_spatial_queries [crags]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.geo import KM_PER_DEGREE, haversine_km
+
+SCAN_BBOX_SQL = '''
+SELECT crag_id, name, latitude, longitude FROM crags
+WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+'''
+HOTSPOTS = [(53.35, -1.65), (54.45, -3.1), (53.1, -4.0), (50.1, -5.6), (57.1, -5.1)]
+
+
+def make_crags(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for crag_id in range(1, n + 1):
+        if rng.random() < 0.5:
+            lat, lon = rng.choice(HOTSPOTS)
+            yield crag_id, f'Crag {crag_id}', lat + rng.gauss(0, 0.3), lon + rng.gauss(0, 0.4)
+        else:
+            yield crag_id, f'Crag {crag_id}', rng.uniform(50.0, 58.5), rng.uniform(-6.5, 1.7)
+
+
+def viewport(lat: float, lon: float, km: float):
+    lat_delta = km / 2 / KM_PER_DEGREE
+    lon_delta = lat_delta * 1.7
+    return lat - lat_delta, lat + lat_delta, lon - lon_delta, lon + lon_delta
+
+
+def per_query(func, centres) -> float:
+    start = time.perf_counter()
+    for centre in centres:
+        func(*centre)
+    return (time.perf_counter() - start) / len(centres) * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        conn = db.connect()
+        start = time.perf_counter()
+        with db.transaction():
+            conn.executemany("INSERT INTO crags (crag_id, name, latitude, longitude) VALUES (?, ?, ?, ?)",
+                             make_crags(n))
+        print(f"{n:,} crags inserted, R-tree kept up by trigger, in {time.perf_counter() - start:.2f}s")
+
+        def scan_bbox(lat, lon, km):
+            return conn.execute(SCAN_BBOX_SQL, viewport(lat, lon, km)).fetchall()
+
+        def rtree_bbox(lat, lon, km):
+            return db.get_crags_in_bbox(*viewport(lat, lon, km))
+
+        def scan_within(lat, lon, km):
+            return sorted((haversine_km(lat, lon, row[2], row[3]), row[0]) for row in
+                          conn.execute("SELECT crag_id, name, latitude, longitude FROM crags")
+                          if haversine_km(lat, lon, row[2], row[3]) <= km)
+
+        def rtree_within(lat, lon, km):
+            return db.get_crags_within_km(lat, lon, km)
+
+        print(f"{'query':<20} {'crags found':>11} {'scan ms':>9} {'R-tree ms':>10} {'speedup':>8}")
+        for label, scan, indexed, sizes, repeat in (
+                ('viewport', scan_bbox, rtree_bbox, (5, 25, 100, 400), 200),
+                ('within', scan_within, rtree_within, (5, 25, 100), 10)):
+            for km in sizes:
+                centres = [(rng.uniform(50.5, 58.0), rng.uniform(-6.0, 1.2), km) for _ in range(repeat)]
+                centres[::2] = [(lat + rng.gauss(0, 0.2), lon + rng.gauss(0, 0.2), km)
+                                for lat, lon in rng.choices(HOTSPOTS, k=len(centres[::2]))]
+                found = sum(len(indexed(*centre)) for centre in centres) / len(centres)
+                assert all(len(scan(*centre)) == len(indexed(*centre)) for centre in centres[:5])
+                scan_ms, index_ms = per_query(scan, centres), per_query(indexed, centres)
+                print(f"{label + f' {km} km':<20} {found:11.0f} {scan_ms:9.3f} {index_ms:10.3f} "
+                      f"{scan_ms / index_ms:7.1f}x")
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
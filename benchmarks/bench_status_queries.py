@@ -0,0 +1,55 @@
+"""Status and queue queries on a synthetic 1M-row crag_ids table, old scans against the
+counter table and the partial index.
+
+Usage: python -m benchmarks.bench_status_queries [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from climb_scraper.data.database import ClimbingDatabase
+
+OLD_STATS_SQL = """
+    SELECT
+        SUM(CASE WHEN processed = TRUE THEN 1 ELSE 0 END) as processed,
+        SUM(CASE WHEN processed = FALSE THEN 1 ELSE 0 END) as unprocessed
+    FROM crag_ids
+"""
+NEXT_ID_SQL = "SELECT crag_id FROM crag_ids WHERE processed = FALSE ORDER BY crag_id LIMIT 1"
+
+
+def per_call(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        db = ClimbingDatabase(os.path.join(directory, 'bench.db'), persistent=True)
+        conn = db.connect()
+        # Nearly everything processed, with the backlog at the top of the ID space
+        backlog_start = rows - rows // 100
+        with db.transaction():
+            conn.executemany("INSERT INTO crag_ids (crag_id, processed) VALUES (?, ?)",
+                             ((i, i < backlog_start) for i in range(rows)))
+        print(f"{rows:,} crag IDs, {rows - backlog_start:,} unprocessed")
+
+        old_stats = per_call(lambda: conn.execute(OLD_STATS_SQL).fetchone(), 5)
+        new_stats = per_call(db.get_processing_stats, 1000)
+        new_next = per_call(lambda: conn.execute(NEXT_ID_SQL).fetchone(), 1000)
+        new_claim = per_call(lambda: db.claim_batch(20, 'bench', 0), 200)
+        conn.execute("DROP INDEX idx_crag_ids_unprocessed")
+        old_next = per_call(lambda: conn.execute(NEXT_ID_SQL).fetchone(), 5)
+        db.disconnect()
+
+    print(f"processing stats   scan {old_stats * 1000:9.3f} ms   counters {new_stats * 1000:9.3f} ms")
+    print(f"next unprocessed   scan {old_next * 1000:9.3f} ms   index    {new_next * 1000:9.3f} ms")
+    print(f"claim_batch(20)                        index    {new_claim * 1000:9.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
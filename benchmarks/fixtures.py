@@ -0,0 +1,93 @@
+"""Synthetic crag pages for benchmarks that must not hit ukclimbing.com"""
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+def make_climbs(crag_id: int, n_routes: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed + crag_id)
+    return [{
+        'id': crag_id * 100000 + i,
+        'name': f'Route {i} of crag {crag_id}',
+        'grade': rng.randint(1, 60),
+        'techgrade': rng.choice(['4a', '4b', '4c', '5a', '5b', '5c', '6a']),
+        'gradesystem': 1,
+        'gradetype': rng.choice([1, 2, 3]),
+        'gradescore': rng.uniform(0, 1000),
+        'stars': rng.randint(0, 3),
+        'height': rng.randint(5, 60),
+        'desc': 'Climb the obvious line. ' * rng.randint(1, 10),
+    } for i in range(n_routes)]
+
+
+def make_grades() -> dict:
+    return {str(system): {str(g): {'id': g, 'name': f'G{g}', 'score': g * 10, 'gradesystem': system,
+                                   'gradecolor': '#000'}
+                          for g in range(1, 61)}
+            for system in (1, 2, 3)}
+
+
+def crag_location(crag_id: int) -> Tuple[float, float]:
+    """A made-up but stable (latitude, longitude) in Britain for a crag"""
+    rng = random.Random(crag_id)
+    return round(rng.uniform(50.0, 58.5), 5), round(rng.uniform(-6.5, 1.7), 5)
+
+
+def make_crag_page(crag_id: int, n_routes: int = 200, filler_kb: int = 60) -> bytes:
+    """Build a page shaped like a UKC crag page: big head, nav filler, then the data script"""
+    filler = '<div class="nav"><a href="/x">link</a><span>text</span></div>\n' * (filler_kb * 16)
+    script = (f'var table_data = {json.dumps(make_climbs(crag_id, n_routes))};\n'
+              f'var grades_list = {json.dumps(make_grades())};\n')
+    latitude, longitude = crag_location(crag_id)
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>UKC Logbook - Test Crag {crag_id}</title>'
+            f'<script src="/js/app.js"></script></head><body>{filler}'
+            f'<script>var map_options = {{"lat": {latitude}, "lng": {longitude}, "zoom": 14}};</script>'
+            f'<script>\n{script}</script><script>var other = 1;</script></body></html>').encode('utf-8')
+
+
+def make_invalid_page(filler_kb: int = 30) -> bytes:
+    filler = '<p>Nothing to see here</p>\n' * (filler_kb * 40)
+    return f'<html><head><title>UKClimbing - Page not found</title></head><body>{filler}</body></html>'.encode()
+
+
+def load_pages(directory: str) -> List[bytes]:
+    """Load saved .html pages from a directory"""
+    return [path.read_bytes() for path in sorted(Path(directory).glob('*.html'))]
+
+
+def default_corpus() -> List[bytes]:
+    return [make_crag_page(i, n_routes=n) for i, n in enumerate([20, 200, 1500], start=1)] + [make_invalid_page()]
+
+
+def make_corpus(n_ids: int, first_id: int = 1, seed: int = 0, invalid_share: float = 0.1,
+                missing_share: float = 0.1) -> Dict[int, bytes]:
+    """A run of crag IDs with small, typical and very large crags, non-crag pages and gaps
+
+    IDs left out of the dict are meant to be served as 404s.
+    """
+    rng = random.Random(seed)
+    pages = {}
+    for crag_id in range(first_id, first_id + n_ids):
+        roll = rng.random()
+        if roll < missing_share:
+            continue
+        if roll < missing_share + invalid_share:
+            pages[crag_id] = make_invalid_page(filler_kb=rng.choice([5, 30]))
+            continue
+        n_routes = rng.choice([5, 20, 60, 200, 200, 500, 1500])
+        pages[crag_id] = make_crag_page(crag_id, n_routes=n_routes, filler_kb=rng.choice([20, 60, 120]))
+    return pages
+
+
+def save_corpus(pages: Dict[int, bytes], directory: str):
+    """Write a corpus as <crag_id>.html files"""
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for crag_id, content in pages.items():
+        (Path(directory) / f'{crag_id}.html').write_bytes(content)
+
+
+def load_corpus(directory: str) -> Dict[int, bytes]:
+    """Read a corpus saved by save_corpus or recorded by benchmarks.replay"""
+    return {int(path.stem): path.read_bytes() for path in Path(directory).glob('*.html') if path.stem.isdigit()}
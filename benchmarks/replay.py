@@ -0,0 +1,153 @@
+"""Local stand-in for ukclimbing.com that serves a recorded or synthetic corpus of crag pages.
+
+The server runs in its own process so its CPU and memory stay out of the
+numbers measured in the scraper process. Latency, server errors and 429s can
+be dialled in to see how the scraper copes. Pages carry an ETag and a
+matching If-None-Match gets a 304, like the live site's revalidation.
+
+Record a corpus from the live site (politely, one page at a time):
+    python -m benchmarks.replay record DIR FIRST_ID LAST_ID
+Serve a corpus for manual runs:
+    python -m benchmarks.replay serve DIR [port]
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import random
+import sys
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+CRAG_PATH = '/logbook/crag.php'
+
+
+@dataclass
+class ReplayConfig:
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: int = 0
+    seed: int = 0
+
+
+def _serve(pages: Dict[int, bytes], config: ReplayConfig, host: str, port: int, ready, hits):
+    from aiohttp import web
+
+    rng = random.Random(config.seed)
+    etags = {crag_id: f'"{hashlib.sha1(content).hexdigest()}"' for crag_id, content in pages.items()}
+
+    async def crag(request):
+        with hits.get_lock():
+            hits.value += 1
+        await asyncio.sleep(max(config.latency + rng.uniform(-config.jitter, config.jitter), 0))
+        roll = rng.random()
+        if roll < config.throttle_rate:
+            return web.Response(status=429, headers={'Retry-After': str(config.retry_after)})
+        if roll < config.throttle_rate + config.error_rate:
+            return web.Response(status=503)
+        try:
+            crag_id = int(request.query.get('id', ''))
+        except ValueError:
+            crag_id = None
+        if crag_id not in pages:
+            return web.Response(status=404, text='Not found')
+        etag = etags[crag_id]
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=pages[crag_id], content_type='text/html', charset='utf-8', headers={'ETag': etag})
+
+    async def start():
+        app = web.Application()
+        app.router.add_get(CRAG_PATH, crag)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        ready.put(runner.addresses[0][1])
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start())
+    loop.run_forever()
+
+
+class ReplayServer:
+    """Serves `pages` ({crag_id: body}) at /logbook/crag.php?id=N; other IDs get a 404"""
+
+    def __init__(self, pages: Dict[int, bytes], config: Optional[ReplayConfig] = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.pages = pages
+        self.config = config or ReplayConfig()
+        self.host = host
+        self.port = port
+        self._process: Optional[multiprocessing.Process] = None
+        self._hits = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def requests(self) -> int:
+        """Requests the server has answered so far, HEADs and errors included"""
+        return self._hits.value if self._hits is not None else 0
+
+    @property
+    def url_template(self) -> str:
+        return f"http://{self.host}:{self.port}{CRAG_PATH}?id={{crag_id}}"
+
+    def start(self) -> str:
+        """Start the server process and return the crag URL template pointing at it"""
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        self._hits = context.Value('l', 0)
+        self._process = context.Process(target=_serve, daemon=True,
+                                        args=(self.pages, self.config, self.host, self.port, ready, self._hits))
+        self._process.start()
+        self.port = ready.get(timeout=30)
+        return self.url_template
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+def record(directory: str, first_id: int, last_id: int):
+    """Save live crag pages, valid or not, as <crag_id>.html; 404s are left out"""
+    from pathlib import Path
+    from climb_scraper.scraper.fetcher import FetchEngine
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    engine = FetchEngine(concurrency=1, rate=0.5, adaptive=True, max_rate=1.0)
+    try:
+        for result in engine.fetch_many(range(first_id, last_id + 1)):
+            if result.ok:
+                (Path(directory) / f'{result.crag_id}.html').write_bytes(result.content)
+            print(f"{result.crag_id}: {result.status or result.error}")
+    finally:
+        engine.stop()
+
+
+def main():
+    from benchmarks.fixtures import load_corpus
+
+    if len(sys.argv) >= 5 and sys.argv[1] == 'record':
+        record(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'serve':
+        server = ReplayServer(load_corpus(sys.argv[2]), port=int(sys.argv[3]) if len(sys.argv) > 3 else 8080)
+        print(f"Serving {len(server.pages)} pages at {server.start()}")
+        try:
+            server._process.join()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
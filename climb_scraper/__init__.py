@@ -1,2 +1,9 @@
-from .scraper.scraper_functions import url_builder
-from .data.data_calls import *
\ No newline at end of file
+from .data.data_calls import *
+
+
+def __getattr__(name):
+    # url_builder stays importable from the package without every command paying for the scraper's imports
+    if name == 'url_builder':
+        from .scraper.scraper_functions import url_builder
+        return url_builder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
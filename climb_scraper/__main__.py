@@ -0,0 +1,5 @@
+import sys
+
+from climb_scraper.cli import main
+
+sys.exit(main())
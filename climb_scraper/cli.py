@@ -0,0 +1,177 @@
+"""Command line entry point: climb-scraper scrape|discover|reparse|status|export|import-ids
+
+Only argparse is imported up front; each command imports what it needs when
+it runs, so `climb-scraper status`, which cron and health checks run all the
+time, never loads aiohttp, pandas, bs4 or requests.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+DEFAULT_DB = os.environ.get('CLIMB_SCRAPER_DB', 'climbing_data.db')
+
+
+def scrape(args) -> int:
+    from climb_scraper.scraper.route_scraper import main as scrape_main
+
+    try:
+        scrape_main(concurrency=args.concurrency, rate=args.rate, batch_size=args.batch_size,
+                    lease_seconds=args.lease_seconds, worker_id=args.worker_id,
+                    cache_dir=None if args.no_cache else args.cache_dir, parsers=args.parsers,
+                    max_rate=args.max_rate, metrics_port=args.metrics_port, metrics_file=args.metrics_file,
+                    db_path=args.db, ids_file=args.ids_file)
+    except KeyboardInterrupt:
+        print("Stopped")
+    return 0
+
+
+def discover(args) -> int:
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.scraper.fetcher import FetchEngine
+    from climb_scraper.scraper.list_builder import CragFinder
+
+    db = ClimbingDatabase(args.db, persistent=True)
+    engine = FetchEngine(concurrency=args.concurrency, rate=args.rate, max_rate=args.max_rate)
+    try:
+        finder = CragFinder(db, max_attempts=args.max_attempts, engine=engine, probe_width=args.concurrency,
+                            gap_budget=args.gap_budget)
+        finder.find_new_crags()
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        engine.stop()
+        db.disconnect()
+    return 0
+
+
+def reparse(args) -> int:
+    if not os.path.isdir(args.cache_dir):
+        print(f"No page cache at {args.cache_dir}", file=sys.stderr)
+        return 1
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.data.page_cache import PageCache
+    from climb_scraper.scraper.route_scraper import reparse_from_cache
+
+    db = ClimbingDatabase(args.db, persistent=True)
+    cache = PageCache(args.cache_dir)
+    try:
+        reparse_from_cache(db, cache)
+    finally:
+        cache.close()
+        db.disconnect()
+    return 0
+
+
+def status(args) -> int:
+    if not os.path.exists(args.db):
+        print(f"No database at {args.db}", file=sys.stderr)
+        return 1
+    from climb_scraper.data.database import ClimbingDatabase
+
+    # Read-only: no table creation or migrations, and no write lock, however often it runs
+    state = ClimbingDatabase(args.db, read_only=True).get_status()
+    if state is None:
+        return 1
+    if args.json:
+        import json
+        print(json.dumps(state, sort_keys=True))
+        return 0
+    total = state['processed'] + state['unprocessed']
+    print(f"Crag IDs:   {total} ({state['min_crag_id']} to {state['max_crag_id']})")
+    print(f"Processed:  {state['processed']}")
+    print(f"Remaining:  {state['unprocessed']} ({state['leased']} leased to workers)")
+    print(f"Crags:      {state['crags']}")
+    print(f"Climbs:     {state['climbs']}")
+    print(f"Last climb: {state['last_climb_added'] or 'never'}")
+    return 0
+
+
+def export(args) -> int:
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.data.export import export_climbs_parquet
+
+    db = ClimbingDatabase(args.db, persistent=True)
+    try:
+        rows = export_climbs_parquet(db, args.directory, chunk_size=args.chunk_size, incremental=not args.full)
+    finally:
+        db.disconnect()
+    return 0 if rows is not None else 1
+
+
+def import_ids(args) -> int:
+    from climb_scraper.data.database import ClimbingDatabase
+    from climb_scraper.scraper.scraper_functions import read_id_file
+
+    db = ClimbingDatabase(args.db, persistent=True)
+    try:
+        added = db.import_crag_ids(read_id_file(args.file), args.chunk_size)
+    except OSError as e:
+        print(f"Error importing IDs from file: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.disconnect()
+    if added is None:
+        return 1
+    print(f"Imported {added} new crag IDs from {args.file}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='climb-scraper', description='Scrape crags and climbs from UKC into SQLite')
+    parser.add_argument('--db', default=DEFAULT_DB,
+                        help='SQLite database path (default: $CLIMB_SCRAPER_DB or climbing_data.db)')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    command = commands.add_parser('scrape', help='scrape queued crags until stopped')
+    command.add_argument('--concurrency', type=int, default=4)
+    command.add_argument('--rate', type=float, default=0.5, help='starting requests/sec')
+    command.add_argument('--max-rate', type=float, default=4.0, help='requests/sec the rate may grow to')
+    command.add_argument('--batch-size', type=int, default=100)
+    command.add_argument('--lease-seconds', type=float, default=600)
+    command.add_argument('--worker-id', help='name for this worker\'s leases (default: host:pid)')
+    command.add_argument('--cache-dir', default='page_cache', help='where raw pages are kept')
+    command.add_argument('--no-cache', action='store_true', help='don\'t keep raw pages')
+    command.add_argument('--parsers', type=int, help='parser processes (default: CPU count)')
+    command.add_argument('--ids-file', default='crag_ids.txt', help='crag IDs to queue first, if the file exists')
+    command.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+    command.add_argument('--metrics-file', help='write a JSON metrics snapshot here every 30s')
+    command.set_defaults(handler=scrape)
+
+    command = commands.add_parser('discover', help='probe for crag IDs above and between the known ones')
+    command.add_argument('--concurrency', type=int, default=8, help='probes in flight')
+    command.add_argument('--rate', type=float, default=0.5, help='starting requests/sec')
+    command.add_argument('--max-rate', type=float, default=4.0)
+    command.add_argument('--max-attempts', type=int, default=50, help='misses in a row before giving up')
+    command.add_argument('--gap-budget', type=int, default=1000, help='IDs below the highest known to probe')
+    command.set_defaults(handler=discover)
+
+    command = commands.add_parser('reparse', help='rebuild climbs from the page cache, without fetching anything')
+    command.add_argument('--cache-dir', default='page_cache', help='where scrape kept the raw pages')
+    command.set_defaults(handler=reparse)
+
+    command = commands.add_parser('status', help='print queue and content counts')
+    command.add_argument('--json', action='store_true', help='one line of JSON, for health checks')
+    command.set_defaults(handler=status)
+
+    command = commands.add_parser('export', help='export climbs to a partitioned Parquet dataset')
+    command.add_argument('directory')
+    command.add_argument('--full', action='store_true', help='re-export everything, replacing the existing dataset')
+    command.add_argument('--chunk-size', type=int, default=50000)
+    command.set_defaults(handler=export)
+
+    command = commands.add_parser('import-ids', help='queue crag IDs and ranges listed in a text file')
+    command.add_argument('file')
+    command.add_argument('--chunk-size', type=int, default=10000)
+    command.set_defaults(handler=import_ids)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import sys
+import time
+
+from climb_scraper.data.database import ClimbingDatabase
+
+
+def rebuild(db: ClimbingDatabase) -> bool:
+    """Recompute every crag's grade summary from the climbs table"""
+    start = time.perf_counter()
+    rebuilt = db.rebuild_grade_aggregates()
+    if rebuilt:
+        print(f"Rebuilt grade aggregates in {time.perf_counter() - start:.2f}s")
+    return rebuilt
+
+
+def check(db: ClimbingDatabase) -> bool:
+    """Report crags whose grade summary no longer matches their climbs"""
+    mismatched = db.check_grade_aggregates()
+    if mismatched is None:
+        return False
+    if mismatched:
+        shown = ', '.join(map(str, mismatched[:20])) + (' ...' if len(mismatched) > 20 else '')
+        print(f"{len(mismatched)} crags have stale grade aggregates: {shown}")
+        print("Run the rebuild command to fix them")
+        return False
+    print("Grade aggregates match the climbs table")
+    return True
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild', 'check'):
+        print("Usage: python -m climb_scraper.data.aggregates rebuild|check [DATABASE]")
+        return
+    db = ClimbingDatabase(sys.argv[2] if len(sys.argv) > 2 else None, persistent=True)
+    try:
+        ok = rebuild(db) if sys.argv[1] == 'rebuild' else check(db)
+    finally:
+        db.disconnect()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,287 @@
+import itertools
+import json
 import sqlite3
+import time
+from contextlib import contextmanager
 from datetime import datetime
-import pandas as pd
-from typing import Optional, List, Tuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, List, Tuple, Union
+
+from climb_scraper.data.geo import bbox_boxes, crags_in_boxes, crags_within
+from climb_scraper.data.search import search_climbs, search_crags
+from climb_scraper.metrics import METRICS, timed
+
+if TYPE_CHECKING:
+    # Only needed for annotations; the scraper's hot loop never imports pandas
+    import pandas as pd
+
+
+CLIMB_COLUMNS = ['id', 'name', 'grade', 'techgrade', 'gradescore', 'gradetype']
+
+# Work-queue columns added to crag_ids after the first release
+CRAG_ID_WORK_COLUMNS = [
+    ('attempts', 'INTEGER DEFAULT 0'),
+    ('last_error', 'TEXT'),
+    ('lease_owner', 'TEXT'),
+    ('lease_expires', 'REAL'),
+]
+
+# Crag columns added after the first release
+CRAG_COLUMNS = [
+    ('region', 'TEXT'),
+]
+
+# The partial index only holds unprocessed rows, so queue lookups stay small as the
+# table fills up. Its WHERE clause must match the queries' "processed = FALSE".
+STATUS_TRACKING_SQL = [
+    '''
+    CREATE INDEX IF NOT EXISTS idx_crag_ids_unprocessed
+    ON crag_ids (crag_id, lease_expires) WHERE processed = FALSE
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crag_ids_count_insert AFTER INSERT ON crag_ids
+    BEGIN
+        UPDATE crag_id_counts
+        SET processed = processed + (NEW.processed = TRUE),
+            unprocessed = unprocessed + (NEW.processed = FALSE)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crag_ids_count_delete AFTER DELETE ON crag_ids
+    BEGIN
+        UPDATE crag_id_counts
+        SET processed = processed - (OLD.processed = TRUE),
+            unprocessed = unprocessed - (OLD.processed = FALSE)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crag_ids_count_update AFTER UPDATE OF processed ON crag_ids
+    WHEN OLD.processed IS NOT NEW.processed
+    BEGIN
+        UPDATE crag_id_counts
+        SET processed = processed + (NEW.processed = TRUE) - (OLD.processed = TRUE),
+            unprocessed = unprocessed + (NEW.processed = FALSE) - (OLD.processed = FALSE)
+        WHERE id = 1;
+    END
+    ''',
+]
+
+# Per-crag summaries of the climbs table, kept up to date by refresh_grade_aggregates.
+# NULL grades and grade types are stored as '' and -1 so they can be part of the key.
+GRADE_AGGREGATE_TABLES_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS crag_grade_counts (
+        crag_id INTEGER NOT NULL,
+        grade_type INTEGER NOT NULL,
+        grade TEXT NOT NULL,
+        climbs INTEGER NOT NULL,
+        PRIMARY KEY (crag_id, grade_type, grade)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS crag_grade_stats (
+        crag_id INTEGER NOT NULL,
+        grade_type INTEGER NOT NULL,
+        climbs INTEGER NOT NULL,
+        scored INTEGER NOT NULL,
+        score_sum REAL,
+        score_sq_sum REAL,
+        mean_score REAL,
+        score_variance REAL,
+        min_score REAL,
+        max_score REAL,
+        PRIMARY KEY (crag_id, grade_type)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Every crag whose climbs change gets a new sequence number, committed with the change, so
+# readers in other processes can tell which crags to drop from their caches
+CRAG_CHANGES_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS crag_changes (
+        crag_id INTEGER PRIMARY KEY,
+        change_seq INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_crag_changes_seq ON crag_changes (change_seq)
+    ''',
+]
+
+# Crag locations as points in an R-tree, kept in step with the crags table, so map and
+# nearby-crag queries read only the index pages around the area asked for
+SPATIAL_INDEX_SQL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS crags_rtree USING rtree (crag_id, min_lat, max_lat, min_lon, max_lon)
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_rtree_insert AFTER INSERT ON crags
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO crags_rtree VALUES (NEW.crag_id, NEW.latitude, NEW.latitude,
+                                                   NEW.longitude, NEW.longitude);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_rtree_update AFTER UPDATE OF latitude, longitude ON crags
+    WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+    BEGIN
+        DELETE FROM crags_rtree WHERE crag_id = OLD.crag_id;
+        INSERT INTO crags_rtree
+        SELECT NEW.crag_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_rtree_delete AFTER DELETE ON crags
+    BEGIN
+        DELETE FROM crags_rtree WHERE crag_id = OLD.crag_id;
+    END
+    ''',
+]
+
+# Full-text indexes over climb and crag names. They are external-content tables, so they
+# hold only the index and read names back from climbs and crags. A climb's crag_id is
+# indexed too, so a search within one crag intersects with that crag's short list of
+# routes instead of filtering every match. INSERT OR REPLACE on climbs deletes the old row
+# without firing DELETE triggers (recursive_triggers is off), so the BEFORE INSERT trigger
+# takes the old row out of the index first. Crags are written with an upsert, which fires
+# the UPDATE trigger instead, so they need no such trigger. Prefix indexes on 2 and 3
+# characters keep the first keystrokes of a typeahead from scanning the whole term list.
+NAME_SEARCH_SQL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS climbs_fts USING fts5 (
+        name, crag_id, content = 'climbs', content_rowid = 'climb_id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS climbs_fts_replace BEFORE INSERT ON climbs
+    BEGIN
+        INSERT INTO climbs_fts (climbs_fts, rowid, name, crag_id)
+        SELECT 'delete', climb_id, name, crag_id FROM climbs WHERE climb_id = NEW.climb_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS climbs_fts_insert AFTER INSERT ON climbs
+    BEGIN
+        INSERT INTO climbs_fts (rowid, name, crag_id) VALUES (NEW.climb_id, NEW.name, NEW.crag_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS climbs_fts_update AFTER UPDATE OF climb_id, name, crag_id ON climbs
+    BEGIN
+        INSERT INTO climbs_fts (climbs_fts, rowid, name, crag_id)
+        VALUES ('delete', OLD.climb_id, OLD.name, OLD.crag_id);
+        INSERT INTO climbs_fts (rowid, name, crag_id) VALUES (NEW.climb_id, NEW.name, NEW.crag_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS climbs_fts_delete AFTER DELETE ON climbs
+    BEGIN
+        INSERT INTO climbs_fts (climbs_fts, rowid, name, crag_id)
+        VALUES ('delete', OLD.climb_id, OLD.name, OLD.crag_id);
+    END
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS crags_fts USING fts5 (
+        name, content = 'crags', content_rowid = 'crag_id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_fts_insert AFTER INSERT ON crags WHEN NEW.name IS NOT NULL
+    BEGIN
+        INSERT INTO crags_fts (rowid, name) VALUES (NEW.crag_id, NEW.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_fts_update AFTER UPDATE OF crag_id, name ON crags
+    BEGIN
+        INSERT INTO crags_fts (crags_fts, rowid, name)
+        SELECT 'delete', OLD.crag_id, OLD.name WHERE OLD.name IS NOT NULL;
+        INSERT INTO crags_fts (rowid, name) SELECT NEW.crag_id, NEW.name WHERE NEW.name IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS crags_fts_delete AFTER DELETE ON crags WHEN OLD.name IS NOT NULL
+    BEGIN
+        INSERT INTO crags_fts (crags_fts, rowid, name) VALUES ('delete', OLD.crag_id, OLD.name);
+    END
+    ''',
+]
+
+# Logged in crag_changes when every crag changed at once
+ALL_CRAGS = -1
+
+# {where} narrows the climbs scanned; empty for a full rebuild
+GRADE_COUNTS_SELECT = '''
+SELECT crag_id, COALESCE(grade_type, -1), COALESCE(grade, ''), COUNT(*)
+FROM climbs {where}
+GROUP BY crag_id, COALESCE(grade_type, -1), COALESCE(grade, '')
+'''
+
+# Population variance from the running sums; MAX(.., 0) absorbs rounding below zero
+GRADE_STATS_SELECT = '''
+SELECT crag_id, COALESCE(grade_type, -1), COUNT(*), COUNT(grade_score),
+       SUM(grade_score), SUM(grade_score * grade_score), AVG(grade_score),
+       MAX(SUM(grade_score * grade_score) / COUNT(grade_score) - AVG(grade_score) * AVG(grade_score), 0),
+       MIN(grade_score), MAX(grade_score)
+FROM climbs {where}
+GROUP BY crag_id, COALESCE(grade_type, -1)
+'''
+
+CRAG_LIST_FILTER = 'WHERE crag_id IN (SELECT value FROM json_each(?))'
+
+INSERT_CLIMB_SQL = '''
+INSERT OR REPLACE INTO climbs
+(climb_id, crag_id, name, grade, tech_grade, grade_score, grade_type)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def climb_rows(climbs: Union['pd.DataFrame', list], crag_id: int) -> Iterator[tuple]:
+    """Yield climbs insert parameters from a dataframe, a list of climb dicts or a list of records
+
+    Records are anything with an as_row(crag_id) method, such as ClimbRecord.
+    """
+    if isinstance(climbs, list):
+        if climbs and not isinstance(climbs[0], dict):
+            for record in climbs:
+                yield record.as_row(crag_id)
+            return
+        for climb in climbs:
+            yield (climb['id'], crag_id, climb['name'], climb['grade'], climb['techgrade'],
+                   climb['gradescore'], climb['gradetype'])
+        return
+
+    missing_columns = [col for col in CLIMB_COLUMNS if col not in climbs.columns]
+    if missing_columns:
+        raise KeyError(f"Missing climb columns {missing_columns}, have {list(climbs.columns)}")
+    # A column of whole numbers with gaps is held as floats, which would store grade 5 as '5.0';
+    # convert_dtypes gives the ints back, and the gaps are bound as NULL like a record's None
+    climbs = climbs[CLIMB_COLUMNS].convert_dtypes()
+    # tolist() hands back plain Python values, which sqlite3 can bind without per-row conversion
+    ids, names, grades, tech_grades, scores, grade_types = (
+        climbs[col].astype(object).where(climbs[col].notna(), None).tolist() for col in CLIMB_COLUMNS)
+    yield from zip(ids, itertools.repeat(crag_id), names, grades, tech_grades, scores, grade_types)
 
 
 class ClimbingDatabase:
-    def __init__(self, db_path: str = None):
-        """Initialize database connection and create tables if they don't exist"""
+    def __init__(self, db_path: str = None, persistent: bool = False, synchronous: str = 'NORMAL',
+                 cache_size: int = -20000, busy_timeout: float = 30.0, read_only: bool = False):
+        """Initialize database connection and create tables if they don't exist
+
+        With persistent=True one connection is kept open for the life of the object,
+        in WAL mode with the given synchronous and cache_size pragmas, instead of
+        opening and closing a connection around every call. busy_timeout is how
+        many seconds a write waits for another worker's lock before failing.
+        With read_only=True the database is opened with mode=ro and the tables
+        are taken as they are, so nothing takes the write lock or migrates them.
+        """
         if db_path is None:
             import os
             # Get the project root directory
@@ -14,21 +289,125 @@ class ClimbingDatabase:
             self.db_path = os.path.join(project_root, "climbing_data.db")
         else:
             self.db_path = db_path
+        self.persistent = persistent
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.read_only = read_only
         self.conn = None
-        self.create_tables()
+        self._transaction_depth = 0
+        # Callbacks waiting on each open transaction level, run once the outermost one commits
+        self._on_commit: List[List[Callable[[], None]]] = []
+        if not read_only:
+            self.create_tables()
+
     def connect(self):
-        """Create a database connection"""
+        """Create a database connection, or reuse the open one"""
+        if self.conn is not None and (self.persistent or self._transaction_depth):
+            return self.conn
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            if self.read_only:
+                # As ReadOnlyPool opens them: a status check must never write, or wait on a writer
+                uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+                self.conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout,
+                                            check_same_thread=not self.persistent)
+                self.conn.execute("PRAGMA query_only = ON")
+                return self.conn
+            # A larger statement cache keeps the hot INSERT/UPDATE statements prepared
+            self.conn = sqlite3.connect(self.db_path, cached_statements=256, timeout=self.busy_timeout,
+                                        check_same_thread=not self.persistent)
+            if self.persistent:
+                self.conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+                self.conn.execute("PRAGMA journal_mode = WAL")
+                self.conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+                self.conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
             return self.conn
         except sqlite3.Error as e:
             print(f"Error connecting to database: {e}")
             return None
 
     def close(self):
-        """Close the database connection"""
+        """Close the database connection unless it is being kept open"""
+        if self.conn and not self.persistent and not self._transaction_depth:
+            self.conn.close()
+            self.conn = None
+
+    def disconnect(self):
+        """Close the database connection, including a persistent one"""
         if self.conn:
             self.conn.close()
+            self.conn = None
+
+    def commit(self):
+        """Commit the current statement unless it is part of a larger transaction"""
+        if self.conn and not self._transaction_depth:
+            self.conn.commit()
+
+    def rollback(self):
+        """Undo a failed call's uncommitted writes unless it is part of a larger transaction
+
+        Inside transaction() the failure is the caller's to handle: store_crag
+        raises so its savepoint is rolled back as a whole.
+        """
+        if self.conn and not self._transaction_depth:
+            try:
+                self.conn.rollback()
+            except sqlite3.Error as e:
+                print(f"Error rolling back: {e}")
+            self.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group several calls into one unit of work that is committed or rolled back together
+
+        Nested blocks become savepoints, so one failed crag can be rolled back
+        without losing the rest of a batch.
+        """
+        conn = self.connect()
+        savepoint = f"unit_of_work_{self._transaction_depth}"
+        if self._transaction_depth:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        else:
+            conn.commit()
+            # IMMEDIATE takes the write lock up front, waiting up to busy_timeout for it. A deferred
+            # BEGIN that reads first fails outright when another worker has committed in between.
+            conn.execute("BEGIN IMMEDIATE")
+        self._transaction_depth += 1
+        self._on_commit.append([])
+        try:
+            yield conn
+        except BaseException:
+            self._transaction_depth -= 1
+            self._on_commit.pop()
+            if self._transaction_depth:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                conn.rollback()
+                self.close()
+            raise
+        self._transaction_depth -= 1
+        callbacks = self._on_commit.pop()
+        if self._transaction_depth:
+            conn.execute(f"RELEASE {savepoint}")
+            self._on_commit[-1].extend(callbacks)
+        else:
+            with METRICS.timer('db.commit'):
+                conn.commit()
+            self.close()
+            for callback in callbacks:
+                callback()
+
+    def on_commit(self, callback: Callable[[], None]):
+        """Run a callback once the current unit of work commits, or now if there isn't one
+
+        The callback is dropped if the transaction, or the savepoint it was
+        registered in, is rolled back instead.
+        """
+        if self._transaction_depth:
+            self._on_commit[-1].append(callback)
+        else:
+            callback()
 
     def create_tables(self):
         """Create the necessary tables if they don't exist"""
@@ -38,7 +417,11 @@ class ClimbingDatabase:
             crag_id INTEGER PRIMARY KEY,
             processed BOOLEAN DEFAULT FALSE,
             date_added DATETIME DEFAULT CURRENT_TIMESTAMP,
-            date_processed DATETIME
+            date_processed DATETIME,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            lease_owner TEXT,
+            lease_expires REAL
         );
 
         -- Crags table
@@ -47,6 +430,7 @@ class ClimbingDatabase:
             name TEXT,
             latitude REAL,
             longitude REAL,
+            region TEXT,
             date_added DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (crag_id) REFERENCES crag_ids (crag_id)
         );
@@ -63,6 +447,43 @@ class ClimbingDatabase:
             date_added DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (crag_id) REFERENCES crags (crag_id)
         );
+
+        -- Grades table, shared by every crag
+        CREATE TABLE IF NOT EXISTS grades (
+            grade_id INTEGER PRIMARY KEY,
+            grade_system INTEGER,
+            name TEXT,
+            score REAL,
+            color TEXT,
+            alt_id INTEGER,
+            alt_name TEXT
+        );
+
+        -- Recrawl schedule, one row per scraped crag
+        CREATE TABLE IF NOT EXISTS crawl_schedule (
+            crag_id INTEGER PRIMARY KEY,
+            content_hash TEXT,
+            interval_seconds REAL NOT NULL,
+            next_due REAL NOT NULL,
+            crawls INTEGER DEFAULT 0,
+            changes INTEGER DEFAULT 0,
+            last_crawled REAL,
+            FOREIGN KEY (crag_id) REFERENCES crag_ids (crag_id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_crawl_schedule_next_due ON crawl_schedule (next_due);
+
+        -- Probe history for the whole crag ID space, one row per 65536 IDs
+        CREATE TABLE IF NOT EXISTS id_space (
+            chunk INTEGER PRIMARY KEY,
+            probed BLOB NOT NULL,
+            valid BLOB NOT NULL,
+            probed_day BLOB NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_climbs_crag_id ON climbs (crag_id);
+
+        CREATE INDEX IF NOT EXISTS idx_climbs_date_added ON climbs (date_added);
         '''
 
         try:
@@ -72,14 +493,94 @@ class ClimbingDatabase:
                 for command in create_tables_sql.split(';'):
                     if command.strip():
                         conn.execute(command)
-                conn.commit()
+                self._add_missing_columns(conn, 'crag_ids', CRAG_ID_WORK_COLUMNS)
+                self._add_missing_columns(conn, 'crags', CRAG_COLUMNS)
+                self._create_status_tracking(conn)
+                self._create_grade_aggregates(conn)
+                self._create_spatial_index(conn)
+                self._create_name_search(conn)
+                self.commit()
                 self.close()
         except sqlite3.Error as e:
             print(f"Error creating tables: {e}")
+            self.rollback()
+
+
+    def _add_missing_columns(self, conn, table: str, columns: List[Tuple[str, str]]):
+        """Bring a table created by an older version up to date"""
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def _create_status_tracking(self, conn):
+        """Create the unprocessed-ID index and the trigger-maintained status counters"""
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS crag_id_counts (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            processed INTEGER NOT NULL DEFAULT 0,
+            unprocessed INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        if conn.execute("SELECT 1 FROM crag_id_counts WHERE id = 1").fetchone() is None:
+            # Seed from a one-off scan; the triggers keep the counts current from here on
+            conn.execute('''
+            INSERT INTO crag_id_counts (id, processed, unprocessed)
+            SELECT 1,
+                   COALESCE(SUM(CASE WHEN processed = TRUE THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN processed = FALSE THEN 1 ELSE 0 END), 0)
+            FROM crag_ids
+            ''')
+        for statement in STATUS_TRACKING_SQL:
+            conn.execute(statement)
+
+    def _create_grade_aggregates(self, conn):
+        """Create the per-crag grade summary tables, filling them if climbs already exist"""
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crag_grade_stats'").fetchone()
+        for statement in GRADE_AGGREGATE_TABLES_SQL + CRAG_CHANGES_SQL:
+            conn.execute(statement)
+        if not existed:
+            self._refresh_grade_aggregates(conn)
 
+    def _create_spatial_index(self, conn):
+        """Create the crag R-tree and its triggers, indexing any crags that already have coordinates"""
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'crags_rtree'").fetchone()
+        for statement in SPATIAL_INDEX_SQL:
+            conn.execute(statement)
+        if not existed:
+            conn.execute('''
+            INSERT INTO crags_rtree
+            SELECT crag_id, latitude, latitude, longitude, longitude FROM crags
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            ''')
 
+    def _create_name_search(self, conn):
+        """Create the name search indexes and their triggers, indexing any names already stored"""
+        existed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'climbs_fts'").fetchone()
+        for statement in NAME_SEARCH_SQL:
+            conn.execute(statement)
+        if not existed:
+            # crag_id only narrows a search to one crag, so it mustn't count towards the rank
+            conn.execute("INSERT INTO climbs_fts (climbs_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+            conn.execute("INSERT INTO climbs_fts (climbs_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO crags_fts (crags_fts) VALUES ('rebuild')")
+
+    @timed('db.add_crag_ids')
     def add_crag_ids(self, start_id: int, end_id: int) -> bool:
         """Add a range of crag IDs to be processed"""
+        return self.import_crag_ids(range(start_id, end_id + 1)) is not None
+
+    @timed('db.import_crag_ids')
+    def import_crag_ids(self, crag_ids: Iterable[int], chunk_size: int = 10000) -> Optional[int]:
+        """Stream crag IDs into the queue, committing every chunk_size IDs
+
+        The IDs are never all held in memory, so a generator over a large file
+        or a wide range costs one chunk. Returns the number of new IDs added, or
+        None on error.
+        """
         try:
             conn = self.connect()
             if conn:
@@ -87,15 +588,69 @@ class ClimbingDatabase:
                 INSERT OR IGNORE INTO crag_ids (crag_id, processed)
                 VALUES (?, FALSE)
                 '''
-                ids = [(i,) for i in range(start_id, end_id + 1)]
-                conn.executemany(sql, ids)
-                conn.commit()
+                rows = ((crag_id,) for crag_id in crag_ids)
+                added = 0
+                while True:
+                    chunk = list(itertools.islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    # rowcount leaves out the status-count trigger writes that total_changes would include
+                    added += conn.executemany(sql, chunk).rowcount
+                    self.commit()
+                self.close()
+                return added
+        except sqlite3.Error as e:
+            print(f"Error adding crag IDs: {e}")
+            self.rollback()
+            return None
+
+    @timed('db.add_crag_id_list')
+    def add_crag_id_list(self, crag_ids: Iterable[int]) -> bool:
+        """Add specific crag IDs to be processed"""
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                INSERT OR IGNORE INTO crag_ids (crag_id, processed)
+                VALUES (?, FALSE)
+                '''
+                conn.executemany(sql, ((crag_id,) for crag_id in crag_ids))
+                self.commit()
                 self.close()
                 return True
         except sqlite3.Error as e:
             print(f"Error adding crag IDs: {e}")
+            self.rollback()
             return False
 
+    def get_all_crag_ids(self) -> List[int]:
+        """Get every crag ID in the queue, processed or not"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT crag_id FROM crag_ids ORDER BY crag_id")
+                result = [row[0] for row in cursor.fetchall()]
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting crag IDs: {e}")
+            self.rollback()
+            return []
+
+    def get_stored_crag_ids(self) -> List[int]:
+        """Get the ID of every crag that has been scraped into the crags table"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = [row[0] for row in conn.execute("SELECT crag_id FROM crags ORDER BY crag_id")]
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting stored crag IDs: {e}")
+            self.rollback()
+            return []
+
     def get_next_unprocessed_crag_id(self) -> Optional[int]:
         """Get the next crag ID that hasn't been processed yet"""
         try:
@@ -114,98 +669,667 @@ class ClimbingDatabase:
                 return result[0] if result else None
         except sqlite3.Error as e:
             print(f"Error getting next crag ID: {e}")
+            self.rollback()
             return None
 
+    @timed('db.get_unprocessed_crag_ids')
+    def get_unprocessed_crag_ids(self, limit: int) -> List[int]:
+        """Get up to `limit` crag IDs that haven't been processed yet"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT crag_id
+                    FROM crag_ids
+                    WHERE processed = FALSE
+                    ORDER BY crag_id
+                    LIMIT ?
+                """, (limit,))
+                result = [row[0] for row in cursor.fetchall()]
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting unprocessed crag IDs: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.mark_crag_processed')
     def mark_crag_processed(self, crag_id: int, success: bool = True) -> bool:
         """Mark a crag ID as processed"""
         try:
             conn = self.connect()
             if conn:
                 sql = '''
-                UPDATE crag_ids 
-                SET processed = ?, date_processed = CURRENT_TIMESTAMP
+                UPDATE crag_ids
+                SET processed = ?, date_processed = CURRENT_TIMESTAMP,
+                    lease_owner = NULL, lease_expires = NULL
                 WHERE crag_id = ?
                 '''
                 conn.execute(sql, (success, crag_id))
-                conn.commit()
+                self.commit()
                 self.close()
                 return True
         except sqlite3.Error as e:
             print(f"Error marking crag as processed: {e}")
+            self.rollback()
             return False
 
+    @timed('db.claim_batch')
+    def claim_batch(self, n: int, worker_id: str, lease_seconds: float = 600) -> Optional[List[int]]:
+        """Lease up to n unprocessed crag IDs to a worker
+
+        IDs leased to another worker are skipped until their lease expires, so
+        several scraper processes can share one database without duplicate work.
+        Returns None if the claim failed, which is not the same as an empty lease.
+        """
+        try:
+            conn = self.connect()
+            if conn:
+                now = time.time()
+                sql = '''
+                UPDATE crag_ids
+                SET lease_owner = ?, lease_expires = ?
+                WHERE crag_id IN (
+                    SELECT crag_id
+                    FROM crag_ids
+                    WHERE processed = FALSE
+                      AND (lease_expires IS NULL OR lease_expires < ?)
+                    ORDER BY crag_id
+                    LIMIT ?
+                )
+                RETURNING crag_id
+                '''
+                # A single UPDATE takes the write lock, so two workers can never claim the same ID
+                claimed = sorted(row[0] for row in conn.execute(sql, (worker_id, now + lease_seconds, now, n)))
+                self.commit()
+                self.close()
+                return claimed
+        except sqlite3.Error as e:
+            print(f"Error claiming crag IDs: {e}")
+            self.rollback()
+            return None
+
+    @timed('db.record_failure')
+    def record_failure(self, crag_id: int, error: str, max_attempts: int = 3) -> Optional[int]:
+        """Count a failed attempt at a crag and release its lease
+
+        Once a crag reaches max_attempts it is marked processed so it is not claimed
+        again. Returns the attempt count so far.
+        """
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                UPDATE crag_ids
+                SET attempts = attempts + 1,
+                    last_error = ?,
+                    lease_owner = NULL,
+                    lease_expires = NULL,
+                    processed = attempts + 1 >= ?,
+                    date_processed = CASE WHEN attempts + 1 >= ? THEN CURRENT_TIMESTAMP ELSE date_processed END
+                WHERE crag_id = ?
+                RETURNING attempts
+                '''
+                result = conn.execute(sql, (error, max_attempts, max_attempts, crag_id)).fetchone()
+                self.commit()
+                self.close()
+                return result[0] if result else None
+        except sqlite3.Error as e:
+            print(f"Error recording failure for crag {crag_id}: {e}")
+            self.rollback()
+            return None
+
+    def release_leases(self, worker_id: str) -> bool:
+        """Hand back every unfinished crag ID leased to a worker"""
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                UPDATE crag_ids
+                SET lease_owner = NULL, lease_expires = NULL
+                WHERE lease_owner = ? AND processed = FALSE
+                '''
+                conn.execute(sql, (worker_id,))
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error releasing leases for {worker_id}: {e}")
+            self.rollback()
+            return False
+
+    @timed('db.get_processing_stats')
     def get_processing_stats(self) -> Tuple[int, int]:
         """Get counts of processed and unprocessed crags"""
         try:
             conn = self.connect()
             if conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT 
-                        SUM(CASE WHEN processed = TRUE THEN 1 ELSE 0 END) as processed,
-                        SUM(CASE WHEN processed = FALSE THEN 1 ELSE 0 END) as unprocessed
-                    FROM crag_ids
-                """)
+                cursor.execute("SELECT processed, unprocessed FROM crag_id_counts WHERE id = 1")
                 result = cursor.fetchone()
                 self.close()
                 return result if result else (0, 0)
         except sqlite3.Error as e:
             print(f"Error getting processing stats: {e}")
+            self.rollback()
             return (0, 0)
 
-    def insert_crag(self, crag_id: int, name: Optional[str] = None,
-                    latitude: Optional[float] = None, longitude: Optional[float] = None) -> bool:
-        """Insert a new crag into the database"""
+    @timed('db.insert_crag')
+    def insert_crag(self, crag_id: int, name: Optional[str] = None, latitude: Optional[float] = None,
+                    longitude: Optional[float] = None, region: Optional[str] = None) -> bool:
+        """Insert a crag, or update its details; values not given keep what is stored"""
         try:
             conn = self.connect()
             if conn:
                 sql = '''
-                INSERT OR IGNORE INTO crags (crag_id, name, latitude, longitude)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO crags (crag_id, name, latitude, longitude, region)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (crag_id) DO UPDATE SET
+                    name = COALESCE(excluded.name, name),
+                    latitude = COALESCE(excluded.latitude, latitude),
+                    longitude = COALESCE(excluded.longitude, longitude),
+                    region = COALESCE(excluded.region, region)
+                WHERE excluded.name IS NOT NULL AND excluded.name IS NOT name
+                   OR excluded.latitude IS NOT NULL AND excluded.latitude IS NOT latitude
+                   OR excluded.longitude IS NOT NULL AND excluded.longitude IS NOT longitude
+                   OR excluded.region IS NOT NULL AND excluded.region IS NOT region
                 '''
-                conn.execute(sql, (crag_id, name, latitude, longitude))
-                conn.commit()
+                if conn.execute(sql, (crag_id, name, latitude, longitude, region)).rowcount:
+                    self._log_crag_changes(conn, [crag_id])
+                self.commit()
                 self.close()
                 return True
         except sqlite3.Error as e:
             print(f"Error inserting crag: {e}")
+            self.rollback()
             return False
 
-    def insert_climbs(self, climbs_df: pd.DataFrame, crag_id: int) -> bool:
-        """Insert climbs from a dataframe into the database"""
+    @timed('db.insert_climbs')
+    def insert_climbs(self, climbs: Union['pd.DataFrame', list], crag_id: int) -> bool:
+        """Insert climbs from a dataframe, the parsed climbs JSON list or ClimbRecords into the database"""
+        return self.insert_climbs_batch([(crag_id, climbs)])
+
+    @timed('db.insert_climbs_batch')
+    def insert_climbs_batch(self, crag_climbs: Iterable[Tuple[int, Union['pd.DataFrame', list]]]) -> bool:
+        """Insert the climbs for several crags in one statement stream"""
         try:
             conn = self.connect()
             if conn:
-                # Prepare the data for insertion
-                climbs_data = []
-                for _, row in climbs_df.iterrows():
-                    climb_data = (
-                        row['id'],  # climb_id from the original data
-                        crag_id,
-                        row['name'],  # climb name from the original data
-                        row['grade'],
-                        row['techgrade'],
-                        row['gradescore'],
-                        row['gradetype']
-                    )
-                    climbs_data.append(climb_data)
+                crag_climbs = list(crag_climbs)
+                climbs_data = list(itertools.chain.from_iterable(
+                    climb_rows(climbs, crag_id) for crag_id, climbs in crag_climbs))
+                # A climb replaced under another crag leaves its old crag's summary to refresh too
+                moved_from = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT crag_id FROM climbs WHERE climb_id IN (SELECT value FROM json_each(?))",
+                    (json.dumps([row[0] for row in climbs_data]),))]
+                conn.executemany(INSERT_CLIMB_SQL, climbs_data)
+                self._refresh_grade_aggregates(conn, [crag_id for crag_id, _ in crag_climbs] + moved_from)
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error inserting climbs: {e}")
+            self.rollback()
+            return False
+        except Exception as e:
+            print(f"Error processing climb data: {e}")
+            self.rollback()
+            return False
 
-                # Insert the data
+    @timed('db.insert_grades')
+    def insert_grades(self, grades: List[dict]) -> bool:
+        """Insert flattened grade records, keeping any already stored"""
+        try:
+            conn = self.connect()
+            if conn:
                 sql = '''
-                INSERT OR REPLACE INTO climbs 
-                (climb_id, crag_id, name, grade, tech_grade, grade_score, grade_type)
+                INSERT OR IGNORE INTO grades (grade_id, grade_system, name, score, color, alt_id, alt_name)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
                 '''
-                conn.executemany(sql, climbs_data)
-                conn.commit()
+                conn.executemany(sql, ((grade['id'], grade.get('gradesystem'), grade.get('name'), grade.get('score'),
+                                        grade.get('gradecolor'), grade.get('alt_id'), grade.get('alt_name'))
+                                       for grade in grades))
+                self.commit()
                 self.close()
                 return True
         except sqlite3.Error as e:
-            print(f"Error inserting climbs: {e}")
+            print(f"Error inserting grades: {e}")
+            self.rollback()
             return False
-        except Exception as e:
-            print(f"Error processing climb data: {e}")
-            print("DataFrame columns:", climbs_df.columns)
+
+    def get_grades(self) -> List[tuple]:
+        """Get every stored grade as (grade_id, grade_system, name, score, color, alt_id, alt_name)"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT grade_id, grade_system, name, score, color, alt_id, alt_name
+                    FROM grades
+                """)
+                result = cursor.fetchall()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting grades: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.get_crawl_state')
+    def get_crawl_state(self, crag_id: int) -> Optional[Tuple[Optional[str], float, int, int]]:
+        """Get a crag's last content hash, recrawl interval, crawl count and change count"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT content_hash, interval_seconds, crawls, changes
+                    FROM crawl_schedule
+                    WHERE crag_id = ?
+                """, (crag_id,))
+                result = cursor.fetchone()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting crawl state for crag {crag_id}: {e}")
+            self.rollback()
+            return None
+
+    @timed('db.save_crawl_state')
+    def save_crawl_state(self, crag_id: int, content_hash: Optional[str], interval_seconds: float,
+                         next_due: float, crawls: int, changes: int) -> bool:
+        """Record the outcome of a crawl and when the crag is next due"""
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                INSERT OR REPLACE INTO crawl_schedule
+                (crag_id, content_hash, interval_seconds, next_due, crawls, changes, last_crawled)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                '''
+                conn.execute(sql, (crag_id, content_hash, interval_seconds, next_due, crawls, changes, time.time()))
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error saving crawl state for crag {crag_id}: {e}")
+            self.rollback()
+            return False
+
+    @timed('db.get_due_crags')
+    def get_due_crags(self, now: float, limit: int) -> List[Tuple[float, int]]:
+        """Get up to `limit` (next_due, crag_id) pairs that are due by `now`, soonest first"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT next_due, crag_id
+                    FROM crawl_schedule
+                    WHERE next_due <= ?
+                    ORDER BY next_due
+                    LIMIT ?
+                """, (now, limit))
+                result = cursor.fetchall()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting due crags: {e}")
+            self.rollback()
+            return []
+
+    def schedule_unscheduled_crags(self, interval_seconds: float) -> bool:
+        """Give crags scraped before scheduling existed a schedule row, spread over one interval"""
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                INSERT OR IGNORE INTO crawl_schedule (crag_id, interval_seconds, next_due)
+                SELECT crag_id, ?, ? + ? * (ABS(RANDOM()) % 1000) / 1000.0
+                FROM crags
+                '''
+                conn.execute(sql, (interval_seconds, time.time(), interval_seconds))
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error scheduling crags: {e}")
+            self.rollback()
+            return False
+
+    def get_id_space_chunks(self) -> List[Tuple[int, bytes, bytes, bytes]]:
+        """Get every persisted ID-space chunk as (chunk, probed, valid, probed_day) blobs"""
+        try:
+            conn = self.connect()
+            if conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT chunk, probed, valid, probed_day FROM id_space ORDER BY chunk")
+                result = cursor.fetchall()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting ID space: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.save_id_space_chunks')
+    def save_id_space_chunks(self, chunks: Iterable[Tuple[int, bytes, bytes, bytes]]) -> bool:
+        """Store ID-space chunks, replacing any saved before"""
+        try:
+            conn = self.connect()
+            if conn:
+                sql = '''
+                INSERT OR REPLACE INTO id_space (chunk, probed, valid, probed_day)
+                VALUES (?, ?, ?, ?)
+                '''
+                conn.executemany(sql, chunks)
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error saving ID space: {e}")
+            self.rollback()
+            return False
+
+    def iter_climb_export_rows(self, since_seq: Optional[int] = None, until_seq: Optional[int] = None,
+                               chunk_size: int = 50000) -> Iterator[List[tuple]]:
+        """Yield climbs joined with their crag, chunk_size rows at a time
+
+        With since_seq, only climbs of crags whose latest crag_changes sequence
+        number is above it, and at most until_seq, are included; a logged
+        ALL_CRAGS change in that range includes every climb. A changed crag
+        left with no climbs gets one row with only its crag columns set. Rows
+        are (climb_id, crag_id, name, grade, tech_grade, grade_score,
+        grade_type, date_added, crag_name, latitude, longitude, region).
+
+        Read errors are raised, so a caller can't take a partial export for a
+        whole one.
+        """
+        conn = self.connect()
+        if conn is None:
+            return
+        select = '''
+        SELECT c.climb_id, {crag_id}, c.name, c.grade, c.tech_grade, c.grade_score, c.grade_type,
+               c.date_added, cr.name, cr.latitude, cr.longitude, cr.region
+        '''
+        try:
+            everything = since_seq is None or conn.execute(
+                "SELECT 1 FROM crag_changes WHERE crag_id = ? AND change_seq > ? AND change_seq <= ?",
+                (ALL_CRAGS, since_seq, until_seq)).fetchone() is not None
+            if everything:
+                cursor = conn.execute(select.format(crag_id='c.crag_id') + '''
+                FROM climbs c
+                LEFT JOIN crags cr ON cr.crag_id = c.crag_id
+                ''')
+            else:
+                # Changed crags come off idx_crag_changes_seq, and their climbs off idx_climbs_crag_id
+                cursor = conn.execute(select.format(crag_id='ch.crag_id') + '''
+                FROM crag_changes ch
+                LEFT JOIN climbs c ON c.crag_id = ch.crag_id
+                LEFT JOIN crags cr ON cr.crag_id = ch.crag_id
+                WHERE ch.change_seq > ? AND ch.change_seq <= ?
+                ''', (since_seq, until_seq))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        except sqlite3.Error as e:
+            print(f"Error reading climbs for export: {e}")
+            raise
+        finally:
+            self.close()
+
+    def get_change_seq(self) -> Optional[int]:
+        """The latest committed crag_changes sequence number, 0 if nothing has been logged"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = conn.execute("SELECT COALESCE(MAX(change_seq), 0) FROM crag_changes").fetchone()[0]
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error reading the change sequence: {e}")
+            self.rollback()
+            return None
+
+    def _refresh_grade_aggregates(self, conn, crag_ids: Optional[Iterable[int]] = None):
+        """Recompute the grade summaries for some crags, or all of them, on an open connection"""
+        if crag_ids is None:
+            conn.execute("DELETE FROM crag_grade_counts")
+            conn.execute("DELETE FROM crag_grade_stats")
+            params = ()
+            where = ''
+        else:
+            crag_ids = sorted(set(crag_ids))
+            params = (json.dumps(crag_ids),)
+            where = CRAG_LIST_FILTER
+            conn.execute(f"DELETE FROM crag_grade_counts {where}", params)
+            conn.execute(f"DELETE FROM crag_grade_stats {where}", params)
+        # Each crag's climbs come straight off idx_climbs_crag_id, so the cost follows the crags changed
+        conn.execute("INSERT INTO crag_grade_counts (crag_id, grade_type, grade, climbs) "
+                     + GRADE_COUNTS_SELECT.format(where=where), params)
+        conn.execute('''
+        INSERT INTO crag_grade_stats (crag_id, grade_type, climbs, scored, score_sum, score_sq_sum,
+                                      mean_score, score_variance, min_score, max_score)
+        ''' + GRADE_STATS_SELECT.format(where=where), params)
+        self._log_crag_changes(conn, crag_ids)
+
+    def _log_crag_changes(self, conn, crag_ids: Optional[Iterable[int]] = None):
+        """Give the changed crags, or ALL_CRAGS, a new change sequence number"""
+        crag_ids = [ALL_CRAGS] if crag_ids is None else sorted(set(crag_ids))
+        conn.execute('''
+        INSERT OR REPLACE INTO crag_changes (crag_id, change_seq)
+        SELECT value, (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM crag_changes)
+        FROM json_each(?)
+        ''', (json.dumps(crag_ids),))
+
+    @timed('db.rebuild_grade_aggregates')
+    def rebuild_grade_aggregates(self) -> bool:
+        """Recompute the per-crag grade summaries from the whole climbs table"""
+        try:
+            conn = self.connect()
+            if conn:
+                self._refresh_grade_aggregates(conn)
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error rebuilding grade aggregates: {e}")
+            self.rollback()
+            return False
+
+    def check_grade_aggregates(self) -> Optional[List[int]]:
+        """Compare the grade summaries with the climbs table and return the crags that disagree"""
+        def close(column: str) -> str:
+            # Sums taken in a different order can differ in the last bits
+            return f"(s.{column} IS m.{column} OR ABS(s.{column} - m.{column}) <= 1e-6 * MAX(1.0, ABS(s.{column})))"
+
+        try:
+            conn = self.connect()
+            if conn:
+                sql = f'''
+                WITH computed_counts (crag_id, grade_type, grade, climbs) AS (
+                    {GRADE_COUNTS_SELECT.format(where='')}
+                ),
+                computed_stats (crag_id, grade_type, climbs, scored, score_sum, score_sq_sum,
+                                mean_score, score_variance, min_score, max_score) AS (
+                    {GRADE_STATS_SELECT.format(where='')}
+                )
+                SELECT crag_id FROM (
+                    SELECT * FROM computed_counts
+                    EXCEPT SELECT crag_id, grade_type, grade, climbs FROM crag_grade_counts
+                )
+                UNION SELECT crag_id FROM (
+                    SELECT crag_id, grade_type, grade, climbs FROM crag_grade_counts
+                    EXCEPT SELECT * FROM computed_counts
+                )
+                UNION SELECT s.crag_id
+                FROM computed_stats s LEFT JOIN crag_grade_stats m USING (crag_id, grade_type)
+                WHERE m.crag_id IS NULL OR s.climbs != m.climbs OR s.scored != m.scored
+                   OR s.min_score IS NOT m.min_score OR s.max_score IS NOT m.max_score
+                   OR NOT {close('score_sum')} OR NOT {close('score_sq_sum')}
+                   OR NOT {close('mean_score')} OR NOT {close('score_variance')}
+                UNION SELECT m.crag_id
+                FROM crag_grade_stats m LEFT JOIN computed_stats s USING (crag_id, grade_type)
+                WHERE s.crag_id IS NULL
+                '''
+                result = sorted(row[0] for row in conn.execute(sql))
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error checking grade aggregates: {e}")
+            self.rollback()
+            return None
+
+    def get_crags_in_bbox(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float,
+                          limit: Optional[int] = None) -> List[Tuple[int, Optional[str], float, float]]:
+        """(crag_id, name, latitude, longitude) for crags in a map viewport
+
+        A viewport with min_lon > max_lon spans the antimeridian.
+        """
+        try:
+            conn = self.connect()
+            if conn:
+                result = crags_in_boxes(conn, bbox_boxes(min_lat, max_lat, min_lon, max_lon), limit)
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting crags in bounding box: {e}")
+            self.rollback()
+            return []
+
+    def get_crags_within_km(self, latitude: float, longitude: float, km: float,
+                            limit: Optional[int] = None) -> List[Tuple[int, Optional[str], float, float, float]]:
+        """(crag_id, name, latitude, longitude, distance_km) for crags within km of a point, nearest first"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = crags_within(conn, latitude, longitude, km, limit)
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting crags within {km} km: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.search_climbs')
+    def search_climbs(self, text: str, limit: int = 10,
+                      crag_id: Optional[int] = None) -> List[Tuple[int, int, str, Optional[str], Optional[str]]]:
+        """Best matching climbs for a typeahead, the last word taken as a prefix
+
+        Returns (climb_id, crag_id, name, grade, crag name) rows, best first.
+        """
+        try:
+            conn = self.connect()
+            if conn:
+                result = search_climbs(conn, text, limit, crag_id)
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error searching climbs: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.search_crags')
+    def search_crags(self, text: str, limit: int = 10) -> List[Tuple[int, str, Optional[float], Optional[float]]]:
+        """Best matching crags for a typeahead as (crag_id, name, latitude, longitude) rows"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = search_crags(conn, text, limit)
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error searching crags: {e}")
+            self.rollback()
+            return []
+
+    def rebuild_name_search(self) -> bool:
+        """Rebuild both name search indexes from the climbs and crags tables"""
+        try:
+            conn = self.connect()
+            if conn:
+                conn.execute("INSERT INTO climbs_fts (climbs_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO crags_fts (crags_fts) VALUES ('rebuild')")
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error rebuilding name search: {e}")
+            self.rollback()
+            return False
+
+    def check_name_search(self) -> bool:
+        """Whether both name search indexes match the tables they cover"""
+        conn = self.connect()
+        if conn is None:
+            return False
+        try:
+            conn.execute("INSERT INTO climbs_fts (climbs_fts, rank) VALUES ('integrity-check', 1)")
+            conn.execute("INSERT INTO crags_fts (crags_fts, rank) VALUES ('integrity-check', 1)")
+            return True
+        except sqlite3.DatabaseError as e:
+            print(f"Name search index is out of step: {e}")
+            return False
+        finally:
+            # The checks are INSERTs, so they opened a write transaction; it changed nothing
+            if not self._transaction_depth:
+                conn.rollback()
+            self.close()
+
+    def get_crag_grade_counts(self, crag_id: int) -> List[Tuple[int, str, int]]:
+        """(grade_type, grade, climbs) for a crag from the grade summary"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = conn.execute('''
+                SELECT grade_type, grade, climbs FROM crag_grade_counts WHERE crag_id = ?
+                ORDER BY grade_type, grade
+                ''', (crag_id,)).fetchall()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting grade counts for crag {crag_id}: {e}")
+            self.rollback()
+            return []
+
+    def get_crag_grade_stats(self, crag_id: int) -> List[tuple]:
+        """(grade_type, climbs, mean_score, score_variance, min_score, max_score) for a crag"""
+        try:
+            conn = self.connect()
+            if conn:
+                result = conn.execute('''
+                SELECT grade_type, climbs, mean_score, score_variance, min_score, max_score
+                FROM crag_grade_stats WHERE crag_id = ?
+                ORDER BY grade_type
+                ''', (crag_id,)).fetchall()
+                self.close()
+                return result
+        except sqlite3.Error as e:
+            print(f"Error getting grade stats for crag {crag_id}: {e}")
+            self.rollback()
+            return []
+
+    @timed('db.clear_climbs')
+    def clear_climbs(self, crag_id: Optional[int] = None) -> bool:
+        """Delete the stored climbs for one crag, or every climb when no crag is given"""
+        try:
+            conn = self.connect()
+            if conn:
+                if crag_id is None:
+                    conn.execute("DELETE FROM climbs")
+                    self._refresh_grade_aggregates(conn)
+                else:
+                    conn.execute("DELETE FROM climbs WHERE crag_id = ?", (crag_id,))
+                    self._refresh_grade_aggregates(conn, [crag_id])
+                self.commit()
+                self.close()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error clearing climbs: {e}")
+            self.rollback()
             return False
 
     def reset_crag_ids(self, start_id: int) -> bool:
@@ -216,7 +1340,11 @@ class ClimbingDatabase:
                 # First, delete all records from dependent tables due to foreign key constraints
                 conn.execute("DELETE FROM climbs")
                 conn.execute("DELETE FROM crags")
+                conn.execute("DELETE FROM crawl_schedule")
+                conn.execute("DELETE FROM id_space")
                 conn.execute("DELETE FROM crag_ids")
+                # Empties the grade summaries and logs ALL_CRAGS, so cached crag queries are dropped too
+                self._refresh_grade_aggregates(conn)
 
                 # Then add the new starting range (e.g., from 200 to 200 + 50)
                 sql = '''
@@ -227,14 +1355,43 @@ class ClimbingDatabase:
                 ids = [(i,) for i in range(start_id, start_id + 50)]
                 conn.executemany(sql, ids)
 
-                conn.commit()
+                self.commit()
                 self.close()
                 print(f"Database reset successfully. Starting from ID {start_id}")
                 return True
         except sqlite3.Error as e:
             print(f"Error resetting database: {e}")
+            self.rollback()
             return False
 
+    def get_status(self) -> Optional[dict]:
+        """Queue, lease and content counts for status checks, all from counters and indexes
+
+        Nothing here scans crag_ids or climbs, so it stays fast however large
+        they grow.
+        """
+        try:
+            conn = self.connect()
+            if conn:
+                processed, unprocessed = conn.execute(
+                    "SELECT processed, unprocessed FROM crag_id_counts WHERE id = 1").fetchone() or (0, 0)
+                min_id, max_id = conn.execute("SELECT MIN(crag_id), MAX(crag_id) FROM crag_ids").fetchone()
+                # Unprocessed rows only, which the partial index holds
+                leased = conn.execute('''
+                SELECT COUNT(*) FROM crag_ids WHERE processed = FALSE AND lease_expires >= ?
+                ''', (time.time(),)).fetchone()[0]
+                crags = conn.execute("SELECT COUNT(*) FROM crags").fetchone()[0]
+                climbs = conn.execute("SELECT COALESCE(SUM(climbs), 0) FROM crag_grade_stats").fetchone()[0]
+                last_climb_added = conn.execute("SELECT MAX(date_added) FROM climbs").fetchone()[0]
+                self.close()
+                return {'processed': processed, 'unprocessed': unprocessed, 'leased': leased,
+                        'min_crag_id': min_id, 'max_crag_id': max_id, 'crags': crags, 'climbs': climbs,
+                        'last_climb_added': last_climb_added}
+        except sqlite3.Error as e:
+            print(f"Error getting status: {e}")
+            self.rollback()
+            return None
+
     def verify_database_state(self):
         """Print current database state"""
         try:
@@ -243,12 +1400,11 @@ class ClimbingDatabase:
                 cursor = conn.cursor()
 
                 # Get counts
-                cursor.execute("SELECT COUNT(*) FROM crag_ids")
-                total_ids = cursor.fetchone()[0]
-
-                cursor.execute("SELECT COUNT(*) FROM crag_ids WHERE processed = 1")
-                processed = cursor.fetchone()[0]
+                cursor.execute("SELECT processed, unprocessed FROM crag_id_counts WHERE id = 1")
+                processed, unprocessed = cursor.fetchone()
+                total_ids = processed + unprocessed
 
+                # MIN and MAX are single primary-key lookups
                 cursor.execute("SELECT MIN(crag_id), MAX(crag_id) FROM crag_ids")
                 min_max = cursor.fetchone()
 
@@ -262,3 +1418,4 @@ class ClimbingDatabase:
                 self.close()
         except Exception as e:
             print(f"Error verifying database state: {e}")
+            self.rollback()
@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.geo import region_for
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+WATERMARK_FILE = '_export_watermark.json'
+UNKNOWN_PARTITION = 'unknown'
+
+# Column order matches ClimbingDatabase.iter_climb_export_rows; grade_type and region become directories
+EXPORT_COLUMNS = ['climb_id', 'crag_id', 'name', 'grade', 'tech_grade', 'grade_score', 'grade_type',
+                  'date_added', 'crag_name', 'latitude', 'longitude', 'region']
+PARTITION_COLUMNS = ('grade_type', 'region')
+# Written alongside them: the change sequence number the exporting run read up to
+SEQUENCE_COLUMN = 'export_seq'
+
+
+def export_schema() -> 'pa.Schema':
+    return pa.schema([
+        ('climb_id', pa.int64()),
+        ('crag_id', pa.int64()),
+        ('name', pa.string()),
+        ('grade', pa.string()),
+        ('tech_grade', pa.string()),
+        ('grade_score', pa.float64()),
+        ('date_added', pa.string()),
+        ('crag_name', pa.string()),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        (SEQUENCE_COLUMN, pa.int64()),
+    ])
+
+
+def partition_path(grade_type, region) -> str:
+    """Hive-style directory for a partition, e.g. grade_type=2/region=Peak%20District"""
+    grade_type = UNKNOWN_PARTITION if grade_type is None else grade_type
+    region = quote(region, safe='') if region else UNKNOWN_PARTITION
+    return os.path.join(f'grade_type={grade_type}', f'region={region}')
+
+
+def read_watermark(directory: str) -> Optional[int]:
+    try:
+        with open(os.path.join(directory, WATERMARK_FILE)) as f:
+            return json.load(f).get('change_seq')
+    except (OSError, ValueError):
+        return None
+
+
+def replace_dataset(directory: str, staging: str):
+    """Swap the partitions written to staging in for the ones in directory"""
+    for entry in os.listdir(directory):
+        if entry.startswith('grade_type='):
+            shutil.rmtree(os.path.join(directory, entry))
+    for entry in os.listdir(staging):
+        os.replace(os.path.join(staging, entry), os.path.join(directory, entry))
+    os.rmdir(staging)
+
+
+def write_watermark(directory: str, change_seq: int, rows: int):
+    path = os.path.join(directory, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'change_seq': change_seq, 'rows': rows, 'exported_at': time.time()}, f)
+    os.replace(path + '.tmp', path)
+
+
+def export_climbs_parquet(db: ClimbingDatabase, directory: str, chunk_size: int = 50000,
+                          incremental: bool = True) -> Optional[int]:
+    """Stream climbs joined with their crags into a partitioned Parquet dataset
+
+    Files are laid out as grade_type=<n>/region=<name>/part-<uuid>.parquet, one
+    row group per chunk, so memory stays at about one chunk whatever the table
+    size. Crags stored without a region are placed by their coordinates.
+    Incremental runs only append the climbs of crags changed since the last
+    run, going by the crag_changes sequence numbers. Those are handed out
+    under the write lock, so they follow commit order and a slow transaction
+    can't slip in behind the watermark. Each run writes every climb of each
+    crag it includes, stamped with the sequence number it read up to in
+    export_seq, and a crag left with no climbs gets a single row with a null
+    climb_id. So for each crag_id only the rows with the highest export_seq
+    are current: older rows are climbs since changed, moved or removed. A
+    full run writes a fresh dataset beside the old one and swaps it in once
+    complete.
+
+    If reading the database fails, the files this run wrote are removed and
+    neither the dataset nor the watermark moves on. Returns the number of
+    rows written, or None if the export failed or pyarrow isn't installed.
+    """
+    if pa is None:
+        print("Parquet export needs the pyarrow package: pip install pyarrow")
+        return None
+    os.makedirs(directory, exist_ok=True)
+    since = read_watermark(directory) if incremental else None
+    # Changes committed after this are numbered above it and go in the next run
+    until = db.get_change_seq()
+    if until is None:
+        return None
+    schema = export_schema()
+    # Unique per run, so two runs can never write to the same file
+    part_name = f"part-{uuid.uuid4().hex}.parquet"
+    # Readers skip directories starting with an underscore, so a half-written full export stays hidden
+    target = directory if incremental else os.path.join(directory, f"_full-{uuid.uuid4().hex}")
+    data_indexes = [EXPORT_COLUMNS.index(name) for name in schema.names if name != SEQUENCE_COLUMN]
+    grade_type_index, region_index = (EXPORT_COLUMNS.index(name) for name in PARTITION_COLUMNS)
+    latitude_index, longitude_index = EXPORT_COLUMNS.index('latitude'), EXPORT_COLUMNS.index('longitude')
+    writers: Dict[Tuple, 'pq.ParquetWriter'] = {}
+    rows_written = 0
+    complete = False
+    try:
+        for rows in db.iter_climb_export_rows(since, until, chunk_size):
+            partitions: Dict[Tuple, list] = {}
+            for row in rows:
+                region = row[region_index] or region_for(row[latitude_index], row[longitude_index])
+                partitions.setdefault((row[grade_type_index], region), []).append(row)
+            for key, partition_rows in partitions.items():
+                writer = writers.get(key)
+                if writer is None:
+                    path = os.path.join(target, partition_path(*key))
+                    os.makedirs(path, exist_ok=True)
+                    writer = writers[key] = pq.ParquetWriter(os.path.join(path, part_name), schema)
+                columns = [[row[i] for row in partition_rows] for i in data_indexes]
+                columns.append([until] * len(partition_rows))
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            rows_written += len(rows)
+        complete = True
+    except sqlite3.Error:
+        return None
+    finally:
+        for writer in writers.values():
+            writer.close()
+        if not complete:
+            if incremental:
+                for key in writers:
+                    os.remove(os.path.join(target, partition_path(*key), part_name))
+            else:
+                shutil.rmtree(target, ignore_errors=True)
+    if not incremental:
+        os.makedirs(target, exist_ok=True)
+        replace_dataset(directory, target)
+    write_watermark(directory, until, rows_written)
+    print(f"Exported {rows_written} climbs to {directory} in {len(writers)} partitions"
+          + (f" (changed since change {since})" if since is not None else ""))
+    return rows_written
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python -m climb_scraper.data.export DATABASE DIRECTORY [--full]")
+        return
+    db = ClimbingDatabase(sys.argv[1], persistent=True)
+    try:
+        export_climbs_parquet(db, sys.argv[2], incremental='--full' not in sys.argv[3:])
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import math
+from typing import List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# (min_lat, max_lat, min_lon, max_lon), the column order of crags_rtree
+BoundingBox = Tuple[float, float, float, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km between two points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(latitude: float, longitude: float, km: float) -> List[BoundingBox]:
+    """Boxes that together cover every point within km of (latitude, longitude)
+
+    Usually one box; two when the circle crosses the antimeridian. Near the
+    poles the box widens to every longitude.
+    """
+    lat_delta = km / KM_PER_DEGREE
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    # The circle is widest in longitude at the latitude furthest from the equator
+    widest = max(abs(min_lat), abs(max_lat))
+    lon_delta = lat_delta / math.cos(math.radians(widest))
+    if lon_delta >= 180:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+# Crag pages don't name their area in a form the parser can rely on, so the region is derived from the
+# coordinates: the main climbing areas as rough boxes (min_lat, max_lat, min_lon, max_lon), checked in order
+# so the smaller areas win over the larger ones around them
+REGIONS: List[Tuple[str, BoundingBox]] = [
+    ('Peak District', (52.95, 53.60, -2.10, -1.45)),
+    ('Lake District', (54.20, 54.75, -3.55, -2.70)),
+    ('Yorkshire', (53.60, 54.60, -2.60, -0.40)),
+    ('Northumberland', (54.75, 55.80, -2.70, -1.40)),
+    ('North Wales', (52.70, 53.45, -4.80, -3.20)),
+    ('South Wales', (51.35, 52.10, -5.40, -2.65)),
+    ('Cornwall', (49.90, 50.95, -5.80, -4.15)),
+    ('South West', (50.20, 51.60, -4.15, -1.90)),
+    ('South East', (50.70, 52.00, -1.90, 1.80)),
+    ('Scotland', (54.60, 61.00, -8.00, -0.50)),
+    ('Ireland', (51.40, 55.45, -10.70, -5.40)),
+]
+
+
+def region_for(latitude: Optional[float], longitude: Optional[float]) -> Optional[str]:
+    """The climbing area a point falls in, else its one-degree grid cell such as '45N_6E'"""
+    if latitude is None or longitude is None:
+        return None
+    for name, (min_lat, max_lat, min_lon, max_lon) in REGIONS:
+        if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+            return name
+    lat, lon = math.floor(latitude), math.floor(longitude)
+    return f"{abs(lat)}{'N' if lat >= 0 else 'S'}_{abs(lon)}{'E' if lon >= 0 else 'W'}"
+
+
+# Candidates come off the R-tree, whose 32-bit float boxes are rounded outwards, so the
+# stored coordinates are checked again on the crags row
+CRAGS_IN_BOX_SQL = '''
+SELECT c.crag_id, c.name, c.latitude, c.longitude
+FROM crags_rtree r JOIN crags c ON c.crag_id = r.crag_id
+WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+  AND c.latitude BETWEEN ? AND ? AND c.longitude BETWEEN ? AND ?
+'''
+
+
+def crags_in_boxes(conn, boxes: List[BoundingBox], limit: Optional[int] = None) -> List[tuple]:
+    """(crag_id, name, latitude, longitude) for crags inside any of the boxes, via the R-tree"""
+    rows = []
+    for min_lat, max_lat, min_lon, max_lon in boxes:
+        sql, params = CRAGS_IN_BOX_SQL, [min_lat, max_lat, min_lon, max_lon] * 2
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit - len(rows))
+        rows += conn.execute(sql, params).fetchall()
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+def bbox_boxes(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[BoundingBox]:
+    """A map viewport as R-tree boxes; min_lon > max_lon means it spans the antimeridian"""
+    if min_lon > max_lon:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def crags_within(conn, latitude: float, longitude: float, km: float,
+                 limit: Optional[int] = None) -> List[tuple]:
+    """(crag_id, name, latitude, longitude, distance_km) for crags within km, nearest first
+
+    The R-tree narrows the search to the bounding box, and only the crags in it
+    get an exact great-circle distance.
+    """
+    nearby = []
+    for crag_id, name, crag_lat, crag_lon in crags_in_boxes(conn, bounding_boxes(latitude, longitude, km)):
+        distance = haversine_km(latitude, longitude, crag_lat, crag_lon)
+        if distance <= km:
+            nearby.append((crag_id, name, crag_lat, crag_lon, distance))
+    nearby.sort(key=lambda row: row[4])
+    return nearby if limit is None else nearby[:limit]
@@ -0,0 +1,238 @@
+import re
+import sys
+import time
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from climb_scraper.data.database import ClimbingDatabase
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_BYTES = CHUNK_SIZE // 8
+DAY = 24 * 60 * 60
+
+# A byte that still has a clear bit, or one with any bit set; the regex engine skips the rest in C
+_NOT_FULL = re.compile(b'[^\xff]')
+_NOT_EMPTY = re.compile(b'[^\x00]')
+
+
+def today() -> int:
+    """Days since the Unix epoch, the unit probe dates are kept in"""
+    return int(time.time() // DAY)
+
+
+class IdChunk:
+    """Probe state for CHUNK_SIZE consecutive crag IDs.
+
+    Two bitmaps, probed and valid, with bit n of byte n // 8 for the nth ID,
+    plus the day each ID was last probed as an unsigned 16-bit array. A probed
+    ID without its valid bit is a known miss.
+    """
+    __slots__ = ('probed', 'valid', 'probed_day')
+
+    def __init__(self, probed: Optional[bytearray] = None, valid: Optional[bytearray] = None,
+                 probed_day: Optional[array] = None):
+        self.probed = probed if probed is not None else bytearray(CHUNK_BYTES)
+        self.valid = valid if valid is not None else bytearray(CHUNK_BYTES)
+        self.probed_day = probed_day if probed_day is not None else array('H', bytes(CHUNK_SIZE * 2))
+
+    def to_blobs(self) -> Tuple[bytes, bytes, bytes]:
+        days = array('H', self.probed_day)
+        if sys.byteorder == 'big':
+            days.byteswap()
+        return zlib.compress(bytes(self.probed)), zlib.compress(bytes(self.valid)), zlib.compress(days.tobytes())
+
+    @classmethod
+    def from_blobs(cls, probed: bytes, valid: bytes, probed_day: bytes) -> 'IdChunk':
+        days = array('H', zlib.decompress(probed_day))
+        if sys.byteorder == 'big':
+            days.byteswap()
+        return cls(bytearray(zlib.decompress(probed)), bytearray(zlib.decompress(valid)), days)
+
+
+def _first_clear(bitmap: bytearray, offset: int) -> Optional[int]:
+    """First clear bit at or after offset, or None"""
+    index, bit = offset >> 3, offset & 7
+    if index >= len(bitmap):
+        return None
+    # Rest of the starting byte, with the bits below offset treated as set
+    partial = ~(bitmap[index] | ((1 << bit) - 1)) & 0xff
+    if partial:
+        return (index << 3) + ((partial & -partial).bit_length() - 1)
+    match = _NOT_FULL.search(bitmap, index + 1)
+    if match is None:
+        return None
+    index = match.start()
+    free = ~bitmap[index] & 0xff
+    return (index << 3) + ((free & -free).bit_length() - 1)
+
+
+def _first_set(bitmap: bytearray, offset: int) -> Optional[int]:
+    """First set bit at or after offset, or None"""
+    index, bit = offset >> 3, offset & 7
+    if index >= len(bitmap):
+        return None
+    partial = bitmap[index] & ~((1 << bit) - 1) & 0xff
+    if partial:
+        return (index << 3) + ((partial & -partial).bit_length() - 1)
+    match = _NOT_EMPTY.search(bitmap, index + 1)
+    if match is None:
+        return None
+    index = match.start()
+    value = bitmap[index]
+    return (index << 3) + ((value & -value).bit_length() - 1)
+
+
+class IdSpaceMap:
+    """What is known about every crag ID, persisted in the id_space table.
+
+    The ID space is split into chunks of 65536 IDs, created only once an ID in
+    them is probed, so a few million IDs cost a few hundred KiB. Lookups are
+    O(1) and the scans behind next_unprobed and unprobed_ranges skip whole
+    bytes of the bitmaps at a time.
+    """
+
+    def __init__(self):
+        self.chunks: Dict[int, IdChunk] = {}
+        self.dirty: Set[int] = set()
+
+    @classmethod
+    def load(cls, db: ClimbingDatabase) -> 'IdSpaceMap':
+        """Read the map from the database, seeding it from the crags table the first time"""
+        id_space = cls()
+        rows = db.get_id_space_chunks()
+        for chunk, probed, valid, probed_day in rows:
+            id_space.chunks[chunk] = IdChunk.from_blobs(probed, valid, probed_day)
+        if not rows:
+            # Only scraped crags are known to be valid; queued IDs may come from an unprobed
+            # min..max range, so they are left unprobed
+            day = today()
+            for crag_id in db.get_stored_crag_ids():
+                id_space.mark(crag_id, True, day)
+            id_space.save(db)
+        return id_space
+
+    def save(self, db: ClimbingDatabase) -> bool:
+        """Write the chunks changed since the last save"""
+        if not self.dirty:
+            return True
+        saved = db.save_id_space_chunks((chunk, *self.chunks[chunk].to_blobs()) for chunk in sorted(self.dirty))
+        if saved:
+            self.dirty.clear()
+        return saved
+
+    def mark(self, crag_id: int, valid: bool, day: Optional[int] = None):
+        """Record a probe of crag_id and whether it found a crag"""
+        key, offset = crag_id >> CHUNK_BITS, crag_id & (CHUNK_SIZE - 1)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = IdChunk()
+        index, mask = offset >> 3, 1 << (offset & 7)
+        chunk.probed[index] |= mask
+        if valid:
+            chunk.valid[index] |= mask
+        else:
+            chunk.valid[index] &= ~mask
+        chunk.probed_day[offset] = today() if day is None else day
+        self.dirty.add(key)
+
+    def state(self, crag_id: int) -> Optional[bool]:
+        """True for a known crag, False for a known miss, None if never probed"""
+        chunk = self.chunks.get(crag_id >> CHUNK_BITS)
+        if chunk is None:
+            return None
+        offset = crag_id & (CHUNK_SIZE - 1)
+        index, mask = offset >> 3, 1 << (offset & 7)
+        if not chunk.probed[index] & mask:
+            return None
+        return bool(chunk.valid[index] & mask)
+
+    def probed_day(self, crag_id: int) -> Optional[int]:
+        if self.state(crag_id) is None:
+            return None
+        return self.chunks[crag_id >> CHUNK_BITS].probed_day[crag_id & (CHUNK_SIZE - 1)]
+
+    def next_unprobed(self, start: int = 1) -> int:
+        """The first ID at or after start that has never been probed"""
+        key = start >> CHUNK_BITS
+        offset = start & (CHUNK_SIZE - 1)
+        while True:
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                return (key << CHUNK_BITS) + offset
+            found = _first_clear(chunk.probed, offset)
+            if found is not None:
+                return (key << CHUNK_BITS) + found
+            key, offset = key + 1, 0
+
+    def next_probed(self, start: int, end: int) -> Optional[int]:
+        """The first probed ID in [start, end], or None"""
+        key = start >> CHUNK_BITS
+        offset = start & (CHUNK_SIZE - 1)
+        while (key << CHUNK_BITS) <= end:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                found = _first_set(chunk.probed, offset)
+                if found is not None:
+                    crag_id = (key << CHUNK_BITS) + found
+                    return crag_id if crag_id <= end else None
+            key, offset = key + 1, 0
+        return None
+
+    def unprobed_ranges(self, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Inclusive (first, last) runs of never-probed IDs within [start, end]"""
+        position = start
+        while position <= end:
+            first = self.next_unprobed(position)
+            if first > end:
+                return
+            probed = self.next_probed(first, end)
+            last = end if probed is None else probed - 1
+            yield first, last
+            position = last + 1
+
+    def stale_negatives(self, older_than: float, start: int = 0, end: Optional[int] = None,
+                        limit: Optional[int] = None, now: Optional[float] = None) -> List[int]:
+        """Known misses in [start, end] last probed more than older_than seconds ago"""
+        cutoff = int(((time.time() if now is None else now) - older_than) // DAY)
+        stale = []
+        for key in sorted(self.chunks):
+            base = key << CHUNK_BITS
+            if base + CHUNK_SIZE <= start or (end is not None and base > end):
+                continue
+            chunk = self.chunks[key]
+            # Whole-chunk bitmap arithmetic leaves only the misses, and the regex skips bytes without any
+            misses = (int.from_bytes(chunk.probed, 'little') & ~int.from_bytes(chunk.valid, 'little')
+                      ).to_bytes(CHUNK_BYTES, 'little')
+            days = chunk.probed_day
+            first = max(start - base, 0)
+            for match in _NOT_EMPTY.finditer(misses, first >> 3):
+                index = match.start()
+                value = misses[index]
+                while value:
+                    lowest = value & -value
+                    value ^= lowest
+                    offset = (index << 3) + lowest.bit_length() - 1
+                    if offset < first or days[offset] >= cutoff:
+                        continue
+                    if end is not None and base + offset > end:
+                        return stale
+                    stale.append(base + offset)
+                    if limit is not None and len(stale) >= limit:
+                        return stale
+        return stale
+
+    def max_probed(self) -> Optional[int]:
+        """The highest ID ever probed, or None"""
+        for key in sorted(self.chunks, reverse=True):
+            probed = bytes(self.chunks[key].probed).rstrip(b'\x00')
+            if probed:
+                return (key << CHUNK_BITS) + ((len(probed) - 1) << 3) + probed[-1].bit_length() - 1
+        return None
+
+    def counts(self) -> Tuple[int, int]:
+        """(probed, valid) ID counts"""
+        probed = sum(int.from_bytes(chunk.probed, 'little').bit_count() for chunk in self.chunks.values())
+        valid = sum(int.from_bytes(chunk.valid, 'little').bit_count() for chunk in self.chunks.values())
+        return probed, valid
@@ -0,0 +1,175 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+@dataclass
+class CachedPage:
+    """A raw crag page read back from the cache"""
+    crag_id: int
+    body: bytes
+    digest: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class PageCache:
+    """Content-addressed store of compressed raw crag pages.
+
+    Bodies live under objects/ named by their sha256, compressed with zstd when
+    the zstandard package is installed and gzip otherwise. A small SQLite index
+    maps each crag ID to its current body plus the ETag/Last-Modified needed to
+    revalidate it. When the stored bytes pass max_bytes the least recently used
+    crags are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 ** 3, compression: Optional[str] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression = compression or ('zstd' if zstandard is not None else 'gzip')
+        if self.compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            crag_id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_last_access ON pages (last_access)")
+        self.conn.commit()
+        # Running total so put() doesn't have to sum the index every time
+        self._total = self.total_bytes()
+
+    def _object_path(self, digest: str) -> str:
+        extension = 'zst' if self.compression == 'zstd' else 'gz'
+        return os.path.join('objects', digest[:2], f"{digest}.{extension}")
+
+    def _compress(self, body: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=6).compress(body)
+        return gzip.compress(body, compresslevel=6)
+
+    @staticmethod
+    def _decompress(path: str, data: bytes) -> bytes:
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise ValueError(f"{path} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def put(self, crag_id: int, body: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> str:
+        """Store a page body for a crag and return its digest"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        full_path = os.path.join(self.directory, path)
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                # Write then rename so a crash never leaves a truncated object behind
+                with open(full_path + '.tmp', 'wb') as f:
+                    f.write(self._compress(body))
+                os.replace(full_path + '.tmp', full_path)
+                self._total += os.path.getsize(full_path)
+            previous = self.conn.execute("SELECT path, size FROM pages WHERE crag_id = ?", (crag_id,)).fetchone()
+            self.conn.execute('''
+            INSERT OR REPLACE INTO pages (crag_id, digest, path, size, etag, last_modified, fetched_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (crag_id, digest, path, os.path.getsize(full_path), etag, last_modified, now, now))
+            self.conn.commit()
+            if previous and previous[0] != path:
+                self._remove_unreferenced(*previous)
+        if self._total > self.max_bytes:
+            self.evict()
+        return digest
+
+    def get(self, crag_id: int, touch: bool = True) -> Optional[CachedPage]:
+        """Read a crag's cached page, or None if it isn't cached"""
+        with self._lock:
+            row = self.conn.execute('''
+            SELECT digest, path, etag, last_modified, fetched_at FROM pages WHERE crag_id = ?
+            ''', (crag_id,)).fetchone()
+            if row is None:
+                return None
+            if touch:
+                self.conn.execute("UPDATE pages SET last_access = ? WHERE crag_id = ?", (time.time(), crag_id))
+                self.conn.commit()
+        digest, path, etag, last_modified, fetched_at = row
+        try:
+            with open(os.path.join(self.directory, path), 'rb') as f:
+                body = self._decompress(path, f.read())
+        except (OSError, ValueError) as e:
+            print(f"Error reading cached page for crag {crag_id}: {e}")
+            return None
+        return CachedPage(crag_id, body, digest, etag, last_modified, fetched_at)
+
+    def validators(self, crag_id: int) -> Dict[str, str]:
+        """Conditional request headers for revalidating a crag's cached page"""
+        with self._lock:
+            row = self.conn.execute("SELECT etag, last_modified FROM pages WHERE crag_id = ?",
+                                    (crag_id,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def crag_ids(self) -> List[int]:
+        """All crag IDs with a cached page"""
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT crag_id FROM pages ORDER BY crag_id")]
+
+    def total_bytes(self) -> int:
+        """Compressed bytes held by the cache, counting shared bodies once"""
+        with self._lock:
+            result = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT path, size FROM pages)").fetchone()
+        return result[0]
+
+    def _remove_unreferenced(self, path: str, size: int):
+        """Delete a body file once no crag points at it; the caller holds the lock"""
+        if self.conn.execute("SELECT 1 FROM pages WHERE path = ? LIMIT 1", (path,)).fetchone() is not None:
+            return
+        try:
+            os.remove(os.path.join(self.directory, path))
+            self._total -= size
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Drop least recently used crags until the cache fits in max_bytes"""
+        with self._lock:
+            rows = self.conn.execute("SELECT crag_id, path, size FROM pages ORDER BY last_access")
+            for crag_id, path, size in rows.fetchall():
+                if self._total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM pages WHERE crag_id = ?", (crag_id,))
+                self._remove_unreferenced(path, size)
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
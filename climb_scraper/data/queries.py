@@ -0,0 +1,308 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from climb_scraper.data.database import ALL_CRAGS
+from climb_scraper.data.geo import bbox_boxes, crags_in_boxes, crags_within
+from climb_scraper.data.search import search_climbs, search_crags
+from climb_scraper.metrics import METRICS
+
+_MISSING = object()
+
+
+class ReadOnlyPool:
+    """A fixed set of read-only SQLite connections shared between threads.
+
+    Connections are opened with mode=ro and query_only, so nothing done through
+    them can write to the scraper's database, and with mmap_size set so hot
+    pages are read straight from the OS page cache. In WAL mode readers never
+    block the scraper's writes, or the other way round.
+    """
+
+    def __init__(self, db_path: str, size: int = 4, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -8000, timeout: float = 5.0):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._idle: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        for _ in range(size):
+            conn = self._open()
+            self._all.append(conn)
+            self._idle.put(conn)
+
+    def _open(self) -> sqlite3.Connection:
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=64)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one to come free if they are all in use"""
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+        self._all.clear()
+
+
+class QueryCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    Every entry is filed under the crag it describes, so the entries for one
+    crag can be dropped without touching the rest.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Hashable, Tuple[float, int, Any]]' = OrderedDict()
+        self._by_crag: Dict[int, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation, so a result read before one isn't cached after it
+        self.generation = 0
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Any:
+        """The cached value, or _MISSING if absent or expired"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._discard(key)
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, crag_id: int, value: Any, generation: Optional[int] = None,
+            now: Optional[float] = None):
+        """Cache value, unless generation is given and an invalidation has happened since"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (now + self.ttl, crag_id, value)
+            self._by_crag.setdefault(crag_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: Hashable):
+        _, crag_id, _ = self._entries.pop(key)
+        keys = self._by_crag.get(crag_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_crag[crag_id]
+
+    def invalidate(self, crag_ids: Iterable[int]) -> int:
+        """Drop every entry for the given crags; returns the number dropped"""
+        dropped = 0
+        with self._lock:
+            self.generation += 1
+            for crag_id in crag_ids:
+                for key in self._by_crag.pop(crag_id, ()):
+                    self._entries.pop(key, None)
+                    dropped += 1
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_crag.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class CragQueries:
+    """Cached read-only queries behind the website's crag pages.
+
+    Results come from the pooled read-only connections and are cached per
+    crag. The scraper logs every crag it changes in crag_changes within the
+    same transaction, so before answering, at most once per poll_interval, the
+    cache checks PRAGMA data_version for commits from other connections and,
+    if there were any, drops the entries of just the crags they touched. That
+    works whether the scraper runs in this process or another one; the TTL is
+    only a backstop. Pass poll_interval=0 to check on every call.
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, cache_entries: int = 4096, ttl: float = 300.0,
+                 poll_interval: float = 0.5, mmap_size: int = 256 * 1024 * 1024):
+        self.pool = ReadOnlyPool(db_path, size=pool_size, mmap_size=mmap_size)
+        self.cache = QueryCache(cache_entries, ttl)
+        self.poll_interval = poll_interval
+        # data_version is per connection, so one connection of our own watches for commits
+        self._watch = self.pool._open()
+        self._watch_lock = threading.Lock()
+        self._data_version = self._read_data_version()
+        self._last_poll = time.monotonic()
+        self._change_seq = self._watch.execute(
+            "SELECT COALESCE(MAX(change_seq), 0) FROM crag_changes").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self._watch.close()
+
+    def _read_data_version(self) -> int:
+        return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def sync(self) -> int:
+        """Drop cache entries for crags changed since the last check; returns the crags seen"""
+        with self._watch_lock:
+            self._last_poll = time.monotonic()
+            version = self._read_data_version()
+            if version == self._data_version:
+                return 0
+            self._data_version = version
+            changed = self._watch.execute(
+                "SELECT crag_id, change_seq FROM crag_changes WHERE change_seq > ? ORDER BY change_seq",
+                (self._change_seq,)).fetchall()
+            if not changed:
+                return 0
+            self._change_seq = changed[-1][1]
+        crag_ids = [crag_id for crag_id, _ in changed]
+        if ALL_CRAGS in crag_ids:
+            self.cache.clear()
+        else:
+            METRICS.inc('query_cache_invalidated', self.cache.invalidate(crag_ids))
+        return len(crag_ids)
+
+    def _cached(self, key: Tuple, crag_id: int, query: Callable[[sqlite3.Connection], Any]) -> Any:
+        if time.monotonic() - self._last_poll >= self.poll_interval:
+            self.sync()
+        value = self.cache.get(key)
+        if value is not _MISSING:
+            METRICS.inc('query_cache_hits')
+            return value
+        METRICS.inc('query_cache_misses')
+        generation = self.cache.generation
+        with METRICS.timer(f'query.{key[0]}'), self.pool.connection() as conn:
+            value = query(conn)
+        self.cache.put(key, crag_id, value, generation)
+        return value
+
+    def crag_summary(self, crag_id: int) -> Optional[dict]:
+        """Name, location and per-grade-type route statistics for a crag, or None if unknown"""
+        def query(conn: sqlite3.Connection) -> Optional[dict]:
+            crag = conn.execute("SELECT name, latitude, longitude, region FROM crags WHERE crag_id = ?",
+                                (crag_id,)).fetchone()
+            if crag is None:
+                return None
+            stats = conn.execute('''
+            SELECT grade_type, climbs, mean_score, score_variance, min_score, max_score
+            FROM crag_grade_stats WHERE crag_id = ?
+            ORDER BY grade_type
+            ''', (crag_id,)).fetchall()
+            return {
+                'crag_id': crag_id, 'name': crag[0], 'latitude': crag[1], 'longitude': crag[2],
+                'region': crag[3], 'routes': sum(row[1] for row in stats),
+                'grade_types': [{'grade_type': None if row[0] == -1 else row[0], 'routes': row[1],
+                                 'mean_score': row[2], 'score_variance': row[3],
+                                 'min_score': row[4], 'max_score': row[5]} for row in stats],
+            }
+        return self._cached(('crag_summary', crag_id), crag_id, query)
+
+    def routes(self, crag_id: int, min_score: Optional[float] = None, max_score: Optional[float] = None,
+               grade_type: Optional[int] = None, limit: int = 500) -> List[dict]:
+        """Routes at a crag, easiest first, optionally limited to a grade score range and grade type"""
+        def query(conn: sqlite3.Connection) -> List[dict]:
+            sql = ("SELECT climb_id, name, grade, tech_grade, grade_score, grade_type FROM climbs "
+                   "WHERE crag_id = ?")
+            params: list = [crag_id]
+            if min_score is not None:
+                sql += " AND grade_score >= ?"
+                params.append(min_score)
+            if max_score is not None:
+                sql += " AND grade_score <= ?"
+                params.append(max_score)
+            if grade_type is not None:
+                sql += " AND grade_type = ?"
+                params.append(grade_type)
+            sql += " ORDER BY grade_score, name LIMIT ?"
+            params.append(limit)
+            return [{'climb_id': row[0], 'name': row[1], 'grade': row[2], 'tech_grade': row[3],
+                     'grade_score': row[4], 'grade_type': row[5]}
+                    for row in conn.execute(sql, params)]
+        key = ('routes', crag_id, min_score, max_score, grade_type, limit)
+        return self._cached(key, crag_id, query)
+
+    def grade_histogram(self, crag_id: int, grade_type: Optional[int] = None) -> Dict[int, Dict[str, int]]:
+        """{grade_type: {grade: routes}} for a crag, from the grade summary table"""
+        def query(conn: sqlite3.Connection) -> Dict[int, Dict[str, int]]:
+            sql = "SELECT grade_type, grade, climbs FROM crag_grade_counts WHERE crag_id = ?"
+            params: list = [crag_id]
+            if grade_type is not None:
+                sql += " AND grade_type = ?"
+                params.append(grade_type)
+            histogram: Dict[int, Dict[str, int]] = {}
+            for row_type, grade, climbs in conn.execute(sql + " ORDER BY grade_type, grade", params):
+                histogram.setdefault(None if row_type == -1 else row_type, {})[grade or None] = climbs
+            return histogram
+        return self._cached(('grade_histogram', crag_id, grade_type), crag_id, query)
+
+    def crags_in_bbox(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float,
+                      limit: Optional[int] = 1000) -> List[dict]:
+        """Crags in a map viewport, straight off the R-tree
+
+        Viewports rarely repeat exactly, so these aren't cached.
+        """
+        with METRICS.timer('query.crags_in_bbox'), self.pool.connection() as conn:
+            rows = crags_in_boxes(conn, bbox_boxes(min_lat, max_lat, min_lon, max_lon), limit)
+        return [{'crag_id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3]} for row in rows]
+
+    def crags_near(self, latitude: float, longitude: float, km: float, limit: Optional[int] = 50) -> List[dict]:
+        """Crags within km of a point, nearest first; not cached, like crags_in_bbox"""
+        with METRICS.timer('query.crags_near'), self.pool.connection() as conn:
+            rows = crags_within(conn, latitude, longitude, km, limit)
+        return [{'crag_id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3],
+                 'distance_km': row[4]} for row in rows]
+
+    def search_climbs(self, text: str, limit: int = 10, crag_id: Optional[int] = None) -> List[dict]:
+        """Typeahead matches for climb names, best first
+
+        Not cached: most keystrokes are searched only once. The first letters of
+        a common word are the slow case, as every route they match is ranked.
+        """
+        with METRICS.timer('query.search_climbs'), self.pool.connection() as conn:
+            rows = search_climbs(conn, text, limit, crag_id)
+        return [{'climb_id': row[0], 'crag_id': row[1], 'name': row[2], 'grade': row[3], 'crag_name': row[4]}
+                for row in rows]
+
+    def search_crags(self, text: str, limit: int = 10) -> List[dict]:
+        """Typeahead matches for crag names, best first"""
+        with METRICS.timer('query.search_crags'), self.pool.connection() as conn:
+            rows = search_crags(conn, text, limit)
+        return [{'crag_id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3]} for row in rows]
@@ -0,0 +1,61 @@
+import re
+from typing import List, Optional
+
+# A last word shorter than this is left out until more is typed; one letter would match most of the index
+MIN_PREFIX = 2
+
+_WORD_RE = re.compile(r'\w+')
+
+# The best matches are taken straight off the index: FTS5 keeps only the top LIMIT rows while
+# it ranks, so the join below sees just those
+SEARCH_CLIMBS_SQL = '''
+SELECT c.climb_id, c.crag_id, c.name, c.grade, g.name
+FROM (SELECT rowid, rank FROM climbs_fts WHERE climbs_fts MATCH ? ORDER BY rank LIMIT ?) AS f
+JOIN climbs c ON c.climb_id = f.rowid
+LEFT JOIN crags g ON g.crag_id = c.crag_id
+ORDER BY f.rank
+'''
+SEARCH_CRAGS_SQL = '''
+SELECT g.crag_id, g.name, g.latitude, g.longitude
+FROM (SELECT rowid, rank FROM crags_fts WHERE crags_fts MATCH ? ORDER BY rank LIMIT ?) AS f
+JOIN crags g ON g.crag_id = f.rowid
+ORDER BY f.rank
+'''
+
+
+def fts_query(text: str) -> Optional[str]:
+    """An FTS5 query matching names with every word typed so far, the last one as a prefix
+
+    Words are quoted, so punctuation and FTS5 operators in the input are just
+    text. Trailing whitespace means the last word is finished. Returns None
+    when there is nothing to search for.
+    """
+    words = _WORD_RE.findall(text)
+    typing = bool(words) and not text[-1].isspace()
+    if typing and len(words[-1]) < MIN_PREFIX:
+        words.pop()
+        typing = False
+    if not words:
+        return None
+    terms = [f'name : "{word}"' for word in words]
+    if typing:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_climbs(conn, text: str, limit: int = 10, crag_id: Optional[int] = None) -> List[tuple]:
+    """(climb_id, crag_id, name, grade, crag name) for the best matching climbs, best first"""
+    query = fts_query(text)
+    if query is None:
+        return []
+    if crag_id is not None:
+        query += f' AND crag_id : "{int(crag_id)}"'
+    return conn.execute(SEARCH_CLIMBS_SQL, (query, limit)).fetchall()
+
+
+def search_crags(conn, text: str, limit: int = 10) -> List[tuple]:
+    """(crag_id, name, latitude, longitude) for the best matching crags, best first"""
+    query = fts_query(text)
+    if query is None:
+        return []
+    return conn.execute(SEARCH_CRAGS_SQL, (query, limit)).fetchall()
@@ -0,0 +1,263 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds in seconds; wide enough for a SQLite insert and a slow page fetch alike
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative-bucket timing histogram in the Prometheus style"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        cumulative['+Inf'] = self.count
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0.0, 'buckets': cumulative}
+
+
+class Metrics:
+    """Process-wide counters, gauges and timing histograms for the scraper stages.
+
+    Everything is off until enable() is called; until then timed functions and
+    timer blocks cost one attribute check, so the hot loop is unaffected. Stage
+    names are plain strings such as 'fetch' or 'db.insert_climbs'.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._gauge_fns: Dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional['ThreadingHTTPServer'] = None
+        self._dump_stop: Optional[threading.Event] = None
+
+    def enable(self):
+        if not self.enabled:
+            self.started = time.time()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def inc(self, name: str, amount: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def gauge_fn(self, name: str, fn: Callable[[], float]):
+        """Register a gauge read from `fn` whenever the metrics are exported"""
+        self._gauge_fns[name] = fn
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def _timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timer(self, name: str):
+        """Context manager timing a block into the `name` histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name)
+
+    def throughput(self, counter: str = 'crags_stored') -> float:
+        """Average per minute of a counter since metrics were enabled"""
+        minutes = (time.time() - self.started) / 60
+        return self.counters.get(counter, 0) / minutes if minutes > 0 else 0.0
+
+    def eta_seconds(self, counter: str = 'crags_stored', backlog_gauge: str = 'backlog') -> Optional[float]:
+        """Seconds to clear the backlog gauge at the current throughput, or None if unknown"""
+        rate = self.throughput(counter)
+        backlog = self.gauges.get(backlog_gauge)
+        if backlog is None or rate <= 0:
+            return None
+        return backlog / rate * 60
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            gauges = dict(self.gauges)
+            for name, fn in self._gauge_fns.items():
+                try:
+                    gauges[name] = fn()
+                except Exception:
+                    pass
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'crags_per_minute': self.throughput(),
+                'eta_seconds': self.eta_seconds(),
+                'counters': dict(self.counters),
+                'gauges': gauges,
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix: str = 'climb_scraper') -> str:
+        """The metrics in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = []
+
+        def metric_name(name: str) -> str:
+            return f"{prefix}_{name.replace('.', '_').replace('-', '_')}"
+
+        for name, value in sorted(snap['counters'].items()):
+            lines += [f"# TYPE {metric_name(name)}_total counter", f"{metric_name(name)}_total {value}"]
+        gauges = dict(snap['gauges'], crags_per_minute=snap['crags_per_minute'])
+        if snap['eta_seconds'] is not None:
+            gauges['eta_seconds'] = snap['eta_seconds']
+        for name, value in sorted(gauges.items()):
+            lines += [f"# TYPE {metric_name(name)} gauge", f"{metric_name(name)} {value}"]
+        for name, histogram in sorted(snap['histograms'].items()):
+            base = f"{metric_name(name)}_seconds"
+            lines.append(f"# TYPE {base} histogram")
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{base}_bucket{{le="{bound}"}} {count}')
+            lines += [f"{base}_sum {histogram['sum']}", f"{base}_count {histogram['count']}"]
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+        """Serve /metrics (Prometheus) and /metrics.json from a background thread"""
+        # Imported here: http.server pulls in email and html, and only the scraper serves metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, content_type = metrics.to_json().encode(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, content_type = metrics.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.enable()
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def dump_periodically(self, path: str, interval: float = 30.0):
+        """Rewrite a JSON snapshot to `path` every `interval` seconds from a background thread"""
+        self.enable()
+        self._dump_stop = threading.Event()
+
+        def run(stop: threading.Event):
+            while not stop.wait(interval):
+                self.dump(path)
+
+        threading.Thread(target=run, args=(self._dump_stop,), name='metrics-dump', daemon=True).start()
+
+    def dump(self, path: str):
+        try:
+            with open(path + '.tmp', 'w') as f:
+                f.write(self.to_json())
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error writing metrics to {path}: {e}")
+
+    def stop(self):
+        """Shut down the HTTP endpoint and periodic dump, if running"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._dump_stop is not None:
+            self._dump_stop.set()
+            self._dump_stop = None
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+METRICS = Metrics()
+
+
+def timed(name: str):
+    """Decorator recording each call's duration in the `name` histogram while metrics are on"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                METRICS.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def format_progress(metrics: Metrics = METRICS) -> str:
+    """One-line throughput and ETA summary for the scraper log"""
+    eta = metrics.eta_seconds()
+    eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None and eta < 86400 else (
+        f"{eta / 86400:.1f} days" if eta is not None else 'unknown')
+    return f"{metrics.throughput():.1f} crags/min, ETA {eta_text}"
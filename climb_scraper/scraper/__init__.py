@@ -1 +1,11 @@
-from .scraper_functions import *
\ No newline at end of file
+import importlib
+import importlib.util
+
+
+def __getattr__(name):
+    # The scraper helpers load on first use, so importing one scraper module doesn't import them all
+    if not name.startswith('__') and importlib.util.find_spec(f'{__name__}.{name}') is None:
+        scraper_functions = importlib.import_module('.scraper_functions', __name__)
+        if hasattr(scraper_functions, name):
+            return getattr(scraper_functions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
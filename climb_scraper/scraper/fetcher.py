@@ -0,0 +1,495 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, List, Mapping, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from climb_scraper.data.page_cache import PageCache
+from climb_scraper.metrics import METRICS
+from climb_scraper.scraper.page_parser import CRAG_TITLE_PREFIX, CragPage, detect_encoding, scan_title
+
+CRAG_URL = "https://www.ukclimbing.com/logbook/crag.php?id={crag_id}"
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15'
+]
+
+_TITLE_END = re.compile(rb'</title\s*>', re.IGNORECASE)
+
+# Statuses that mean the server wants us to slow down, and are worth retrying
+BACKOFF_STATUSES = {429, 503}
+
+DEFAULT_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a single page fetch"""
+    crag_id: Optional[int]
+    url: str
+    status: Optional[int] = None
+    content: Optional[bytes] = None
+    headers: Mapping[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    page: Optional[CragPage] = None
+    from_cache: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.content is not None
+
+
+@dataclass
+class ProbeResult:
+    """Outcome of a lightweight validity probe that stops reading after the <title>"""
+    crag_id: int
+    url: str
+    status: Optional[int] = None
+    title: str = ''
+    method: str = 'GET'
+    bytes_read: int = 0
+    content_length: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def valid(self) -> bool:
+        return self.status in (200, 206) and CRAG_TITLE_PREFIX in self.title
+
+    @property
+    def settled(self) -> bool:
+        """Whether the probe says for sure if the ID is a crag: a page with or without the crag title, or a 404/410
+
+        A failed request, pushback (429/503) or another status says nothing about the ID.
+        """
+        return self.error is None and self.status in (200, 206, 404, 410)
+
+    @property
+    def bytes_saved(self) -> Optional[int]:
+        """Body bytes not downloaded thanks to the early abort, when the full size is known"""
+        if self.content_length is None:
+            return None
+        return max(self.content_length - self.bytes_read, 0)
+
+
+class TokenBucket:
+    """Async token bucket limiting how many requests start per second"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Holding the lock while sleeping keeps waiters served in arrival order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Token bucket whose rate follows how the server is coping (AIMD).
+
+    Each healthy response adds `increase / rate` to the rate, so it climbs by
+    about `increase` requests per second every second. A 429 or 5xx, a dropped
+    connection, or latency well above the best seen so far (by both
+    `latency_factor` and `latency_slack` seconds) multiplies the rate
+    by `decrease`, at most once per `cooldown` seconds, so repeated pushback
+    backs off exponentially. A Retry-After header holds all requests until it
+    has passed.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, min_rate: float = 0.05, max_rate: float = 4.0,
+                 increase: float = 0.1, decrease: float = 0.5, latency_factor: float = 2.0,
+                 latency_slack: float = 0.5, cooldown: float = 5.0):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_slack = latency_slack
+        self.cooldown = cooldown
+        self.latency: Optional[float] = None
+        self.base_latency: Optional[float] = None
+        self.blocked_until = 0.0
+        self.backoffs = 0
+        self._last_backoff = 0.0
+
+    async def acquire(self):
+        """Wait out any Retry-After hold, then until a token is available, and take it"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                delay = self.blocked_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._refill()
+                if self.tokens >= 1:
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+            self.tokens -= 1
+
+    def _set_rate(self, rate: float):
+        # Settle the tokens earned at the old rate before switching
+        self._refill()
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+
+    def _back_off(self, now: float):
+        if now - self._last_backoff >= self.cooldown:
+            self._last_backoff = now
+            self.backoffs += 1
+            self._set_rate(self.rate * self.decrease)
+            # Drop any saved burst so the lower rate takes effect straight away
+            self.tokens = min(self.tokens, 0.0)
+
+    def record(self, status: Optional[int], elapsed: Optional[float] = None, retry_after: Optional[float] = None):
+        """Adjust the rate from one response; a None status is a connection error or timeout"""
+        now = time.monotonic()
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if status is None or status in BACKOFF_STATUSES or status >= 500:
+            self._back_off(now)
+            return
+        if elapsed is not None:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            if self.base_latency is None or self.latency < self.base_latency:
+                self.base_latency = self.latency
+            if self.latency > max(self.base_latency * self.latency_factor, self.base_latency + self.latency_slack):
+                self._back_off(now)
+                # Let the baseline drift up so a permanently slower server isn't punished forever
+                self.base_latency *= 1.05
+                return
+        self._set_rate(self.rate + self.increase / self.rate)
+
+
+def retry_after_seconds(headers: Mapping[str, str], limit: float = 600.0) -> Optional[float]:
+    """Delay asked for by a Retry-After header, either seconds or an HTTP date"""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), limit)
+    try:
+        delay = parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+    return min(max(delay, 0.0), limit)
+
+
+class AsyncCragFetcher:
+    """Fetches crag pages concurrently over one pooled keep-alive session.
+
+    At most `concurrency` requests are in flight at once. The rate limit is per
+    host: each host gets its own token bucket, so no one host is sent more than
+    `rate` requests per second, though URLs spread over several hosts can add
+    up to more in total. With `adaptive` on, `rate` is only the starting point:
+    each host's bucket speeds up towards `max_rate` while responses are healthy
+    and backs off on 429/5xx or rising latency. 429 and 503 responses are
+    retried up to `max_retries` times once any Retry-After has passed.
+
+    Probes try a HEAD first, which settles IDs the server answers with 404.
+    Once `head_give_up` misses in a row on a host got a 200 from HEAD and were
+    only caught by the ranged GET, that host gets no more HEADs: it can't tell
+    crags from misses by status, and each HEAD costs a rate-limit token.
+    """
+
+    def __init__(self, url_template: str = CRAG_URL, concurrency: int = 4, rate: float = 0.5,
+                 burst: float = 1.0, timeout: float = 30.0, head_precheck: bool = True,
+                 probe_max_bytes: int = 64 * 1024, cache: Optional[PageCache] = None,
+                 adaptive: bool = True, max_rate: float = 4.0, max_retries: int = 2, head_give_up: int = 3):
+        self.url_template = url_template
+        self.adaptive = adaptive
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.cache = cache
+        self.head_precheck = head_precheck
+        self.probe_max_bytes = probe_max_bytes
+        self.head_give_up = head_give_up
+        self._head_unsupported = set()
+        self._head_unsettled: Dict[str, int] = defaultdict(int)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiters: Dict[str, TokenBucket] = defaultdict(self._new_limiter)
+
+    def _new_limiter(self) -> TokenBucket:
+        if self.adaptive:
+            return AdaptiveTokenBucket(self.rate, self.burst, min_rate=min(self.rate, 0.05),
+                                       max_rate=self.max_rate)
+        return TokenBucket(self.rate, self.burst)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """Create the shared client session"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency,
+                                             ttl_dns_cache=300)
+            headers = dict(DEFAULT_HEADERS, **{'User-Agent': random.choice(USER_AGENTS)})
+            self.session = aiohttp.ClientSession(connector=connector, headers=headers,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        """Close the shared client session"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def build_url(self, crag_id: int) -> str:
+        return self.url_template.format(crag_id=crag_id)
+
+    def limiter_for(self, url: str) -> TokenBucket:
+        return self._limiters[urlsplit(url).netloc]
+
+    def _record(self, limiter: TokenBucket, status: Optional[int], elapsed: Optional[float] = None,
+                headers: Mapping[str, str] = None):
+        if isinstance(limiter, AdaptiveTokenBucket):
+            limiter.record(status, elapsed, retry_after_seconds(headers) if headers else None)
+
+    @property
+    def current_rate(self) -> float:
+        """Requests per second currently allowed, summed over all hosts"""
+        if not self._limiters:
+            return self.rate
+        return sum(limiter.rate for limiter in self._limiters.values())
+
+    async def fetch_url(self, url: str, crag_id: Optional[int] = None) -> FetchResult:
+        """Fetch a single URL, waiting on the concurrency and rate limits first"""
+        await self.open()
+        result = FetchResult(crag_id=crag_id, url=url)
+        limiter = self.limiter_for(url)
+        use_cache = self.cache is not None and crag_id is not None
+        headers = await asyncio.to_thread(self.cache.validators, crag_id) if use_cache else {}
+        for _ in range(self.max_retries + 1):
+            result.status = result.content = result.error = None
+            result.headers = {}
+            async with self._semaphore:
+                with METRICS.timer('fetch.rate_limit_wait'):
+                    await limiter.acquire()
+                start = time.monotonic()
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        result.status = response.status
+                        # Keep the case-insensitive mapping; servers vary between ETag and Etag
+                        result.headers = response.headers.copy()
+                        result.content = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    result.error = str(e) or type(e).__name__
+                result.elapsed = time.monotonic() - start
+            self._record(limiter, result.status, result.elapsed, result.headers)
+            if METRICS.enabled:
+                METRICS.observe('fetch', result.elapsed)
+                METRICS.inc(f"http_{result.status or 'error'}")
+            if result.status not in BACKOFF_STATUSES:
+                break
+        if use_cache and result.status == 304:
+            cached = await asyncio.to_thread(self.cache.get, crag_id)
+            if cached is not None:
+                result.status, result.content, result.from_cache = 200, cached.body, True
+        elif use_cache and result.ok:
+            await asyncio.to_thread(self.cache.put, crag_id, result.content,
+                                    result.headers.get('ETag'), result.headers.get('Last-Modified'))
+        return result
+
+    async def fetch(self, crag_id: int) -> FetchResult:
+        return await self.fetch_url(self.build_url(crag_id), crag_id)
+
+    async def fetch_many(self, crag_ids: Iterable[int]) -> List[FetchResult]:
+        """Fetch several crags at once, returning results in the order requested"""
+        return list(await asyncio.gather(*(self.fetch(crag_id) for crag_id in crag_ids)))
+
+    async def _head(self, url: str, result: ProbeResult) -> bool:
+        """HEAD pre-check; returns True when it has already settled the probe"""
+        host = urlsplit(url).netloc
+        if not self.head_precheck or host in self._head_unsupported:
+            return False
+        limiter = self.limiter_for(url)
+        await limiter.acquire()
+        async with self.session.head(url, allow_redirects=False) as response:
+            self._record(limiter, response.status, headers=response.headers)
+            if response.status in (405, 501):
+                self._head_unsupported.add(host)
+                return False
+            if response.status in (404, 410):
+                self._head_unsettled[host] = 0
+                result.method = 'HEAD'
+                result.status = response.status
+                return True
+        result.method = 'HEAD+GET'
+        return False
+
+    def _head_missed(self, url: str):
+        """Count a miss the HEAD pre-check let through, turning HEAD off for the host after too many"""
+        host = urlsplit(url).netloc
+        self._head_unsettled[host] += 1
+        if self._head_unsettled[host] >= self.head_give_up and host not in self._head_unsupported:
+            self._head_unsupported.add(host)
+            print(f"HEAD doesn't settle probes on {host}, probing with GET only")
+
+    async def probe(self, crag_id: int) -> ProbeResult:
+        """Check a crag ID by reading the page only as far as its </title>
+
+        A HEAD request settles outright misses when the server answers 404 for
+        them; otherwise the GET body is streamed and the connection dropped as
+        soon as the title has been seen.
+        """
+        await self.open()
+        url = self.build_url(crag_id)
+        result = ProbeResult(crag_id=crag_id, url=url)
+        limiter = self.limiter_for(url)
+        async with self._semaphore:
+            try:
+                if await self._head(url, result):
+                    return result
+                await limiter.acquire()
+                # identity encoding keeps bytes_read comparable with Content-Length
+                headers = {'Accept-Encoding': 'identity', 'Range': f'bytes=0-{self.probe_max_bytes - 1}'}
+                async with self.session.get(url, headers=headers) as response:
+                    result.status = response.status
+                    self._record(limiter, response.status, headers=response.headers)
+                    result.content_length = _full_length(response)
+                    buffer = b''
+                    async for chunk in response.content.iter_chunked(8192):
+                        buffer += chunk
+                        if _TITLE_END.search(buffer) or len(buffer) >= self.probe_max_bytes:
+                            break
+                    result.bytes_read = len(buffer)
+                    result.title = scan_title(buffer, detect_encoding(buffer))
+                # Only a miss the GET settled counts against HEAD, not server pushback
+                if result.method == 'HEAD+GET' and result.settled and not result.valid:
+                    self._head_missed(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result.error = str(e) or type(e).__name__
+                self._record(limiter, None)
+        return result
+
+    async def probe_many(self, crag_ids: Iterable[int]) -> List[ProbeResult]:
+        """Probe several crag IDs at once, returning results in the order requested"""
+        return list(await asyncio.gather(*(self.probe(crag_id) for crag_id in crag_ids)))
+
+
+def _full_length(response: aiohttp.ClientResponse) -> Optional[int]:
+    """Size of the whole page, from Content-Range on a 206 or Content-Length otherwise"""
+    content_range = response.headers.get('Content-Range', '')
+    if response.status == 206 and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    return response.content_length
+
+
+class FetchEngine:
+    """Synchronous front end that keeps an AsyncCragFetcher alive on a background event loop.
+
+    The scraper loop and the database code are synchronous, so this lets them hand
+    batches of crag IDs to the async fetcher while the connection pool survives
+    between batches.
+    """
+
+    def __init__(self, **fetcher_kwargs):
+        self.fetcher_kwargs = fetcher_kwargs
+        self.fetcher = AsyncCragFetcher(**fetcher_kwargs)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="crag-fetcher", daemon=True)
+                self._thread.start()
+
+    def run(self, coro):
+        """Run a coroutine on the engine loop and wait for its result"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def fetch(self, crag_id: int) -> FetchResult:
+        return self.run(self.fetcher.fetch(crag_id))
+
+    def fetch_url(self, url: str) -> FetchResult:
+        return self.run(self.fetcher.fetch_url(url))
+
+    def fetch_many(self, crag_ids: Iterable[int]) -> List[FetchResult]:
+        return self.run(self.fetcher.fetch_many(list(crag_ids)))
+
+    def probe(self, crag_id: int) -> ProbeResult:
+        return self.run(self.fetcher.probe(crag_id))
+
+    def probe_many(self, crag_ids: Iterable[int]) -> List[ProbeResult]:
+        return self.run(self.fetcher.probe_many(list(crag_ids)))
+
+    def stop(self):
+        """Close the session and shut down the background loop"""
+        with self._lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.fetcher.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop = None
+            self._thread = None
+
+
+_default_engine: Optional[FetchEngine] = None
+
+
+def get_engine(**fetcher_kwargs) -> FetchEngine:
+    """Return the process-wide fetch engine, creating it on first use
+
+    Called with no arguments it returns whatever engine is running. Called with
+    settings that differ from the running engine's, the old engine is stopped
+    and replaced, so settings passed by main() win over an engine that an
+    earlier get_data() or check_crag_id() call started with the defaults.
+    """
+    global _default_engine
+    if _default_engine is not None and fetcher_kwargs and fetcher_kwargs != _default_engine.fetcher_kwargs:
+        print(f"Restarting the fetch engine with new settings: {sorted(fetcher_kwargs)}")
+        _default_engine.stop()
+        _default_engine = None
+    if _default_engine is None:
+        _default_engine = FetchEngine(**fetcher_kwargs)
+    return _default_engine
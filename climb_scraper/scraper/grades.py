@@ -0,0 +1,89 @@
+import threading
+from typing import Dict, List, Optional
+
+from climb_scraper.data.database import ClimbingDatabase
+
+
+def flatten_grade(grade: dict) -> dict:
+    """Copy a grade with its nested alternative grade as alt_* keys"""
+    row = grade.copy()
+    if 'alt' in row:
+        alt_data = row.pop('alt')
+        row.update({f'alt_{k}': v for k, v in alt_data.items()})
+    return row
+
+
+def flatten_grades(grades_json: dict) -> List[dict]:
+    """Flatten the grades_list blob ({system: {grade id: grade}}) into one dict per grade"""
+    return [flatten_grade(grade) for outer_value in grades_json.values() for grade in outer_value.values()]
+
+
+class GradeTable:
+    """Process-wide grade lookup keyed by grade id.
+
+    Every crag page repeats the same grade systems, so grades are learned once,
+    added to incrementally when a page brings an unseen id, and written to the
+    grades table so the database has one grade dimension to join on.
+    """
+
+    def __init__(self):
+        self.grades: Dict[int, dict] = {}
+        self._loaded_from: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def load(self, db: ClimbingDatabase):
+        """Fill the table from the database, once per database"""
+        if self._loaded_from == db.db_path:
+            return
+        for grade_id, grade_system, name, score, color, alt_id, alt_name in db.get_grades():
+            self.grades[grade_id] = {'id': grade_id, 'gradesystem': grade_system, 'name': name, 'score': score,
+                                     'gradecolor': color, 'alt_id': alt_id, 'alt_name': alt_name}
+        self._loaded_from = db.db_path
+
+    def update(self, grades_json: dict, db: Optional[ClimbingDatabase] = None) -> int:
+        """Add any grades not seen before, persisting them if a database is given
+
+        With a database the grades are only learned once their write commits,
+        so a rolled back crag leaves them to be written again by the next one.
+        Raises RuntimeError if they could not be written. Returns the number of
+        new grades.
+        """
+        if db is not None:
+            self.load(db)
+        with self._lock:
+            new_grades = {}
+            for outer_key, outer_value in grades_json.items():
+                for grade in outer_value.values():
+                    if grade.get('id') is None or int(grade['id']) in self.grades:
+                        continue
+                    row = flatten_grade(grade)
+                    row.setdefault('gradesystem', outer_key)
+                    new_grades[int(row['id'])] = row
+        if not new_grades:
+            return 0
+        if db is None:
+            self._learn(new_grades)
+        else:
+            if not db.insert_grades(list(new_grades.values())):
+                raise RuntimeError(f"Could not store {len(new_grades)} new grades")
+            db.on_commit(lambda: self._learn(new_grades))
+        return len(new_grades)
+
+    def _learn(self, grades: Dict[int, dict]):
+        with self._lock:
+            for grade_id, row in grades.items():
+                self.grades.setdefault(grade_id, row)
+
+    def resolve(self, grade_id) -> Optional[dict]:
+        """The grade record for an id, or None if it isn't known"""
+        try:
+            return self.grades.get(int(grade_id))
+        except (TypeError, ValueError):
+            return None
+
+    def name(self, grade_id) -> Optional[str]:
+        grade = self.resolve(grade_id)
+        return grade['name'] if grade else None
+
+
+GRADE_TABLE = GradeTable()
@@ -1,15 +1,14 @@
-import requests
-from bs4 import BeautifulSoup as bs
-import time
 import random
-from typing import Optional
+import time
+from typing import Dict, Iterable, List, Optional, Set
 from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.id_space import DAY, IdSpaceMap
+from climb_scraper.scraper.fetcher import FetchEngine, ProbeResult, get_engine
+from climb_scraper.scraper.page_parser import CRAG_TITLE_PREFIX, detect_encoding, scan_title
 
 
 def is_valid_crag_page(content):
-    soup = bs(content, 'html.parser')
-    title = soup.title.string if soup.title else ''
-    return 'UKC Logbook - ' in title
+    return CRAG_TITLE_PREFIX in scan_title(content, detect_encoding(content))
 
 
 def get_random_user_agent() -> str:
@@ -23,33 +22,64 @@ def get_random_user_agent() -> str:
     return random.choice(user_agents)
 
 
-def check_crag_id(crag_id: int) -> bool:
+def check_crag_id(crag_id: int, engine: Optional[FetchEngine] = None) -> bool:
     """Check if a specific crag ID is valid"""
-    headers = {
-        'User-Agent': get_random_user_agent(),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    }
-
     try:
-        response = requests.get(
-            f"https://www.ukclimbing.com/logbook/crag.php?id={crag_id}",
-            headers=headers
-        )
-        return response.status_code == 200 and is_valid_crag_page(response.content)
+        return is_valid_probe((engine or get_engine()).probe(crag_id))
     except Exception as e:
         print(f"Error checking crag ID {crag_id}: {e}")
         return False
 
 
+def is_valid_probe(result: ProbeResult) -> bool:
+    """Whether a probe found a valid crag page"""
+    if result.error is not None:
+        print(f"Error checking crag ID {result.crag_id}: {result.error}")
+        return False
+    return result.valid
+
+
 class CragFinder:
-    def __init__(self, db: ClimbingDatabase, max_attempts: int = 50):
+    """Discovers new crag IDs above the highest one in the database.
+
+    Probes go out `probe_width` at a time through the shared fetch engine. The
+    finder first gallops upwards in doubling steps to find roughly where the ID
+    space ends, binary-searches that edge, then fills in the IDs it hasn't seen
+    in batches until MAX_ATTEMPTS misses in a row.
+
+    Every probe outcome goes into the persisted IdSpaceMap, and IDs it already
+    knows are answered from it rather than probed: a known crag, or a miss
+    newer than its staleness window. Above the highest known crag, where new
+    crags get their IDs, misses go stale after `frontier_recheck_after`
+    seconds; below it, after `recheck_after`. So a run straight after another
+    probes nothing it has already seen. After the search above the highest
+    known ID, up to `gap_budget` IDs below it are probed: ones never probed,
+    then stale misses.
+
+    Only settled probes are recorded. An ID the server throttled or failed on
+    stays unprobed and doesn't count towards the run of misses; MAX_ATTEMPTS
+    unanswered probes in a row end the search until the next run.
+    """
+
+    def __init__(self, db: ClimbingDatabase, max_attempts: int = 50, engine: Optional[FetchEngine] = None,
+                 probe_width: int = 8, batch_size: int = 50, gap_budget: int = 1000,
+                 recheck_after: float = 180 * DAY, frontier_recheck_after: float = 7 * DAY):
         self.db = db
         self.MAX_ATTEMPTS = max_attempts
         self.errors_in_a_row = 0
+        self.unanswered_in_a_row = 0
+        self.engine = engine or get_engine()
+        self.probe_width = probe_width
+        self.batch_size = batch_size
+        self.results: Dict[int, bool] = {}
+        self.unanswered: Set[int] = set()
+        self.bytes_read = 0
+        self.bytes_saved = 0
+        self.gap_budget = gap_budget
+        self.recheck_after = recheck_after
+        self.frontier_recheck_after = frontier_recheck_after
+        self.last_known = 0
+        self.id_space = IdSpaceMap.load(db)
 
     def get_last_checked_id(self) -> int:
         """Get the highest crag ID we've checked"""
@@ -65,40 +95,143 @@ class CragFinder:
             print(f"Error getting last checked ID: {e}")
             return 0
 
-    def find_new_crags(self):
-        """Find new valid crag IDs and add them to the database"""
-        last_id = self.get_last_checked_id()
-        next_id = last_id + 1
+    def needs_probe(self, crag_id: int) -> bool:
+        """Whether the ID is unprobed, or a miss old enough to check again"""
+        # Unanswered IDs wait for the next run rather than adding to the pushback in this one
+        if crag_id in self.results or crag_id in self.unanswered:
+            return False
+        state = self.id_space.state(crag_id)
+        if state is None:
+            return True
+        if state:
+            return False
+        window = self.frontier_recheck_after if crag_id > self.last_known else self.recheck_after
+        return self.id_space.probed_day(crag_id) < int((time.time() - window) // DAY)
+
+    def is_crag(self, crag_id: int) -> bool:
+        """What this run's probe, or else the ID space map, says about an ID"""
+        if crag_id in self.results:
+            return self.results[crag_id]
+        return bool(self.id_space.state(crag_id))
+
+    def probe(self, crag_ids: Iterable[int]) -> List[int]:
+        """Probe the IDs that need it, store the valid ones and return them"""
+        unseen = [crag_id for crag_id in crag_ids if self.needs_probe(crag_id)]
+        if not unseen:
+            return []
         valid_ids = []
-        self.errors_in_a_row = 0
-
-        print(f"Starting search from crag ID: {next_id}")
-
-        while self.errors_in_a_row < self.MAX_ATTEMPTS:
-            print(f"Checking crag ID: {next_id}")
-
-            # Add random delay between checks
-            time.sleep(random.uniform(3, 7))
-
-            if check_crag_id(next_id):
-                print(f"Found valid crag ID: {next_id}")
-                valid_ids.append(next_id)
-                self.errors_in_a_row = 0
-
-                # Add to database immediately
-                self.db.add_crag_ids(next_id, next_id)
+        for result in self.engine.probe_many(unseen):
+            valid = is_valid_probe(result)
+            self.bytes_read += result.bytes_read
+            self.bytes_saved += result.bytes_saved or 0
+            # A failed request, 429 or 5xx says nothing about the ID, so it stays unprobed
+            if not result.settled:
+                self.unanswered.add(result.crag_id)
+                continue
+            self.results[result.crag_id] = valid
+            self.id_space.mark(result.crag_id, valid)
+            if valid:
+                valid_ids.append(result.crag_id)
+        if valid_ids:
+            print(f"Found valid crag IDs: {valid_ids}")
+            # One insert per batch of probes rather than one per hit
+            self.db.add_crag_id_list(valid_ids)
+        self.id_space.save(self.db)
+        return valid_ids
 
+    def gap_candidates(self, below: int) -> List[int]:
+        """IDs under `below` worth probing: never probed first, then stale misses"""
+        candidates = []
+        for first, last in self.id_space.unprobed_ranges(1, below - 1):
+            candidates.extend(range(first, min(last + 1, first + self.gap_budget - len(candidates))))
+            if len(candidates) >= self.gap_budget:
+                return candidates
+        return candidates + self.id_space.stale_negatives(self.recheck_after, 1, below - 1,
+                                                          limit=self.gap_budget - len(candidates))
+
+    def fill_gaps(self, below: int) -> List[int]:
+        """Probe the gap candidates below an ID and return the crags found"""
+        candidates = self.gap_candidates(below)
+        if not candidates:
+            return []
+        print(f"Checking {len(candidates)} unprobed or stale IDs below {below}")
+        found = []
+        for i in range(0, len(candidates), self.batch_size):
+            found += self.probe(candidates[i:i + self.batch_size])
+        return found
+
+    def window_has_crag(self, start: int) -> bool:
+        """Probe probe_width IDs from start and report whether any is a crag"""
+        window = range(start, start + self.probe_width)
+        self.probe(window)
+        return any(self.is_crag(crag_id) for crag_id in window)
+
+    def find_upper_bound(self, last_id: int) -> int:
+        """Estimate the first ID past the end of the ID space
+
+        Returns an ID whose window held no crags, with every probed window
+        below it known to hold at least one.
+        """
+        low, step = last_id, self.probe_width
+        while self.window_has_crag(low + step):
+            low += step
+            step *= 2
+        high = low + step
+        print(f"Galloped to crag ID {low}, no crags at {high}")
+
+        while high - low > self.probe_width:
+            mid = (low + high) // 2
+            if self.window_has_crag(mid):
+                low = mid
             else:
-                print(f"Invalid crag ID: {next_id}")
-                self.errors_in_a_row += 1
+                high = mid
+        return high
 
-            next_id += 1
+    def find_new_crags(self):
+        """Find new valid crag IDs and add them to the database"""
+        last_id = self.get_last_checked_id()
+        self.last_known = last_id
+        self.results = {}
+        self.unanswered = set()
+        self.errors_in_a_row = self.unanswered_in_a_row = 0
+        self.bytes_read = self.bytes_saved = 0
 
-        print(f"Search complete. Found {len(valid_ids)} new crag IDs")
+        print(f"Starting search from crag ID: {last_id + 1}, first unprobed ID {self.id_space.next_unprobed(last_id + 1)}")
+        upper_bound = self.find_upper_bound(last_id)
+        print(f"ID space appears to end near {upper_bound}, filling in from {last_id + 1}")
+
+        next_id = last_id + 1
+        while next_id < upper_bound or self.errors_in_a_row < self.MAX_ATTEMPTS:
+            batch = range(next_id, next_id + self.batch_size)
+            self.probe(batch)
+            # Known misses count towards the run of misses without being probed again
+            for crag_id in batch:
+                if self.is_crag(crag_id):
+                    self.errors_in_a_row = self.unanswered_in_a_row = 0
+                elif crag_id in self.unanswered:
+                    self.unanswered_in_a_row += 1
+                else:
+                    self.errors_in_a_row += 1
+                    self.unanswered_in_a_row = 0
+            next_id += self.batch_size
+            if self.unanswered_in_a_row >= self.MAX_ATTEMPTS:
+                print(f"{self.unanswered_in_a_row} probes in a row went unanswered, stopping at {next_id - 1}")
+                break
+
+        if self.unanswered_in_a_row < self.MAX_ATTEMPTS:
+            self.fill_gaps(last_id + 1)
+
+        valid_ids = sorted(crag_id for crag_id, valid in self.results.items() if valid)
+        print(f"Search complete. Probed {len(self.results)} IDs, found {len(valid_ids)} new crag IDs, "
+              f"{len(self.unanswered)} left for the next run")
+        probes = len(self.results) + len(self.unanswered)
+        if probes:
+            print(f"Probes read {self.bytes_read / probes / 1024:.1f} KiB each on average, "
+                  f"saving {self.bytes_saved / probes / 1024:.1f} KiB each")
         return valid_ids
 
 
-def populate_ids_list(db: ClimbingDatabase):
+def populate_ids_list(db: ClimbingDatabase, engine: Optional[FetchEngine] = None):
     """Main function to find new crag IDs"""
-    finder = CragFinder(db)
-    return finder.find_new_crags()
\ No newline at end of file
+    finder = CragFinder(db, engine=engine)
+    return finder.find_new_crags()
@@ -0,0 +1,177 @@
+import html
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional, Tuple
+
+VALID_TITLE_PREFIX = 'UKC Logbook'
+# Crag pages are titled 'UKC Logbook - <crag>'; discovery probes require the separator too
+CRAG_TITLE_PREFIX = VALID_TITLE_PREFIX + ' - '
+TABLE_DATA_MARKER = b'table_data = '
+GRADES_LIST_MARKER = b'grades_list = '
+
+_TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+_SCRIPT_OPEN = b'<script'
+_SCRIPT_CLOSE = b'</script>'
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+# The only bytes windows-1252 can't decode
+_CP1252_UNDEFINED = re.compile(b'[\x81\x8d\x8f\x90\x9d]')
+
+# Crag coordinates in the forms map widgets and structured data use: "latitude": 53.3, "longitude": -1.6
+# or lat = 53.3; lng = -1.6, geo.position/ICBM meta tags, and map links with ?q=, ll= or center=.
+# Each pattern starts with a literal so the regex engine can skip through the page without backtracking,
+# and meta tags are only looked for in the <head>.
+_COORDINATE_RES = (
+    re.compile(rb'lat(?:itude)?["\']?\s*[:=]\s*["\']?(-?\d{1,2}(?:\.\d+)?)["\']?\s*[,;]\s*(?:var\s+)?'
+               rb'["\']?\w*?(?:lng|lon|long|longitude)["\']?\s*[:=]\s*["\']?(-?\d{1,3}(?:\.\d+)?)'),
+    re.compile(rb'maps[^"\'\s<>]{0,80}?[?&](?:q|ll|center)=(-?\d{1,2}\.\d+)(?:,|%2C)\s*(-?\d{1,3}\.\d+)'),
+)
+_META_COORDINATE_RES = (
+    re.compile(rb'geo\.position["\']\s+content=["\']\s*(-?\d{1,2}(?:\.\d+)?)\s*;\s*(-?\d{1,3}(?:\.\d+)?)'),
+    re.compile(rb'ICBM["\']\s+content=["\']\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)'),
+)
+_HEAD_CLOSE = b'</head>'
+_OG_TITLE_RE = re.compile(rb'og:title["\']\s+content=["\']([^"\']*)["\']')
+_TITLE_SEPARATORS = ' -|:\u2013\u2014'
+
+
+@dataclass
+class CragPage:
+    """Everything the scraper needs from one crag page, pulled out in a single pass"""
+    title: str
+    encoding: str
+    table_script: Optional[str] = None
+    grades_script: Optional[str] = None
+    climbs: Optional[list] = None
+    grades: Optional[dict] = None
+    name: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    _data_loaded: bool = field(default=False, repr=False)
+
+    @property
+    def is_valid(self) -> bool:
+        return VALID_TITLE_PREFIX in self.title
+
+    def load_data(self) -> 'CragPage':
+        """Decode the table_data and grades_list literals, once, on first use"""
+        if not self._data_loaded:
+            self._data_loaded = True
+            if self.table_script is not None:
+                self.climbs, _ = extract_json_literal(self.table_script, TABLE_DATA_MARKER.decode())
+            if self.grades_script is not None:
+                self.grades, _ = extract_json_literal(self.grades_script, GRADES_LIST_MARKER.decode())
+        return self
+
+
+def detect_encoding(content: bytes) -> str:
+    """Pick the first of utf-8, windows-1252 and iso-8859-1 that can decode the page
+
+    The page is decoded at most once, as UTF-8. If that fails, a byte scan
+    for the five bytes windows-1252 leaves undefined settles the rest.
+    """
+    if content.isascii():
+        return 'utf-8'
+    try:
+        content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    # windows-1252 is a superset of the printable iso-8859-1 range
+    if _CP1252_UNDEFINED.search(content) is None:
+        return 'windows-1252'
+    return 'iso-8859-1'
+
+
+def _decode(raw: bytes, encoding: str) -> str:
+    return raw.decode(encoding, errors='replace')
+
+
+def scan_title(content: bytes, encoding: str = 'utf-8') -> str:
+    """Read the page <title> straight from the bytes"""
+    match = _TITLE_RE.search(content)
+    if match is None:
+        return ''
+    return html.unescape(_decode(match.group(1), encoding)).strip()
+
+
+def scan_script(content: bytes, marker: bytes, encoding: str = 'utf-8') -> Optional[str]:
+    """Return the body of the <script> element containing `marker`, or None"""
+    index = content.find(marker)
+    if index == -1:
+        return None
+    open_tag = content.rfind(_SCRIPT_OPEN, 0, index)
+    if open_tag == -1:
+        return None
+    body_start = content.find(b'>', open_tag, index)
+    body_end = content.find(_SCRIPT_CLOSE, index)
+    if body_start == -1 or body_end == -1:
+        return None
+    return _decode(content[body_start + 1:body_end], encoding).strip()
+
+
+def extract_json_literal(text: str, marker: str) -> Tuple[Any, Optional[int]]:
+    """Decode the JSON literal assigned after `marker` in a script
+
+    The JSON scanner finds the end of the literal itself, so payloads spanning
+    several lines and strings containing braces or semicolons are handled.
+    Returns the decoded value and the index just past it, or (None, None) if the
+    marker isn't there. Raises json.JSONDecodeError on malformed JSON.
+    """
+    start = text.find(marker)
+    if start == -1:
+        return None, None
+    start = _WHITESPACE.match(text, start + len(marker)).end()
+    return _DECODER.raw_decode(text, start)
+
+
+def _head_end(content: bytes) -> int:
+    end = content.find(_HEAD_CLOSE)
+    return len(content) if end == -1 else end
+
+
+def scan_coordinates(content: bytes) -> Tuple[Optional[float], Optional[float]]:
+    """The crag's (latitude, longitude) from the page, or (None, None) if it has none that make sense"""
+    head_end = _head_end(content)
+    searches = [(pattern, head_end) for pattern in _META_COORDINATE_RES]
+    searches += [(pattern, len(content)) for pattern in _COORDINATE_RES]
+    for pattern, end in searches:
+        for match in pattern.finditer(content, 0, end):
+            latitude, longitude = float(match.group(1)), float(match.group(2))
+            # 0,0 is what an unset map widget shows
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180 and (latitude, longitude) != (0, 0):
+                return latitude, longitude
+    return None, None
+
+
+def crag_name(title: str) -> Optional[str]:
+    """The crag's name from a title such as 'UKC Logbook - Stanage Popular'"""
+    name = title.replace(VALID_TITLE_PREFIX, '').strip(_TITLE_SEPARATORS)
+    return name or None
+
+
+def scan_crag_name(content: bytes, title: str, encoding: str = 'utf-8') -> Optional[str]:
+    """Crag name from the og:title meta tag if there is one, otherwise from the page title"""
+    match = _OG_TITLE_RE.search(content, 0, _head_end(content))
+    if match is not None:
+        name = crag_name(html.unescape(_decode(match.group(1), encoding)))
+        if name:
+            return name
+    return crag_name(title)
+
+
+def parse_crag_page(content: bytes) -> CragPage:
+    """Scan a raw crag page once for its title and data scripts"""
+    # Only the encoding check touches the whole page; the slices below are decoded on their own
+    encoding = detect_encoding(content)
+    page = CragPage(title=scan_title(content, encoding), encoding=encoding)
+    if page.is_valid:
+        page.table_script = scan_script(content, TABLE_DATA_MARKER, encoding)
+        if page.table_script is not None and GRADES_LIST_MARKER.decode() in page.table_script:
+            page.grades_script = page.table_script
+        else:
+            page.grades_script = scan_script(content, GRADES_LIST_MARKER, encoding)
+        page.name = scan_crag_name(content, page.title, encoding)
+        page.latitude, page.longitude = scan_coordinates(content)
+    return page
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.geo import region_for
+from climb_scraper.metrics import METRICS
+from climb_scraper.scraper.fetcher import AsyncCragFetcher, FetchResult
+from climb_scraper.scraper.grades import GRADE_TABLE
+from climb_scraper.scraper.page_parser import parse_crag_page
+from climb_scraper.scraper.records import ClimbRecord, climb_records_creation
+from climb_scraper.scraper.recrawl import RecrawlScheduler, content_hash
+
+
+@dataclass
+class ParsedCrag:
+    """What a parser process hands to the writer for one crag"""
+    crag_id: int
+    records: Optional[List[ClimbRecord]] = None
+    grades: Optional[dict] = None
+    page_hash: Optional[str] = None
+    error: Optional[str] = None
+    name: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+def parse_page(crag_id: int, status: Optional[int], error: Optional[str], content: Optional[bytes]) -> ParsedCrag:
+    """Turn a fetched page into climb records; runs in a parser process"""
+    if error is not None:
+        return ParsedCrag(crag_id, error=error)
+    if status != 200 or content is None:
+        return ParsedCrag(crag_id, error=f"HTTP {status}")
+    page = parse_crag_page(content)
+    if not page.is_valid:
+        return ParsedCrag(crag_id, error=f"Not a crag page: {page.title or 'no title'}")
+    try:
+        page.load_data()
+    except json.JSONDecodeError as e:
+        return ParsedCrag(crag_id, error=f"Invalid JSON format: {e}")
+    records = climb_records_creation(page.climbs)
+    if records is None:
+        return ParsedCrag(crag_id, error="Could not extract climb data")
+    return ParsedCrag(crag_id, records, page.grades, content_hash(page),
+                      name=page.name, latitude=page.latitude, longitude=page.longitude)
+
+
+def store_crag(db: ClimbingDatabase, crag_id: int, climb_records: Optional[list], grades_json: Optional[dict],
+               page_hash: Optional[str] = None, scheduler: Optional[RecrawlScheduler] = None,
+               name: Optional[str] = None, latitude: Optional[float] = None,
+               longitude: Optional[float] = None, changed: Optional[bool] = None) -> bool:
+    """Write a parsed crag, its details, climbs and grades, and mark it processed, as one unit
+
+    With a scheduler and a page hash matching the last crawl, the climbs are
+    not rewritten; only the crag's details and recrawl schedule are updated.
+    A caller that has already compared the hash passes the answer as changed.
+    The crag's region is derived from its coordinates.
+    """
+    region = region_for(latitude, longitude)
+    if scheduler is not None and page_hash is not None and changed is None:
+        changed = scheduler.has_changed(crag_id, page_hash)
+    if scheduler is not None and page_hash is not None and not changed:
+        try:
+            with db.transaction():
+                # Crags stored before their names and coordinates were extracted pick them up here
+                if not (db.insert_crag(crag_id, name, latitude, longitude, region)
+                        and db.mark_crag_processed(crag_id, success=True)):
+                    raise RuntimeError(f"Database write failed for crag {crag_id}, rolled back")
+                scheduler.record(crag_id, page_hash, changed=False)
+        except RuntimeError as e:
+            print(e)
+            return False
+        print(f"Crag {crag_id} unchanged since last crawl, skipped")
+        METRICS.inc('crags_unchanged')
+        METRICS.inc('crags_stored')
+        return True
+
+    if climb_records is None:
+        return False
+
+    # The crag, its climbs and the processed mark are committed together or not at all
+    try:
+        with db.transaction():
+            # A changed page replaces the crag's climbs, so routes removed from it go too
+            if not (db.insert_crag(crag_id, name, latitude, longitude, region)
+                    and (scheduler is None or db.clear_climbs(crag_id))
+                    and db.insert_climbs(climb_records, crag_id)
+                    and db.mark_crag_processed(crag_id, success=True)):
+                raise RuntimeError(f"Database write failed for crag {crag_id}, rolled back")
+            if grades_json:
+                GRADE_TABLE.update(grades_json, db)
+            if scheduler is not None:
+                scheduler.record(crag_id, page_hash, changed=True)
+    except RuntimeError as e:
+        print(e)
+        return False
+    print(f"Successfully processed crag {crag_id}")
+    METRICS.inc('crags_stored')
+    return True
+
+
+class ScrapePipeline:
+    """Fetch, parse and write stages joined by bounded queues.
+
+    Fetcher tasks share the AsyncCragFetcher's pool and rate limit, a
+    ProcessPoolExecutor does the CPU-bound parsing off the GIL, and a single
+    writer batches results into the database. When a later stage falls behind,
+    the bounded queues stall the earlier ones, so memory stays flat.
+
+    All database access happens in the writer while run() is in progress.
+    """
+
+    def __init__(self, db: ClimbingDatabase, fetcher: AsyncCragFetcher, scheduler: Optional[RecrawlScheduler] = None,
+                 parsers: Optional[int] = None, queue_size: int = 32, write_batch: int = 50, max_retries: int = 3):
+        self.db = db
+        self.fetcher = fetcher
+        self.scheduler = scheduler
+        self.parsers = parsers or max((os.cpu_count() or 2) - 1, 1)
+        self.queue_size = queue_size
+        self.write_batch = write_batch
+        self.max_retries = max_retries
+        self.stored = 0
+        self.failed = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn rather than fork: the fetch engine runs its event loop on a thread
+            self._executor = ProcessPoolExecutor(self.parsers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _fetch_stage(self, ids: asyncio.Queue, to_parse: asyncio.Queue):
+        while not ids.empty():
+            crag_id = ids.get_nowait()
+            result = await self.fetcher.fetch(crag_id)
+            with METRICS.timer('pipeline.parse_queue_wait'):
+                await to_parse.put(result)
+
+    async def _parse_stage(self, to_parse: asyncio.Queue, to_write: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            result: Optional[FetchResult] = await to_parse.get()
+            if result is None:
+                return
+            try:
+                # Includes the round trip to the parser process, which is what the pipeline waits on
+                with METRICS.timer('parse'):
+                    parsed = await loop.run_in_executor(self.executor, parse_page, result.crag_id, result.status,
+                                                        result.error, result.content)
+            except Exception as e:
+                parsed = ParsedCrag(result.crag_id, error=f"Parser failed: {e}")
+            with METRICS.timer('pipeline.write_queue_wait'):
+                await to_write.put(parsed)
+
+    def _record_failure(self, crag_id: int, error: str):
+        attempts = self.db.record_failure(crag_id, error, self.max_retries)
+        if attempts is not None and attempts >= self.max_retries:
+            print(f"Crag {crag_id} has failed {self.max_retries} times, marking as permanently failed")
+
+    def _write(self, batch: List[ParsedCrag]):
+        # Whole batch in one transaction, each crag a savepoint within it
+        stored = failed = 0
+        with self.db.transaction():
+            for parsed in batch:
+                error = parsed.error
+                if error is None:
+                    try:
+                        if store_crag(self.db, parsed.crag_id, parsed.records, parsed.grades, parsed.page_hash,
+                                      self.scheduler, parsed.name, parsed.latitude, parsed.longitude):
+                            stored += 1
+                            continue
+                        error = "Database write failed"
+                    except Exception as e:
+                        # e.g. grades_list in a shape GRADE_TABLE doesn't know; the crag's savepoint is rolled back
+                        error = f"Write failed: {e}"
+                failed += 1
+                self._record_failure(parsed.crag_id, error)
+        # Only counted once the batch has committed; _fail_batch counts a batch that didn't
+        self.stored += stored
+        self.failed += failed
+        METRICS.inc('crags_failed', failed)
+
+    def _fail_batch(self, batch: List[ParsedCrag], error: Exception):
+        """Record every crag in a batch whose transaction could not be committed as failed"""
+        print(f"Writing a batch of {len(batch)} crags failed, all rolled back: {error}")
+        for parsed in batch:
+            self._record_failure(parsed.crag_id, f"Batch write failed: {error}")
+        self.failed += len(batch)
+        METRICS.inc('crags_failed', len(batch))
+
+    async def _write_stage(self, to_write: asyncio.Queue):
+        batch = []
+        while True:
+            parsed = await to_write.get()
+            if parsed is not None:
+                batch.append(parsed)
+            if batch and (parsed is None or len(batch) >= self.write_batch or to_write.empty()):
+                # The writer must outlive a failed batch: the parsers block on to_write until it drains
+                try:
+                    with METRICS.timer('write_batch'):
+                        await asyncio.to_thread(self._write, batch)
+                except Exception as e:
+                    await asyncio.to_thread(self._fail_batch, batch, e)
+                batch = []
+            if parsed is None:
+                return
+
+    async def run(self, crag_ids: List[int]) -> Tuple[int, int]:
+        """Push crag IDs through all three stages, returning (stored, failed) counts"""
+        self.stored = self.failed = 0
+        ids = asyncio.Queue()
+        for crag_id in crag_ids:
+            ids.put_nowait(crag_id)
+        to_parse = asyncio.Queue(maxsize=self.queue_size)
+        to_write = asyncio.Queue(maxsize=self.queue_size)
+
+        writer = asyncio.create_task(self._write_stage(to_write))
+        parsers = [asyncio.create_task(self._parse_stage(to_parse, to_write)) for _ in range(self.parsers)]
+        fetchers = [asyncio.create_task(self._fetch_stage(ids, to_parse)) for _ in range(self.fetcher.concurrency)]
+        try:
+            await asyncio.gather(*fetchers)
+            for _ in parsers:
+                await to_parse.put(None)
+            await asyncio.gather(*parsers)
+            await to_write.put(None)
+            await writer
+        finally:
+            # If a stage raised, the others would otherwise be left waiting on their queues
+            stages = fetchers + parsers + [writer]
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+        return self.stored, self.failed
@@ -0,0 +1,59 @@
+from typing import List, Optional
+
+REQUIRED_CLIMB_FIELDS = ('id', 'name', 'grade', 'techgrade', 'gradesystem', 'gradetype', 'gradescore')
+
+
+class ClimbRecord:
+    """One climb with just the fields we store, without a DataFrame row around it"""
+    __slots__ = ('climb_id', 'name', 'grade', 'tech_grade', 'grade_system', 'grade_type', 'grade_score')
+
+    def __init__(self, climb_id, name, grade, tech_grade, grade_system, grade_type, grade_score):
+        self.climb_id = climb_id
+        self.name = name
+        self.grade = grade
+        self.tech_grade = tech_grade
+        self.grade_system = grade_system
+        self.grade_type = grade_type
+        self.grade_score = grade_score
+
+    def as_row(self, crag_id: int) -> tuple:
+        """Parameters for the climbs insert"""
+        return (self.climb_id, crag_id, self.name, self.grade, self.tech_grade, self.grade_score, self.grade_type)
+
+    def __repr__(self):
+        return f"ClimbRecord({self.climb_id!r}, {self.name!r}, grade={self.grade!r})"
+
+
+def climb_records_creation(climbs_data) -> Optional[List[ClimbRecord]]:
+    """Lean counterpart of climbs_dataframe_creation: decoded climbs JSON to ClimbRecords"""
+    if climbs_data is None:
+        return None
+
+    # Ensure we have a list of climb data
+    if not isinstance(climbs_data, list):
+        print("Climbs data is not in expected list format")
+        return None
+
+    if not climbs_data:  # Check if the data is empty
+        print("No climbs data found in JSON")
+        return None
+
+    try:
+        return [ClimbRecord(*(climb[field] for field in REQUIRED_CLIMB_FIELDS)) for climb in climbs_data]
+    except KeyError:
+        pass
+    except TypeError as e:
+        print(f'Failed to create climb records with error:\n{e}')
+        return None
+
+    # As in a DataFrame, a field only has to be on some climbs; the rest are left unset
+    try:
+        missing_columns = [field for field in REQUIRED_CLIMB_FIELDS
+                           if not any(field in climb for climb in climbs_data)]
+        if missing_columns:
+            print(f"Missing required columns: {missing_columns}")
+            return None
+        return [ClimbRecord(*(climb.get(field) for field in REQUIRED_CLIMB_FIELDS)) for climb in climbs_data]
+    except (TypeError, AttributeError) as e:
+        print(f'Failed to create climb records with error:\n{e}')
+        return None
@@ -0,0 +1,88 @@
+import hashlib
+import heapq
+import time
+from typing import List, Optional, Tuple
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.scraper.page_parser import CragPage
+
+DAY = 24 * 60 * 60
+
+
+def content_hash(page: CragPage) -> str:
+    """Hash of the parts of a crag page we store, ignoring the ads and layout around them"""
+    digest = hashlib.sha256()
+    digest.update((page.table_script or '').encode('utf-8'))
+    if page.grades_script != page.table_script:
+        digest.update(b'\0')
+        digest.update((page.grades_script or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RecrawlScheduler:
+    """Decides when each scraped crag should be fetched again.
+
+    Every crawl compares the page's content hash with the last one. A crag that
+    changed has its interval shortened; one that didn't has it stretched, more so
+    the less often it has changed in the past. Due crags come off a heap ordered
+    by next-due time, so a fixed request budget goes to the busiest crags first.
+    """
+
+    def __init__(self, db: ClimbingDatabase, initial_interval: float = 14 * DAY,
+                 min_interval: float = DAY, max_interval: float = 180 * DAY):
+        self.db = db
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._heap: List[Tuple[float, int]] = []
+        self.db.schedule_unscheduled_crags(initial_interval)
+
+    def next_interval(self, interval: float, crawls: int, changes: int, changed: bool) -> float:
+        """New recrawl interval after a crawl, from the crag's change history"""
+        # Laplace-smoothed chance that a crawl finds the crag changed
+        change_rate = (changes + 1) / (crawls + 2)
+        if changed:
+            interval *= 0.5
+        else:
+            interval *= 2 - change_rate
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def has_changed(self, crag_id: int, page_hash: str) -> bool:
+        """Whether a freshly fetched page differs from the last crawl of the crag"""
+        state = self.db.get_crawl_state(crag_id)
+        return state is None or state[0] != page_hash
+
+    def record(self, crag_id: int, page_hash: Optional[str], changed: bool, now: Optional[float] = None) -> float:
+        """Save a crawl of the crag and schedule its next one, returning the next due time
+
+        A None hash records a failed fetch, which keeps the stored hash and retries
+        after the minimum interval.
+        """
+        now = time.time() if now is None else now
+        state = self.db.get_crawl_state(crag_id)
+        previous_hash, interval, crawls, changes = state or (None, self.initial_interval, 0, 0)
+        if page_hash is None:
+            next_due = now + self.min_interval
+            self.db.save_crawl_state(crag_id, previous_hash, interval, next_due, crawls, changes)
+            return next_due
+        if state is not None:
+            interval = self.next_interval(interval, crawls, changes, changed)
+        next_due = now + interval
+        self.db.save_crawl_state(crag_id, page_hash, interval, next_due, crawls + 1,
+                                 changes + (1 if changed and state is not None else 0))
+        return next_due
+
+    def pop_due(self, n: int, now: Optional[float] = None) -> List[int]:
+        """Take up to n crag IDs whose recrawl is due, most overdue first"""
+        now = time.time() if now is None else now
+        if not self._heap or self._heap[0][0] > now:
+            self._heap = self.db.get_due_crags(now, max(n * 4, 100))
+            heapq.heapify(self._heap)
+        due = []
+        seen = set()
+        while self._heap and len(due) < n and self._heap[0][0] <= now:
+            _, crag_id = heapq.heappop(self._heap)
+            if crag_id not in seen:
+                seen.add(crag_id)
+                due.append(crag_id)
+        return due
@@ -1,107 +1,232 @@
-import random
-
-from sqlalchemy.engine import cursor
-
-from climb_scraper.scraper.scraper_functions import get_crag_id, url_builder, get_data, data_to_string, \
-    string_processor_climbs, climbs_dataframe_creation, string_processor_grades, grades_dataframe_creation, \
-    climbs_grades_dataframe_merge, verify_crag
-from data.database import ClimbingDatabase
-from scraper.list_builder import populate_ids_list
+import os
+import socket
 import time
-
-def import_ids_from_file(db: ClimbingDatabase, filename: str) -> bool:
-    """Import crag IDs from existing text file into database"""
+from typing import List, Optional, Tuple
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.page_cache import PageCache
+from climb_scraper.metrics import METRICS, format_progress
+from climb_scraper.scraper.fetcher import FetchResult, get_engine
+from climb_scraper.scraper.list_builder import populate_ids_list
+from climb_scraper.scraper.page_parser import parse_crag_page
+from climb_scraper.scraper.pipeline import ScrapePipeline, store_crag
+from climb_scraper.scraper.records import climb_records_creation
+from climb_scraper.scraper.recrawl import RecrawlScheduler, content_hash
+from climb_scraper.scraper.scraper_functions import read_id_file, url_builder, data_to_string, \
+    string_processor_climbs, string_processor_grades, verify_crag, check_fetch_result
+
+
+def import_ids_from_file(db: ClimbingDatabase, filename: str, chunk_size: int = 10000) -> bool:
+    """Import crag IDs from a text file into the database queue
+
+    Only the IDs and ranges listed are queued, streamed from the file in
+    chunked transactions.
+    """
     try:
-        with open(filename, 'r') as f:
-            ids = [int(line.strip()) for line in f if line.strip()]
-        if ids:
-            min_id = min(ids)
-            max_id = max(ids)
-            return db.add_crag_ids(min_id, max_id)
-    except Exception as e:
+        added = db.import_crag_ids(read_id_file(filename), chunk_size)
+        if added:
+            print(f"Imported {added} new crag IDs from {filename}")
+        return added is not None
+    except OSError as e:
         print(f"Error importing IDs from file: {e}")
         return False
 
 
-def main():
+def process_crag(db: ClimbingDatabase, crag_id: int, url_data,
+                 scheduler: Optional[RecrawlScheduler] = None) -> bool:
+    """Parse a fetched crag page and store its climbs, returning True on success
+
+    With a scheduler, a page whose content hash matches the last crawl is not
+    parsed or rewritten; only its recrawl schedule moves on.
+    """
+    page = url_data.page or parse_crag_page(url_data.content)
+    page_hash = changed = None
+    if scheduler is not None:
+        page_hash = content_hash(page)
+        changed = scheduler.has_changed(crag_id, page_hash)
+        if not changed:
+            return store_crag(db, crag_id, None, None, page_hash, scheduler,
+                              page.name, page.latitude, page.longitude, changed=False)
+
+    data_string = data_to_string(url_data)
+    if data_string is None:
+        return False
+
+    climb_json = string_processor_climbs(data_string)
+    # Plain slotted records rather than a DataFrame; pandas stays out of the scraper loop
+    climb_records = climb_records_creation(climb_json)
+
+    if climb_records is None:
+        return False
+
+    grades_json = string_processor_grades(page.grades_script)
+    return store_crag(db, crag_id, climb_records, grades_json, page_hash, scheduler,
+                      page.name, page.latitude, page.longitude, changed=changed)
+
+
+def recrawl_crags(db: ClimbingDatabase, engine, scheduler: RecrawlScheduler, crag_ids: List[int]):
+    """Refetch crags that are due a recrawl"""
+    print(f"Recrawling {len(crag_ids)} crags that are due")
+    results = engine.fetch_many(crag_ids)
+    # Each crag in a savepoint, so one that fails to write doesn't roll back the others
+    with db.transaction():
+        for result in results:
+            url_data = check_fetch_result(result)
+            try:
+                with db.transaction():
+                    stored = url_data is not None and process_crag(db, result.crag_id, url_data, scheduler)
+            except Exception as e:
+                # e.g. grades_list in a shape GRADE_TABLE doesn't know
+                print(f"Recrawling crag {result.crag_id} failed, kept its stored climbs: {e}")
+                db.record_failure(result.crag_id, f"Write failed: {e}")
+                stored = False
+            if not stored:
+                # Keep the old data and try again after the minimum interval
+                scheduler.record(result.crag_id, None, changed=False)
+
+
+def reparse_from_cache(db: ClimbingDatabase, cache: PageCache) -> int:
+    """Rebuild climbs from cached pages without any network I/O
+
+    Each cached crag's climbs are replaced on their own. Crags whose pages have
+    been evicted from the cache, or no longer parse, keep the climbs they have;
+    a page that fails to reparse is recorded as a failed attempt at its crag.
+    Returns the number of crags rebuilt.
+    """
+    rebuilt = 0
+    crag_ids = cache.crag_ids()
+    print(f"Reparsing {len(crag_ids)} cached crag pages")
+    with db.transaction():
+        for crag_id in crag_ids:
+            cached = cache.get(crag_id, touch=False)
+            if cached is None:
+                continue
+            result = FetchResult(crag_id=crag_id, url=url_builder(crag_id), status=200,
+                                 content=cached.body, from_cache=True)
+            url_data = check_fetch_result(result)
+            if url_data is None:
+                continue
+            # Each crag in a savepoint, so one bad page doesn't roll back the others
+            try:
+                with db.transaction():
+                    if not (db.clear_climbs(crag_id) and process_crag(db, crag_id, url_data)):
+                        raise RuntimeError("the page no longer parses or could not be stored")
+            except Exception as e:
+                print(f"Could not reparse crag {crag_id}, kept its stored climbs: {e}")
+                db.record_failure(crag_id, f"Reparse failed: {e}")
+                continue
+            rebuilt += 1
+    print(f"Rebuilt climbs for {rebuilt} crags from the page cache")
+    return rebuilt
+
+
+def describe_failure(result) -> str:
+    """Short reason a fetched crag could not be stored, for the last_error column"""
+    if result.error is not None:
+        return result.error
+    if result.status != 200:
+        return f"HTTP {result.status}"
+    if result.page is not None and not result.page.is_valid:
+        return f"Not a crag page: {result.page.title or 'no title'}"
+    return "Could not extract climb data"
+
+
+def scrape_batch(db: ClimbingDatabase, engine, pipeline: ScrapePipeline, worker_id: str, batch_size: int = 100,
+                 lease_seconds: float = 600) -> Optional[Tuple[int, int]]:
+    """Lease the next batch of unprocessed crags and run it through the pipeline
+
+    Returns (stored, failed), or None if there was nothing left to lease.
+    Raises RuntimeError if the lease itself failed.
+    """
+    # Lease the next batch of crags so other workers skip them
+    batch = db.claim_batch(batch_size, worker_id, lease_seconds)
+    if batch is None:
+        # Not an empty lease: waiting for other workers to finish would never end
+        raise RuntimeError("Could not lease crag IDs from the database")
+    if not batch:
+        return None
+
+    print(f"Processing crag IDs: {batch[0]} to {batch[-1]}")
+
+    # Fetch, parse in worker processes and write in batches, all overlapping
+    stored, failed = engine.run(pipeline.run(batch))
+    print(f"Batch done: {stored} crags stored, {failed} failed, "
+          f"request rate now {engine.fetcher.current_rate:.2f}/s")
+    return stored, failed
+
+
+def main(concurrency: int = 4, rate: float = 0.5, batch_size: int = 100, lease_seconds: float = 600,
+         worker_id: Optional[str] = None, cache_dir: Optional[str] = 'page_cache', parsers: Optional[int] = None,
+         max_rate: float = 4.0, metrics_port: Optional[int] = None, metrics_file: Optional[str] = None,
+         db_path: str = 'climbing_data.db', ids_file: Optional[str] = 'crag_ids.txt'):
     # Initialize the database
-    db = ClimbingDatabase("climbing_data.db")
+    db = ClimbingDatabase(db_path, persistent=True)
     # First run: Import existing IDs from text file if needed
-    import_ids_from_file(db, 'crag_ids.txt')
-
-    failed_attempts = {}
+    if ids_file is not None and os.path.exists(ids_file):
+        import_ids_from_file(db, ids_file)
+
+    # One pooled client for the whole run; the adaptive token bucket starts at `rate` and
+    # finds the fastest rate up to `max_rate` the site will take without pushing back
+    # Raw pages are kept so a parser fix can be replayed with reparse_from_cache
+    cache = PageCache(cache_dir) if cache_dir else None
+    engine = get_engine(concurrency=concurrency, rate=rate, max_rate=max_rate, cache=cache)
+
+    # Metrics stay off, and cost nothing, unless an endpoint or dump file is asked for
+    if metrics_port is not None:
+        METRICS.serve(metrics_port)
+    if metrics_file is not None:
+        METRICS.dump_periodically(metrics_file)
+    METRICS.gauge_fn('request_rate', lambda: engine.fetcher.current_rate)
+
+    # Attempt counts live in the database so they survive restarts and are shared between workers
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
     MAX_RETRIES = 3
 
     # Check database state before starting
     db.verify_database_state()
 
+    scheduler = RecrawlScheduler(db)
+    pipeline = ScrapePipeline(db, engine.fetcher, scheduler, parsers=parsers, max_retries=MAX_RETRIES)
+
     first_crag = db.get_next_unprocessed_crag_id()
     if first_crag:
         print("\nVerifying first unprocessed crag:")
         verify_crag(first_crag)
 
-
-    while True:
-        # Get processing statistics
-        processed, unprocessed = db.get_processing_stats()
-        print(f"Processing status: {processed} crags processed, {unprocessed} remaining")
-
-        if unprocessed == 0:
-            print("No unprocessed crags found. Looking for new crags...")
-            populate_ids_list(db)  # This will add new crag IDs to the database
-            continue  # Go back to the start of the loop
-
-        # Get next crag to process
-        crag_id = db.get_next_unprocessed_crag_id()
-        if crag_id is None:
-            print("No unprocessed crags found.")
-            break
-
-        print(f"Processing crag ID: {crag_id}")
-
-        # Check if we've tried this crag too many times
-        if failed_attempts.get(crag_id, 0) >= MAX_RETRIES:
-            print(f"Crag {crag_id} has failed {MAX_RETRIES} times, marking as permanently failed")
-            db.mark_crag_processed(crag_id, success=True)
-            continue
-
-        url_data = get_data(url_builder(crag_id))
-
-        if url_data is None:
-            failed_attempts[crag_id] = failed_attempts.get(crag_id, 0) + 1
-            if failed_attempts[crag_id] >= MAX_RETRIES:
-                print(f"Failed to get data for crag {crag_id} after {MAX_RETRIES} attempts, marking as failed")
-                db.mark_crag_processed(crag_id, success=True)
-            continue
-
-        data_string = data_to_string(url_data)
-        if data_string is None:
-            failed_attempts[crag_id] = failed_attempts.get(crag_id, 0) + 1
-            continue
-
-        climb_json = string_processor_climbs(data_string)
-        climb_dataframe = climbs_dataframe_creation(climb_json)
-
-        if climb_dataframe is None:
-            failed_attempts[crag_id] = failed_attempts.get(crag_id, 0) + 1
-            continue
-
-        # Successfully processed the crag
-        if db.insert_crag(crag_id) and db.insert_climbs(climb_dataframe, crag_id):
-            print(f"Successfully processed crag {crag_id}")
-            db.mark_crag_processed(crag_id, success=True)
-            # Clear any failed attempts for this crag
-            failed_attempts.pop(crag_id, None)
-        else:
-            failed_attempts[crag_id] = failed_attempts.get(crag_id, 0) + 1
-
-
-        # Add delay to avoid overwhelming the server
-        base_delay = random.uniform(2, 5)  # Base delay between 2-5 seconds
-        if random.random() < 0.1:  # 10% chance of a longer delay
-            base_delay += random.uniform(5, 15)  # Add 5-15 seconds occasionally
-        time.sleep(base_delay)
+    try:
+        while True:
+            # Get processing statistics
+            processed, unprocessed = db.get_processing_stats()
+            print(f"Processing status: {processed} crags processed, {unprocessed} remaining")
+            METRICS.set_gauge('backlog', unprocessed)
+            METRICS.set_gauge('processed', processed)
+            if METRICS.enabled:
+                print(f"Throughput: {format_progress()}")
+
+            if unprocessed == 0:
+                # Spend the request budget on crags due a recrawl before probing for new ones
+                due = scheduler.pop_due(batch_size)
+                if due:
+                    recrawl_crags(db, engine, scheduler, due)
+                    continue
+                print("No unprocessed crags found. Looking for new crags...")
+                populate_ids_list(db, engine)  # This will add new crag IDs to the database
+                continue  # Go back to the start of the loop
+
+            if scrape_batch(db, engine, pipeline, worker_id, batch_size, lease_seconds) is None:
+                print("All remaining crags are leased by other workers, waiting...")
+                time.sleep(min(lease_seconds, 60))
+    finally:
+        METRICS.stop()
+        if metrics_file is not None:
+            METRICS.dump(metrics_file)
+        engine.stop()
+        pipeline.close()
+        db.release_leases(worker_id)
+        db.disconnect()
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,13 +1,18 @@
-from typing import Optional
+import os
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
 
-import requests
 import json
-from bs4 import BeautifulSoup as bs
-import pandas as pd
-from pandas.core.interchange import dataframe
 import random
-import time
-from scraper.list_builder import is_valid_crag_page
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.metrics import timed
+from climb_scraper.scraper.grades import GRADE_TABLE, GradeTable, flatten_grades
+from climb_scraper.scraper.page_parser import extract_json_literal, parse_crag_page
+
+if TYPE_CHECKING:
+    # pandas, requests, bs4 and aiohttp are imported where they are used, so commands
+    # that only read the ID files or the database start without them
+    import pandas as pd
+    from climb_scraper.scraper.fetcher import FetchEngine, FetchResult
 
 def get_random_user_agent() -> str:
     """Return a random user agent string"""
@@ -20,20 +25,35 @@ def get_random_user_agent() -> str:
     ]
     return random.choice(user_agents)
 
-def get_crag_id(txt_file: str) -> int:
-    """ Gets first crag id from text file"""
-    try:
-        with open(txt_file, 'r') as fin:
-            data = fin.read().splitlines(True)
-            if not data:  # Check if file is empty
-                return None
-            crag_id = data[0].strip()
-        with open(txt_file, 'w') as fout:
-            fout.writelines(data[1:])
-        return int(crag_id)
-    except Exception as e:
-        print(f"Failed to get crag id from {txt_file} with error: \n{e}")
-        return None
+def parse_id_specs(lines: Iterable[str]) -> Iterator[int]:
+    """Yield crag IDs from lines of single IDs and inclusive ranges
+
+    Entries can be separated by whitespace or commas, ranges are written
+    100-200 or 100..200, and anything after a # is ignored. Ranges are
+    expanded lazily, so a wide one costs no memory.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        for spec in line.split('#', 1)[0].replace(',', ' ').split():
+            start, separator, end = spec.replace('..', '-').partition('-')
+            try:
+                if separator:
+                    yield from range(int(start), int(end) + 1)
+                else:
+                    yield int(start)
+            except ValueError:
+                print(f"Skipping invalid crag ID spec on line {line_number}: {spec}")
+
+
+def read_id_file(txt_file: str) -> Iterator[int]:
+    """Stream the crag IDs listed in a text file, one line at a time"""
+    with open(txt_file, 'r') as fin:
+        yield from parse_id_specs(fin)
+
+
+def get_crag_id(db: ClimbingDatabase, worker_id: Optional[str] = None, lease_seconds: float = 600) -> Optional[int]:
+    """Take the next crag ID off the database queue, leasing it so it isn't handed out twice"""
+    claimed = db.claim_batch(1, worker_id or f"get_crag_id:{os.getpid()}", lease_seconds)
+    return claimed[0] if claimed else None
 
 def url_builder(crag_id:int) -> str:
     """Generates a url from a crag ID"""
@@ -44,67 +64,57 @@ def url_builder(crag_id:int) -> str:
 
 def is_valid_crag_url_page(content):
     try:
-        # Try different encodings
-        for encoding in ['utf-8', 'iso-8859-1', 'windows-1252']:
-            try:
-                decoded_content = content.decode(encoding)
-                soup = bs(decoded_content, 'html.parser')
-                title = soup.title.string if soup.title else ''
-                if 'UKC Logbook' in title:
-                    return True
-            except UnicodeDecodeError:
-                continue
-        return False
+        return parse_crag_page(content).is_valid
     except Exception as e:
         print(f"Error checking crag validity: {e}")
         return False
 
 
-def get_data(url: str) -> Optional[requests.Response]:
-    """Make requests appear more human-like with better encoding handling"""
-    headers = {
-        'User-Agent': get_random_user_agent(),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',  # Removed 'br' to avoid compression issues
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    }
-
+@timed('get_data')
+def get_data(url: str, engine: Optional['FetchEngine'] = None) -> Optional['FetchResult']:
+    """Fetch a crag page through the shared fetch engine and check it is a valid crag"""
+    from climb_scraper.scraper.fetcher import get_engine
     try:
-        time.sleep(random.uniform(2, 5))
-        session = requests.Session()
+        result = (engine or get_engine()).fetch_url(url)
+        return check_fetch_result(result)
+    except Exception as e:
+        print(f"Request failed with error:\n{e}")
+        return None
 
-        # Make the request with explicit encoding settings
-        response = session.get(url, headers=headers)
-        response.encoding = 'utf-8'  # Force UTF-8 encoding
 
-        if response.status_code != 200:
-            print(f"HTTP error {response.status_code} for URL: {url}")
-            return None
+def check_fetch_result(result: 'FetchResult') -> Optional['FetchResult']:
+    """Return the fetch result if it holds a valid crag page, otherwise None"""
+    if result.error is not None:
+        print(f"Request failed with error:\n{result.error}")
+        return None
 
-        # Add some debugging
-        print(f"\nChecking crag page: {url}")
-        print(f"Response encoding: {response.encoding}")
-        print(f"Content type: {response.headers.get('content-type', 'unknown')}")
+    if result.status != 200:
+        print(f"HTTP error {result.status} for URL: {result.url}")
+        return None
 
-        if is_valid_crag_url_page(response.content):
-            return response
-        else:
-            # Let's see what we actually got
-            soup = bs(response.content, 'html.parser')
-            title = soup.title.string if soup.title else 'No title found'
-            print(f"Page title: {title}")
-            print("Not a valid crag page")
-            return None
+    print(f"\nChecking crag page: {result.url}")
+    print(f"Content type: {result.headers.get('Content-Type', 'unknown')}")
 
+    try:
+        result.page = parse_crag_page(result.content)
     except Exception as e:
-        print(f"Request failed with error:\n{e}")
+        print(f"Error checking crag validity: {e}")
+        return None
+
+    if result.page.is_valid:
+        return result
+    else:
+        # Let's see what we actually got
+        print(f"Page title: {result.page.title or 'No title found'}")
+        print("Not a valid crag page")
         return None
 
 
 def verify_crag(crag_id: int):
     """Debug function to verify a specific crag"""
+    import requests
+    from bs4 import BeautifulSoup as bs
+
     url = f"https://www.ukclimbing.com/logbook/crag.php?id={crag_id}"
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -128,22 +138,16 @@ def verify_crag(crag_id: int):
 
     return response.content
 
+@timed('data_to_string')
 def data_to_string(data: json) -> str:
     """Processes the raw response into a string for processing"""
     if data is None:
         return None
 
     try:
-        soup = bs(data.content, 'html.parser')
-        scripts = soup.find_all('script')
-
-        # Look specifically for the script containing table_data
-        table_data = None
-        for script in scripts:
-            if script.string and 'table_data = ' in script.string:
-                # Get the whole script content
-                table_data = script.string.strip()
-                break
+        # Reuse the scan done while validating the page when there is one
+        page = getattr(data, 'page', None) or parse_crag_page(data.content)
+        table_data = page.table_script
 
         if table_data is None:
             print("Could not find table_data in scripts")
@@ -154,62 +158,37 @@ def data_to_string(data: json) -> str:
         print(f"Data processor request failed with error:\n{e}")
         return None
 
+@timed('string_processor_climbs')
 def string_processor_climbs(data: str) -> json:
-    """Find the relevant data for the climbs at this crag"""
+    """Find and decode the climbs data for this crag"""
     if data is None:
         return None
 
     try:
-        start_keyword = 'table_data = '
-        start_index = data.find(start_keyword)
-        if start_index == -1:
+        climbs_data, end_index = extract_json_literal(data, 'table_data = ')
+        if end_index is None:
             print('Unable to find climb data in page')
             return None
-
-        start_index += len(start_keyword)
-
-        # Find the semicolon that terminates the JavaScript statement
-        end_index = data.find('\n', start_index)
-        if end_index == -1:
-            end_index = data.find(';', start_index)
-        if end_index == -1:
-            print('Unable to find end of table_data')
-            return None
-
-        # Extract the raw JSON string
-        json_str = data[start_index:end_index].strip()
-
-        # Remove any trailing commas that might cause JSON parsing errors
-        json_str = json_str.rstrip(',')
-
-        # Remove any trailing semicolons
-        json_str = json_str.rstrip(';')
-
-        # Test parse the JSON
-        try:
-            json.loads(json_str)
-            return json_str
-        except json.JSONDecodeError as e:
-            print(f"Invalid JSON format: {e}")
-            print("First 100 characters of extracted data:", json_str[:100])
-            # Debug output to help identify issues
-            print("Last 50 characters:", json_str[-50:])
-            return None
-
+        return climbs_data
+    except json.JSONDecodeError as e:
+        print(f"Invalid JSON format: {e}")
+        print("Data around the error:", data[max(e.pos - 50, 0):e.pos + 50])
+        return None
     except Exception as e:
         print(f'String processing failed with error:\n{e}')
         print("Data string preview:", data[:200] if data else "None")
         return None
 
 
-def climbs_dataframe_creation(data: json) -> dataframe:
+@timed('climbs_dataframe_creation')
+def climbs_dataframe_creation(data: json) -> 'pd.DataFrame':
     """Takes the climb data in json and returns it in a dataframe with only the relevant information"""
     if data is None:
         return None
 
     try:
-        # Parse the JSON data
-        climbs_data = json.loads(data)
+        # string_processor_climbs hands over decoded data; older callers may still pass the JSON text
+        climbs_data = json.loads(data) if isinstance(data, str) else data
 
         # Ensure we have a list of climb data
         if not isinstance(climbs_data, list):
@@ -221,6 +200,7 @@ def climbs_dataframe_creation(data: json) -> dataframe:
             return None
 
         # Create dataframe
+        import pandas as pd
         climbs_dataframe = pd.DataFrame(climbs_data)
 
         # Check for required columns
@@ -236,71 +216,63 @@ def climbs_dataframe_creation(data: json) -> dataframe:
 
     except json.JSONDecodeError as e:
         print(f'JSON parsing error: {e}')
-        print("Problematic JSON:", data[:200])
+        print("Problematic JSON:", str(data)[:200])
         return None
     except Exception as e:
         print(f'Failed to create climbs dataframe with error:\n{e}')
         print("Data type:", type(data))
         return None
 
+@timed('string_processor_grades')
 def string_processor_grades(data: str) -> json:
-    """Find the relevant data for the grades at this crag"""
-
-    start_keyword = 'grades_list = '
-    try:
-        start_index = data.find(start_keyword) + len(start_keyword)
-        i = start_index
-    except Exception as e:
-        print(f'Unable to find start keyword in data string:\n{e}')
-    open_brackets = 0
-    closed_brackets = 0
-
+    """Find and decode the grades data for this crag"""
+    if data is None:
+        return None
 
     try:
-        while True:
-            if data[i] == '{':
-                open_brackets += 1
-            elif data[i] == '}':
-                closed_brackets += 1
-            if open_brackets == closed_brackets and open_brackets != 0:
-                end_index = i + 1
-                break
-            i += 1
-        json_data = data[start_index:end_index]
-        return json_data
-    except Exception as e:
+        grades_data, end_index = extract_json_literal(data, 'grades_list = ')
+        if end_index is None:
+            print('Unable to find grades data in page')
+            return None
+        return grades_data
+    except json.JSONDecodeError as e:
         print(f'String processing failed to correctly determine the bounds of the json with error:\n{e}')
+        return None
 
-def grades_dataframe_creation(data: json) -> dataframe:
+@timed('grades_dataframe_creation')
+def grades_dataframe_creation(data: json) -> 'pd.DataFrame':
     """Takes the grade data in json and returns it in dataframe with only the relevant information"""
     try:
-        grades_json = json.loads(data)
-        grades_list = []
-        for outer_value in grades_json.values():
-            for inner_value in outer_value.values():
-                row = inner_value.copy()
-                if 'alt' in row:
-                    alt_data = row.pop('alt')
-                    row.update({f'alt_{k}': v for k, v in alt_data.items()})
-                grades_list.append(row)
-        grades_df = pd.DataFrame(grades_list)
+        import pandas as pd
+        grades_json = json.loads(data) if isinstance(data, str) else data
+        grades_df = pd.DataFrame(flatten_grades(grades_json))
         return grades_df
     except Exception as e:
         print(f'Unable to process grades data into dataframe with error:\n{e}')
 
-def climbs_grades_dataframe_merge(climbs: dataframe, grades: dataframe) -> dataframe:
-    """Combines the 2 dataframes in preperation for insertion to the database"""
+@timed('climbs_grades_dataframe_merge')
+def climbs_grades_dataframe_merge(climbs: 'pd.DataFrame', grades=None) -> 'pd.DataFrame':
+    """Combines the climbs with their grade names in preperation for insertion to the database
+
+    Grades resolve through a dict lookup per climb rather than a merge. With no
+    grades given the process-wide GRADE_TABLE is used; a GradeTable or the old
+    grades dataframe also work.
+    """
 
     try:
-        climbs_w_grades = pd.merge(climbs, grades, left_on='grade', right_on='id')
-        climbs_w_grades.drop(
-        ['grade', 'gradesystem_x', 'id_y', 'gradesystem_y', 'score', 'gradecolor', 'alt_id', 'alt_name'], axis=1,
-            inplace=True, errors="ignore")
-        climbs_w_grades.rename(columns={'id_x': 'climb_id', 'name_x': 'climb_name', 'name_y': 'climb_grade'},
-                               inplace=True)
+        import pandas as pd
+        if grades is None:
+            grades = GRADE_TABLE
+        if isinstance(grades, GradeTable):
+            grade_names = {grade_id: grade['name'] for grade_id, grade in grades.grades.items()}
+        else:
+            grade_names = dict(zip(grades['id'], grades['name']))
+        climbs_w_grades = climbs.rename(columns={'id': 'climb_id', 'name': 'climb_name'})
+        climbs_w_grades['climb_grade'] = pd.to_numeric(climbs['grade'], errors='coerce').map(grade_names)
+        # Climbs with an unknown grade are dropped, as the inner merge used to
+        climbs_w_grades = climbs_w_grades.dropna(subset=['climb_grade'])
         climbs_w_grades = climbs_w_grades[['climb_id', 'climb_name', 'climb_grade', 'techgrade', 'gradescore',
                                            'gradetype']]
         return climbs_w_grades
     except Exception as e:
         print(f'Unable to merge dataframes with error:\n{e}')
-
@@ -0,0 +1,48 @@
+"""Climbs, grades and crag pages built for the tests
+
+Small and deterministic, so the tests don't depend on the benchmark corpus.
+"""
+import json
+from typing import List, Optional
+
+# Each grade system numbers its grades 1 to 60, as the site's grades_list does
+GRADE_IDS = range(1, 61)
+
+
+def climb(climb_id: int, name: Optional[str] = None, grade: Optional[str] = 'E1',
+          score: Optional[float] = 100.0, grade_type: Optional[int] = 2) -> dict:
+    """A climb as insert_climbs takes it, with grades already resolved to names"""
+    return {'id': climb_id, 'name': name or f'Route {climb_id}', 'grade': grade, 'techgrade': '5b',
+            'gradescore': score, 'gradetype': grade_type}
+
+
+def grades() -> dict:
+    """A grades_list for grade systems 1 to 3"""
+    return {str(system): {str(g): {'id': g, 'name': f'G{g}', 'score': g * 10, 'gradesystem': system,
+                                   'gradecolor': '#000'}
+                          for g in GRADE_IDS}
+            for system in (1, 2, 3)}
+
+
+def page_climbs(crag_id: int, n_routes: int) -> List[dict]:
+    """A crag page's table_data, with grades as ids into grades()"""
+    return [{'id': crag_id * 1000 + i, 'name': f'Route {i} of crag {crag_id}', 'grade': GRADE_IDS[i % 60],
+             'techgrade': '5b', 'gradesystem': 1, 'gradetype': 1 + i % 3, 'gradescore': 10.0 * i}
+            for i in range(n_routes)]
+
+
+def crag_page(crag_id: int, n_routes: int = 5, filler_kb: int = 1) -> bytes:
+    """A page shaped like a UKC crag page: title, nav filler, map and then the data scripts"""
+    filler = '<div class="nav"><a href="/x">link</a><span>text</span></div>\n' * (filler_kb * 16)
+    latitude, longitude = 53.0 + crag_id / 100, -1.5 - crag_id / 100
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>UKC Logbook - Test Crag {crag_id}</title></head><body>{filler}'
+            f'<script>var map_options = {{"lat": {latitude}, "lng": {longitude}, "zoom": 14}};</script>'
+            f'<script>\nvar table_data = {json.dumps(page_climbs(crag_id, n_routes))};\n'
+            f'var grades_list = {json.dumps(grades())};\n</script></body></html>').encode('utf-8')
+
+
+def invalid_page(filler_kb: int = 1) -> bytes:
+    """A page the site serves for an ID that isn't a crag"""
+    filler = '<p>Nothing to see here</p>\n' * (filler_kb * 40)
+    return f'<html><head><title>UKClimbing - Page not found</title></head><body>{filler}</body></html>'.encode()
@@ -0,0 +1,24 @@
+"""Fixtures shared by the test modules"""
+import pytest
+
+from climb_scraper.data.database import ClimbingDatabase
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    return str(tmp_path / 'climbing.db')
+
+
+@pytest.fixture
+def crag_ids():
+    """The crag IDs queued in db; a module overrides this to queue others"""
+    return [1, 2, 3]
+
+
+@pytest.fixture
+def db(db_path, crag_ids):
+    """A database on a persistent connection with crag_ids queued, closed after the test"""
+    db = ClimbingDatabase(db_path, persistent=True)
+    db.add_crag_id_list(crag_ids)
+    yield db
+    db.disconnect()
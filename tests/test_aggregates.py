@@ -0,0 +1,49 @@
+"""Per-crag grade summaries kept up to date incrementally must match a full rebuild"""
+import pytest
+
+from builders import climb
+from climb_scraper.data.database import ClimbingDatabase
+
+
+@pytest.fixture
+def db(db):
+    for crag_id in (1, 2, 3):
+        db.insert_crag(crag_id, f'Crag {crag_id}')
+    return db
+
+
+def summaries(db: ClimbingDatabase):
+    conn = db.connect()
+    counts = conn.execute("SELECT * FROM crag_grade_counts ORDER BY crag_id, grade_type, grade").fetchall()
+    stats = conn.execute("SELECT * FROM crag_grade_stats ORDER BY crag_id, grade_type").fetchall()
+    return counts, [tuple(pytest.approx(value) if isinstance(value, float) else value for value in row)
+                    for row in stats]
+
+
+def test_incremental_summaries_match_a_full_rebuild(db):
+    db.insert_climbs([climb(1), climb(2, grade='E2', score=150.0), climb(3, grade='VS', score=None, grade_type=1)], 1)
+    db.insert_climbs_batch([(2, [climb(10, grade='HVS', score=80.0), climb(11, grade='HVS', score=90.0)]),
+                            (3, [climb(20, grade=None, score=None, grade_type=None)])])
+    # Regraded, a crag rescraped from scratch, and a climb moved to another crag
+    db.insert_climbs([climb(2, grade='E3', score=200.0)], 1)
+    db.clear_climbs(2)
+    db.insert_climbs([climb(12, grade='E5', score=300.0)], 2)
+    db.insert_climbs([climb(3, grade='VS', score=60.0, grade_type=1)], 3)
+
+    incremental = summaries(db)
+    assert db.check_grade_aggregates() == []
+    assert db.rebuild_grade_aggregates()
+    assert summaries(db) == incremental
+    counts, stats = incremental
+    assert (1, 1, 'VS', 1) not in counts and (3, 1, 'VS', 1) in counts
+    assert (3, -1, '', 1) in counts
+
+
+def test_check_finds_a_summary_that_drifted(db):
+    db.insert_climbs([climb(1), climb(2)], 1)
+    db.insert_climbs([climb(10)], 2)
+    db.connect().execute("UPDATE crag_grade_stats SET climbs = 5 WHERE crag_id = 2")
+    db.connect().commit()
+    assert db.check_grade_aggregates() == [2]
+    db.rebuild_grade_aggregates()
+    assert db.check_grade_aggregates() == []
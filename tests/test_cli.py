@@ -0,0 +1,54 @@
+"""The climb-scraper command line"""
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+from climb_scraper import cli
+from climb_scraper.data.database import ClimbingDatabase
+
+
+@pytest.fixture(autouse=True)
+def db(db):
+    db.mark_crag_processed(1)
+    # The commands open the database at db_path themselves
+    db.disconnect()
+    return db
+
+
+def status(db_path: str, capsys) -> dict:
+    assert cli.main(['--db', db_path, 'status', '--json']) == 0
+    return json.loads(capsys.readouterr().out)
+
+
+def test_status_reports_the_queue(db_path, capsys):
+    state = status(db_path, capsys)
+    assert (state['processed'], state['unprocessed'], state['min_crag_id'], state['max_crag_id']) == (1, 2, 1, 3)
+
+
+def test_status_does_not_wait_for_a_writer(db_path, capsys):
+    writer = ClimbingDatabase(db_path, persistent=True)
+    # A scraper holding the write lock
+    with writer.transaction():
+        writer.add_crag_id_list([4])
+        start = time.monotonic()
+        assert status(db_path, capsys)['unprocessed'] == 2
+        assert time.monotonic() - start < 5
+    writer.disconnect()
+
+
+def test_status_does_not_migrate_an_older_database(db_path, capsys):
+    conn = sqlite3.connect(db_path)
+    # An index a later release added, which opening the database normally creates
+    conn.execute("DROP INDEX idx_crag_changes_seq")
+    conn.commit()
+    status(db_path, capsys)
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_crag_changes_seq'").fetchone() is None
+    conn.close()
+
+
+def test_status_without_a_database(tmp_path, capsys):
+    assert cli.main(['--db', str(tmp_path / 'missing.db'), 'status']) == 1
+    assert not os.path.exists(tmp_path / 'missing.db')
@@ -0,0 +1,79 @@
+"""Queuing crag IDs from ID lists and range specs"""
+import pytest
+
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.scraper.scraper_functions import get_crag_id, parse_id_specs, read_id_file
+
+
+@pytest.fixture
+def crag_ids():
+    return []
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('5', [5]),
+    ('3-6', [3, 4, 5, 6]),
+    ('3..6', [3, 4, 5, 6]),
+    ('1, 2,3 4', [1, 2, 3, 4]),
+    ('7-7, 9..10', [7, 9, 10]),
+    ('  8  # the rest is a comment, 9', [8]),
+    ('# a whole line comment', []),
+    ('', []),
+])
+def test_specs(line, expected):
+    assert list(parse_id_specs([line])) == expected
+
+
+@pytest.mark.parametrize('spec', ['abc', '1-x', '5-', '-5', '1..2..3', '4.5'])
+def test_invalid_specs_are_skipped(spec, capsys):
+    assert list(parse_id_specs([f'1 {spec} 2'])) == [1, 2]
+    assert f'line 1: {spec}' in capsys.readouterr().out
+
+
+def test_a_wide_range_is_expanded_lazily():
+    ids = parse_id_specs(['1-1000000000'])
+    assert [next(ids) for _ in range(3)] == [1, 2, 3]
+
+
+def test_an_id_file_is_read_line_by_line(tmp_path):
+    path = tmp_path / 'crag_ids.txt'
+    path.write_text('# Peak District\n1-3\n\n10, 12 # Froggatt\nnot-an-id\n20..21\n')
+    assert list(read_id_file(str(path))) == [1, 2, 3, 10, 12, 20, 21]
+
+
+def queued(db: ClimbingDatabase) -> list:
+    return [row[0] for row in db.connect().execute("SELECT crag_id FROM crag_ids ORDER BY crag_id")]
+
+
+def test_import_counts_only_new_ids(db):
+    db.add_crag_id_list([2, 4])
+    assert db.import_crag_ids(range(1, 6), chunk_size=2) == 3
+    assert queued(db) == [1, 2, 3, 4, 5]
+    assert db.get_processing_stats() == (0, 5)
+
+
+def test_import_commits_each_chunk(db):
+    reader = ClimbingDatabase(db.db_path, persistent=True)
+    seen = []
+
+    def ids():
+        yield from (1, 2, 3, 4)
+        # The first two chunks are already committed and visible to other connections
+        seen.append(queued(reader))
+        yield 5
+
+    assert db.import_crag_ids(ids(), chunk_size=2) == 5
+    assert seen == [[1, 2, 3, 4]]
+    reader.disconnect()
+
+
+def test_a_failed_import_reports_none(db):
+    db.connect().execute("DROP TABLE crag_ids")
+    assert db.import_crag_ids([1, 2]) is None
+
+
+def test_get_crag_id_leases_each_id_once(db):
+    db.add_crag_id_list([1, 2])
+    assert get_crag_id(db, 'a') == 1
+    assert get_crag_id(db, 'b') == 2
+    assert get_crag_id(db, 'c') is None
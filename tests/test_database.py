@@ -0,0 +1,133 @@
+"""ClimbingDatabase behaviour that several workers or a failed call depend on"""
+import threading
+import time
+
+import pytest
+
+from builders import climb
+from climb_scraper.data.database import ALL_CRAGS, ClimbingDatabase
+
+
+@pytest.fixture
+def crag_ids():
+    # Each test queues the crags it needs
+    return []
+
+
+def test_transaction_waits_for_another_workers_commit(db_path):
+    first = ClimbingDatabase(db_path, persistent=True)
+    second = ClimbingDatabase(db_path, persistent=True)
+    first.add_crag_id_list([1, 2])
+    results = []
+
+    def other_worker():
+        time.sleep(0.1)
+        results.append(second.add_crag_id_list([3]))
+
+    thread = threading.Thread(target=other_worker)
+    thread.start()
+    # Read, let the other worker try to commit, then write: the read must not leave a stale snapshot
+    with first.transaction():
+        first.get_crawl_state(1)
+        time.sleep(0.3)
+        assert first.mark_crag_processed(1, success=True)
+    thread.join()
+    assert results == [True]
+    assert sorted(first.get_all_crag_ids()) == [1, 2, 3]
+    first.disconnect()
+    second.disconnect()
+
+
+def test_failed_write_is_not_committed_by_the_next_call(db):
+    db.add_crag_id_list([1])
+    db.insert_crag(1, 'Crag')
+    # The NOT NULL name on the second climb fails the insert after the first row was written
+    assert not db.insert_climbs([climb(5), dict(climb(6), name=None)], 1)
+    assert not db.conn.in_transaction
+    db.add_crag_id_list([2])
+    assert db.connect().execute("SELECT COUNT(*) FROM climbs").fetchone()[0] == 0
+
+
+def test_reset_leaves_no_summaries_or_probe_state_behind(db):
+    db.add_crag_id_list([1, 2])
+    db.insert_crag(1, 'Crag')
+    db.insert_climbs([climb(1), climb(2)], 1)
+    db.save_crawl_state(1, 'hash', 86400, 0.0, 1, 1)
+    db.save_id_space_chunks([(0, b'', b'', b'')])
+    change_seq = db.connect().execute("SELECT MAX(change_seq) FROM crag_changes").fetchone()[0]
+
+    assert db.reset_crag_ids(100)
+    assert db.check_grade_aggregates() == []
+    status = db.get_status()
+    assert (status['crags'], status['climbs'], status['min_crag_id']) == (0, 0, 100)
+    assert db.get_crawl_state(1) is None
+    assert db.get_id_space_chunks() == []
+    assert db.connect().execute("SELECT crag_id FROM crag_changes WHERE change_seq > ?",
+                                (change_seq,)).fetchall() == [(ALL_CRAGS,)]
+
+
+def test_name_search_check_does_not_hold_the_write_lock(db):
+    db.insert_crag(1, 'Stanage')
+    assert db.check_name_search()
+    assert not db.conn.in_transaction
+
+
+def test_workers_never_claim_the_same_crag(db):
+    db.add_crag_id_list(range(1, 6))
+    assert db.claim_batch(3, 'a') == [1, 2, 3]
+    assert db.claim_batch(3, 'b') == [4, 5]
+    assert db.claim_batch(3, 'c') == []
+
+
+def test_an_expired_lease_can_be_claimed_again(db):
+    db.add_crag_id_list([1, 2])
+    assert db.claim_batch(1, 'a', lease_seconds=-1) == [1]
+    assert db.claim_batch(2, 'b') == [1, 2]
+
+
+def test_a_failed_claim_is_not_an_empty_lease(db):
+    db.add_crag_id_list([1])
+    db.connect().execute("DROP TABLE crag_ids")
+    assert db.claim_batch(1, 'a') is None
+
+
+def test_failures_count_attempts_and_give_up_at_the_limit(db):
+    db.add_crag_id_list([1])
+    assert db.claim_batch(1, 'a') == [1]
+    assert db.record_failure(1, 'HTTP 500', max_attempts=2) == 1
+    # A failure releases the lease, so the crag can be retried straight away
+    assert db.claim_batch(1, 'b') == [1]
+    assert db.record_failure(1, 'HTTP 500', max_attempts=2) == 2
+    assert db.claim_batch(1, 'c') == []
+    assert db.get_processing_stats() == (1, 0)
+
+
+def scanned_counts(db: ClimbingDatabase):
+    return db.connect().execute('''
+    SELECT COALESCE(SUM(processed = TRUE), 0), COALESCE(SUM(processed = FALSE), 0) FROM crag_ids
+    ''').fetchone()
+
+
+def test_status_counts_follow_inserts_marks_and_resets(db):
+    db.add_crag_id_list([1, 2, 3])
+    # Duplicates are ignored and must not be counted twice
+    db.add_crag_id_list([3, 4])
+    assert db.get_processing_stats() == (0, 4)
+    db.mark_crag_processed(1)
+    db.mark_crag_processed(2, success=False)
+    assert db.get_processing_stats() == (1, 3) == scanned_counts(db)
+    db.record_failure(3, 'HTTP 500', max_attempts=1)
+    assert db.get_processing_stats() == (2, 2) == scanned_counts(db)
+    db.reset_crag_ids(100)
+    assert db.get_processing_stats() == (0, 50) == scanned_counts(db)
+
+
+def test_status_counts_are_seeded_from_an_existing_table(db_path):
+    db = ClimbingDatabase(db_path, persistent=True)
+    db.add_crag_id_list([1, 2, 3])
+    db.mark_crag_processed(1)
+    db.connect().execute("DROP TABLE crag_id_counts")
+    db.disconnect()
+    db = ClimbingDatabase(db_path, persistent=True)
+    assert db.get_processing_stats() == (1, 2)
+    db.disconnect()
@@ -0,0 +1,142 @@
+"""Partitioned Parquet export of the climbs table"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+pytest.importorskip('pyarrow')
+import pyarrow.dataset as ds
+
+from builders import climb
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.export import export_climbs_parquet, read_watermark
+from climb_scraper.scraper.pipeline import store_crag
+
+
+def climbs(crag_id: int, n: int):
+    """n climbs for a crag, split between two grade types"""
+    return [climb(crag_id * 1000 + i, grade_type=1 + i % 2) for i in range(n)]
+
+
+@pytest.fixture
+def db(db):
+    store_crag(db, 1, climbs(1, 4), None, name='Stanage', latitude=53.35, longitude=-1.65)
+    store_crag(db, 2, climbs(2, 2), None, name='Chamonix', latitude=45.92, longitude=6.87)
+    # Stored before regions were derived: placed by its coordinates at export time
+    db.insert_crag(3, 'Shepherds', 54.55, -3.14)
+    db.insert_climbs(climbs(3, 3), 3)
+    return db
+
+
+def read(directory: str):
+    return ds.dataset(directory, format='parquet', partitioning='hive').to_table()
+
+
+def test_export_partitions_by_grade_type_and_region(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    assert export_climbs_parquet(db, directory) == 9
+    table = read(directory)
+    regions = dict(zip(table.column('crag_id').to_pylist(), table.column('region').to_pylist()))
+    assert regions == {1: 'Peak District', 2: '45N_6E', 3: 'Lake District'}
+    assert sorted(os.listdir(directory)) == ['_export_watermark.json', 'grade_type=1', 'grade_type=2']
+
+
+def test_full_export_replaces_the_dataset(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    export_climbs_parquet(db, directory)
+    assert export_climbs_parquet(db, directory, incremental=False) == 9
+    assert export_climbs_parquet(db, directory, incremental=False) == 9
+    assert read(directory).num_rows == 9
+    assert not [entry for entry in os.listdir(directory) if entry.startswith('_full-')]
+
+
+def test_incremental_export_adds_only_new_climbs(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    export_climbs_parquet(db, directory)
+    assert export_climbs_parquet(db, directory) == 0
+    db.insert_crag(4, 'Almscliff', 53.94, -1.60)
+    db.insert_climbs(climbs(4, 2), 4)
+    assert export_climbs_parquet(db, directory) == 2
+    table = read(directory)
+    assert table.num_rows == 11
+    assert set(table.filter(ds.field('crag_id') == 4).column('region').to_pylist()) == {'Yorkshire'}
+
+
+def test_climbs_committed_during_an_export_go_in_the_next_one(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    writer = ClimbingDatabase(db.db_path, persistent=True)
+    # Inserted before the export starts, but only committed once it has read the database
+    with writer.transaction():
+        writer.insert_crag(4, 'Almscliff', 53.94, -1.60)
+        writer.insert_climbs(climbs(4, 2), 4)
+        # date_added is now in the past, as it is for a long batch transaction
+        time.sleep(1.1)
+        assert export_climbs_parquet(db, directory) == 9
+    writer.disconnect()
+    assert export_climbs_parquet(db, directory) == 2
+    assert export_climbs_parquet(db, directory) == 0
+    assert read(directory).num_rows == 11
+
+
+def test_a_change_to_every_crag_sends_everything_again(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    export_climbs_parquet(db, directory)
+    since = read_watermark(directory)
+    db.rebuild_grade_aggregates()
+    assert export_climbs_parquet(db, directory) == 9
+    assert read_watermark(directory) > since
+
+
+def failing_after_first_chunk(db: ClimbingDatabase):
+    rows = db.iter_climb_export_rows
+
+    def iter_rows(*args):
+        chunks = rows(*args)
+        yield next(chunks)
+        chunks.close()
+        raise sqlite3.OperationalError('disk I/O error')
+    return iter_rows
+
+
+def test_a_failed_read_leaves_the_dataset_and_watermark_alone(db, tmp_path, monkeypatch):
+    directory = str(tmp_path / 'export')
+    export_climbs_parquet(db, directory)
+    since = read_watermark(directory)
+    db.insert_climbs(climbs(1, 6), 1)
+    monkeypatch.setattr(db, 'iter_climb_export_rows', failing_after_first_chunk(db))
+    assert export_climbs_parquet(db, directory, chunk_size=2) is None
+    assert export_climbs_parquet(db, directory, chunk_size=2, incremental=False) is None
+    assert read_watermark(directory) == since
+    assert read(directory).num_rows == 9
+    assert [entry for entry in os.listdir(directory) if entry.startswith('_')] == ['_export_watermark.json']
+    monkeypatch.undo()
+    assert export_climbs_parquet(db, directory) == 6
+
+
+def test_a_read_error_is_raised_from_the_database(db):
+    db.connect().execute("DROP TABLE crags")
+    with pytest.raises(sqlite3.Error):
+        list(db.iter_climb_export_rows())
+
+
+def current(table):
+    """The rows of each crag's latest export"""
+    latest = {}
+    for crag_id, seq in zip(table.column('crag_id').to_pylist(), table.column('export_seq').to_pylist()):
+        latest[crag_id] = max(seq, latest.get(crag_id, seq))
+    return sorted((crag_id, climb_id) for crag_id, climb_id, seq in zip(
+        table.column('crag_id').to_pylist(), table.column('climb_id').to_pylist(),
+        table.column('export_seq').to_pylist()) if seq == latest[crag_id])
+
+
+def test_the_latest_export_of_a_crag_says_which_climbs_are_current(db, tmp_path):
+    directory = str(tmp_path / 'export')
+    export_climbs_parquet(db, directory)
+    # Crag 1 rescraped with fewer climbs, crag 2 emptied, and a climb moved from crag 3 to crag 1
+    db.clear_climbs(1)
+    db.insert_climbs(climbs(1, 2), 1)
+    db.clear_climbs(2)
+    db.insert_climbs([climbs(3, 1)[0]], 1)
+    assert export_climbs_parquet(db, directory) == 6
+    assert current(read(directory)) == [(1, 1000), (1, 1001), (1, 3000), (2, None), (3, 3001), (3, 3002)]
@@ -0,0 +1,200 @@
+"""AsyncCragFetcher against the replay server standing in for ukclimbing.com"""
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from benchmarks.replay import ReplayConfig, ReplayServer
+from builders import crag_page, invalid_page
+from climb_scraper.data.page_cache import PageCache
+from climb_scraper.scraper.fetcher import AdaptiveTokenBucket, AsyncCragFetcher, retry_after_seconds
+
+PAGES = {1: crag_page(1), 2: crag_page(2), 3: invalid_page(),
+         4: b'<html><head><title>UKC Logbook | Search</title></head><body></body></html>'}
+
+
+@pytest.fixture
+def serve():
+    """Start a replay server with the given settings; all are stopped after the test"""
+    servers = []
+
+    def start(**config) -> ReplayServer:
+        server = ReplayServer(PAGES, ReplayConfig(**dict({'latency': 0.0, 'jitter': 0.0}, **config)))
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def run(server: ReplayServer, method: str, *args, **fetcher_kwargs):
+    """Call an AsyncCragFetcher method against the server and return (result, seconds taken)"""
+    settings = dict({'url_template': server.url_template, 'rate': 100.0, 'adaptive': False}, **fetcher_kwargs)
+
+    async def call():
+        async with AsyncCragFetcher(**settings) as fetcher:
+            start = time.monotonic()
+            result = await getattr(fetcher, method)(*args)
+            return result, time.monotonic() - start
+
+    return asyncio.run(call())
+
+
+def test_fetch_page_and_missing_page(serve):
+    server = serve()
+    (page, missing), _ = run(server, 'fetch_many', [1, 99])
+    assert page.ok and page.content == PAGES[1] and page.crag_id == 1
+    assert missing.status == 404 and not missing.ok
+
+
+def test_rate_limit_spaces_out_requests(serve):
+    server = serve()
+    # One token to start with, then one every 1/20 s: 11 requests need at least 0.5 s
+    results, elapsed = run(server, 'fetch_many', [1] * 11, rate=20.0, burst=1.0, concurrency=8)
+    assert all(result.ok for result in results)
+    assert elapsed >= 0.45
+
+
+def test_concurrency_limits_requests_in_flight(serve):
+    server = serve(latency=0.2)
+    results, elapsed = run(server, 'fetch_many', [1, 2, 1, 2], concurrency=2, burst=4.0)
+    assert all(result.ok for result in results)
+    assert elapsed >= 0.38
+
+
+def test_throttled_requests_are_retried_then_given_up(serve):
+    server = serve(throttle_rate=1.0)
+    result, _ = run(server, 'fetch', 1, max_retries=2)
+    assert result.status == 429 and not result.ok
+    assert server.requests == 3
+
+
+def test_server_errors_are_retried(serve):
+    server = serve(error_rate=1.0)
+    result, _ = run(server, 'fetch', 1, max_retries=1)
+    assert result.status == 503
+    assert server.requests == 2
+
+
+def test_missing_pages_are_not_retried(serve):
+    server = serve()
+    result, _ = run(server, 'fetch', 99, max_retries=2)
+    assert result.status == 404
+    assert server.requests == 1
+
+
+def test_retry_after_holds_requests_and_slows_the_rate(serve):
+    server = serve(throttle_rate=1.0, retry_after=1)
+
+    async def call():
+        async with AsyncCragFetcher(url_template=server.url_template, rate=50.0, adaptive=True,
+                                    max_retries=1) as fetcher:
+            start = time.monotonic()
+            result = await fetcher.fetch(1)
+            return result, time.monotonic() - start, fetcher.limiter_for(result.url).rate
+
+    result, elapsed, rate = asyncio.run(call())
+    assert result.status == 429 and server.requests == 2
+    assert elapsed >= 0.9
+    assert rate < 50.0
+
+
+def test_not_modified_page_comes_from_cache(serve, tmp_path):
+    server = serve()
+    cache = PageCache(str(tmp_path))
+
+    async def call():
+        async with AsyncCragFetcher(url_template=server.url_template, rate=100.0, cache=cache) as fetcher:
+            return await fetcher.fetch(1), await fetcher.fetch(1)
+
+    first, second = asyncio.run(call())
+    assert first.ok and not first.from_cache
+    assert cache.validators(1).get('If-None-Match') == first.headers['ETag']
+    assert second.ok and second.from_cache and second.content == PAGES[1]
+    assert server.requests == 2
+    cache.close()
+
+
+def test_probe_tells_crags_from_other_pages(serve):
+    server = serve()
+    (crag, other, logbook, missing), _ = run(server, 'probe_many', [1, 3, 4, 99])
+    assert crag.valid and crag.title.startswith('UKC Logbook - ')
+    assert not other.valid
+    assert not logbook.valid
+    assert not missing.valid and missing.method == 'HEAD' and missing.status == 404
+
+
+def test_head_is_dropped_when_it_cannot_settle_misses(serve):
+    server = serve()
+    # The server answers the non-crag page with a 200, so HEAD never settles it
+    results, _ = run(server, 'probe_many', [3] * 5, concurrency=1, head_give_up=3)
+    assert not any(result.valid for result in results)
+    assert [result.method for result in results] == ['HEAD+GET'] * 3 + ['GET'] * 2
+    assert server.requests == 3 * 2 + 2
+
+
+def test_server_errors_do_not_turn_head_off(serve):
+    server = serve(error_rate=1.0)
+    results, _ = run(server, 'probe_many', [99] * 5, concurrency=1, head_give_up=3)
+    assert [result.status for result in results] == [503] * 5
+    assert [result.method for result in results] == ['HEAD+GET'] * 5
+
+
+def test_head_is_kept_while_it_settles_misses(serve):
+    server = serve()
+    results, _ = run(server, 'probe_many', [1, 2, 1, 2, 99], concurrency=1, head_give_up=3)
+    assert [result.valid for result in results] == [True] * 4 + [False]
+    assert results[-1].method == 'HEAD'
+
+
+def test_healthy_responses_raise_the_rate_up_to_the_maximum():
+    bucket = AdaptiveTokenBucket(rate=1.0, max_rate=2.0, increase=0.1)
+    bucket.record(200, 0.1)
+    assert bucket.rate == pytest.approx(1.1)
+    for _ in range(100):
+        bucket.record(200, 0.1)
+    assert bucket.rate == 2.0
+
+
+@pytest.mark.parametrize('status', [429, 503, 500, None])
+def test_pushback_halves_the_rate_once_per_cooldown(status):
+    bucket = AdaptiveTokenBucket(rate=2.0, min_rate=0.4, decrease=0.5, cooldown=60.0)
+    bucket.record(status)
+    bucket.record(status)
+    assert bucket.rate == 1.0 and bucket.backoffs == 1
+    assert bucket.tokens <= 0
+    for _ in range(5):
+        bucket._last_backoff -= 60.0
+        bucket.record(status)
+    assert bucket.rate == 0.4
+
+
+def test_a_latency_spike_backs_off():
+    bucket = AdaptiveTokenBucket(rate=2.0, latency_factor=2.0, latency_slack=0.5, cooldown=0.0)
+    for _ in range(5):
+        bucket.record(200, 0.1)
+    rate = bucket.rate
+    for _ in range(10):
+        bucket.record(200, 3.0)
+    assert bucket.backoffs and bucket.rate < rate
+
+
+def test_retry_after_holds_the_bucket():
+    bucket = AdaptiveTokenBucket(rate=2.0)
+    bucket.record(429, retry_after=30.0)
+    assert bucket.blocked_until - time.monotonic() == pytest.approx(30.0, abs=1.0)
+    # A shorter hold never cuts a longer one short
+    bucket.record(429, retry_after=1.0)
+    assert bucket.blocked_until - time.monotonic() > 25.0
+
+
+def test_retry_after_header_forms():
+    assert retry_after_seconds({'Retry-After': '12'}) == 12.0
+    assert retry_after_seconds({'Retry-After': '86400'}, limit=600.0) == 600.0
+    assert retry_after_seconds({'Retry-After': formatdate(time.time() + 60, usegmt=True)}) == \
+        pytest.approx(60.0, abs=2.0)
+    assert retry_after_seconds({'Retry-After': 'soon'}) is None
+    assert retry_after_seconds({}) is None
@@ -0,0 +1,47 @@
+"""The crag R-tree follows the crags table through its triggers"""
+import pytest
+
+from climb_scraper.data.database import ClimbingDatabase
+
+
+def indexed(db: ClimbingDatabase) -> dict:
+    return {row[0]: row[1:] for row in db.connect().execute(
+        "SELECT crag_id, min_lat, min_lon FROM crags_rtree ORDER BY crag_id")}
+
+
+def test_crags_with_coordinates_are_indexed_on_insert(db):
+    db.insert_crag(1, 'Stanage', 53.35, -1.65)
+    db.insert_crag(2, 'No location yet')
+    assert indexed(db) == {1: pytest.approx((53.35, -1.65))}
+
+
+def test_moving_locating_and_deleting_a_crag_updates_the_index(db):
+    db.insert_crag(1, 'Stanage', 53.35, -1.65)
+    db.insert_crag(2, 'Froggatt')
+    db.insert_crag(1, latitude=53.36, longitude=-1.66)
+    db.insert_crag(2, latitude=53.29, longitude=-1.62)
+    assert indexed(db) == {1: pytest.approx((53.36, -1.66)), 2: pytest.approx((53.29, -1.62))}
+    db.connect().execute("DELETE FROM crags WHERE crag_id = 1")
+    db.connect().commit()
+    assert set(indexed(db)) == {2}
+
+
+def test_an_existing_crags_table_is_indexed_when_the_rtree_is_created(db):
+    db.insert_crag(1, 'Stanage', 53.35, -1.65)
+    conn = db.connect()
+    conn.execute("DROP TABLE crags_rtree")
+    for trigger in ('insert', 'update', 'delete'):
+        conn.execute(f"DROP TRIGGER crags_rtree_{trigger}")
+    conn.commit()
+    db.disconnect()
+    db = ClimbingDatabase(db.db_path, persistent=True)
+    assert set(indexed(db)) == {1}
+    db.disconnect()
+
+
+def test_nearby_and_viewport_queries_use_the_index(db):
+    db.insert_crag(1, 'Stanage', 53.35, -1.65)
+    db.insert_crag(2, 'Froggatt', 53.29, -1.62)
+    db.insert_crag(3, 'Chamonix', 45.92, 6.87)
+    assert [row[0] for row in db.get_crags_within_km(53.35, -1.65, 10)] == [1, 2]
+    assert [row[0] for row in db.get_crags_in_bbox(45, 46, 6, 7)] == [3]
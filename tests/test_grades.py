@@ -0,0 +1,52 @@
+"""GradeTable must only remember grades the database has committed"""
+import pytest
+
+from builders import GRADE_IDS, grades
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.scraper.grades import GradeTable
+from climb_scraper.scraper.pipeline import store_crag
+from climb_scraper.scraper.records import climb_records_creation
+
+# The grade systems share their ids, so each id is stored once
+STORED = len(GRADE_IDS)
+
+
+@pytest.fixture
+def crag_ids():
+    return [1]
+
+
+def stored_grades(db: ClimbingDatabase) -> int:
+    return len(db.get_grades())
+
+
+def test_grades_are_learned_once_committed(db):
+    table = GradeTable()
+    with db.transaction():
+        assert table.update(grades(), db) == STORED
+        assert table.grades == {}
+    assert len(table.grades) == STORED == stored_grades(db)
+    assert table.update(grades(), db) == 0
+
+
+def test_a_rolled_back_crag_leaves_its_grades_to_be_written_again(db):
+    table = GradeTable()
+    with db.transaction():
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                table.update(grades(), db)
+                raise RuntimeError("crag failed")
+    assert table.grades == {}
+    assert stored_grades(db) == 0
+    assert table.update(grades(), db) == STORED
+    assert stored_grades(db) == STORED
+
+
+def test_a_failed_grade_write_rolls_back_the_crag(db, monkeypatch):
+    monkeypatch.setattr(db, 'insert_grades', lambda grades: False)
+    records = climb_records_creation([{'id': 1, 'name': 'Route', 'grade': 45, 'techgrade': '5b',
+                                       'gradesystem': 2, 'gradetype': 2, 'gradescore': 450.0}])
+    monkeypatch.setattr('climb_scraper.scraper.pipeline.GRADE_TABLE', GradeTable())
+    assert not store_crag(db, 1, records, grades())
+    assert db.get_processing_stats() == (0, 1)
+    assert db.connect().execute("SELECT COUNT(*) FROM climbs").fetchone()[0] == 0
@@ -0,0 +1,88 @@
+"""CragFinder discovery against the replay server"""
+import pytest
+
+from benchmarks.replay import ReplayConfig, ReplayServer
+from builders import crag_page
+from climb_scraper.data.id_space import DAY, IdSpaceMap
+from climb_scraper.scraper.fetcher import FetchEngine
+from climb_scraper.scraper.list_builder import CragFinder
+
+KNOWN = list(range(1, 11))
+NEW = list(range(11, 31))
+
+
+@pytest.fixture(scope='module')
+def server():
+    with ReplayServer({crag_id: crag_page(crag_id, 1) for crag_id in KNOWN + NEW},
+                      ReplayConfig(latency=0.0, jitter=0.0)) as server:
+        yield server
+
+
+@pytest.fixture(scope='module')
+def throttled():
+    with ReplayServer({crag_id: crag_page(crag_id, 1) for crag_id in KNOWN + NEW},
+                      ReplayConfig(latency=0.0, jitter=0.0, throttle_rate=1.0)) as server:
+        yield server
+
+
+@pytest.fixture
+def crag_ids():
+    return KNOWN
+
+
+@pytest.fixture
+def db(db):
+    for crag_id in KNOWN:
+        db.insert_crag(crag_id, f'Crag {crag_id}')
+    return db
+
+
+@pytest.fixture
+def finder(server, db):
+    """Build CragFinders sharing one database and engine, against the healthy server unless told otherwise"""
+    engines = {}
+
+    def build(against=server, **kwargs):
+        if against.url_template not in engines:
+            engines[against.url_template] = FetchEngine(url_template=against.url_template, concurrency=8,
+                                                        rate=1000.0, adaptive=False)
+        return CragFinder(db, engine=engines[against.url_template], max_attempts=20, batch_size=10, **kwargs)
+
+    yield build
+    for engine in engines.values():
+        engine.stop()
+
+
+def test_finds_crags_above_the_highest_known(server, finder):
+    assert finder().find_new_crags() == NEW
+
+
+def test_a_second_run_does_not_probe_known_misses_again(server, finder):
+    finder().find_new_crags()
+    before = server.requests
+    assert finder().find_new_crags() == []
+    assert server.requests == before
+
+
+def test_stale_frontier_misses_are_probed_again(server, finder):
+    finder().find_new_crags()
+    before = server.requests
+    # Every miss is past a staleness window that ended a day in the future
+    assert finder(frontier_recheck_after=-DAY).find_new_crags() == []
+    assert server.requests > before
+
+
+def test_throttled_probes_are_not_stored_as_misses(server, throttled, finder):
+    before = throttled.requests
+    assert finder(against=throttled).find_new_crags() == []
+    # The search gives up on a server that answers nothing rather than probing forever
+    assert throttled.requests - before < 100
+    assert finder().find_new_crags() == NEW
+
+
+def test_only_stored_crags_seed_the_id_space(db):
+    # Queued by a min..max range, never probed
+    db.add_crag_id_list(range(11, 21))
+    id_space = IdSpaceMap.load(db)
+    assert all(id_space.state(crag_id) for crag_id in KNOWN)
+    assert all(id_space.state(crag_id) is None for crag_id in range(11, 21))
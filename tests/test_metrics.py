@@ -0,0 +1,103 @@
+"""Stage timings and counters, and the text the metrics endpoint serves"""
+import pytest
+
+from climb_scraper.metrics import METRICS, Histogram, Metrics, timed
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics()
+    metrics.enable()
+    return metrics
+
+
+@pytest.fixture
+def global_metrics():
+    """The process-wide METRICS that timed() records to, off and empty before and after"""
+    METRICS.disable()
+    METRICS.reset()
+    yield METRICS
+    METRICS.disable()
+    METRICS.reset()
+
+
+def test_a_value_on_a_bucket_bound_is_counted_in_that_bucket():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.0, 0.1, 0.10001, 1.0, 1.5):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['buckets'] == {'0.1': 2, '1.0': 4, '+Inf': 5}
+    assert snapshot['count'] == 5
+    assert snapshot['sum'] == pytest.approx(2.70001)
+    assert snapshot['mean'] == pytest.approx(0.540002)
+
+
+def test_an_empty_histogram():
+    assert Histogram((1.0,)).snapshot() == {'count': 0, 'sum': 0.0, 'mean': 0.0, 'buckets': {'1.0': 0, '+Inf': 0}}
+
+
+def test_prometheus_text(metrics):
+    metrics.inc('crags_stored', 3)
+    metrics.set_gauge('backlog', 12)
+    metrics.histograms['db.insert_climbs'] = histogram = Histogram((0.01, 0.1))
+    histogram.observe(0.005)
+    histogram.observe(0.05)
+    metrics.started -= 60
+    lines = metrics.to_prometheus().splitlines()
+    assert lines[:4] == ['# TYPE climb_scraper_crags_stored_total counter',
+                         'climb_scraper_crags_stored_total 3',
+                         '# TYPE climb_scraper_backlog gauge',
+                         'climb_scraper_backlog 12']
+    assert lines[4] == '# TYPE climb_scraper_crags_per_minute gauge'
+    assert float(lines[5].split()[1]) == pytest.approx(3.0, rel=0.01)
+    assert lines[6] == '# TYPE climb_scraper_eta_seconds gauge'
+    assert float(lines[7].split()[1]) == pytest.approx(240.0, rel=0.01)
+    assert lines[8:] == ['# TYPE climb_scraper_db_insert_climbs_seconds histogram',
+                         'climb_scraper_db_insert_climbs_seconds_bucket{le="0.01"} 1',
+                         'climb_scraper_db_insert_climbs_seconds_bucket{le="0.1"} 2',
+                         'climb_scraper_db_insert_climbs_seconds_bucket{le="+Inf"} 2',
+                         'climb_scraper_db_insert_climbs_seconds_sum 0.055',
+                         'climb_scraper_db_insert_climbs_seconds_count 2']
+    assert metrics.to_prometheus().endswith('\n')
+
+
+def test_eta_is_left_out_until_there_is_a_backlog(metrics):
+    assert 'eta_seconds' not in metrics.to_prometheus()
+
+
+def test_timer_records_the_block_even_when_it_raises(metrics):
+    with metrics.timer('fetch'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer('fetch'):
+            raise ValueError
+    assert metrics.histograms['fetch'].count == 2
+
+
+def test_timed_records_each_call(global_metrics):
+    @timed('parse')
+    def parse(value):
+        return value * 2
+
+    assert parse(2) == 4
+    assert 'parse' not in global_metrics.histograms
+    global_metrics.enable()
+    assert parse(3) == 6
+    assert global_metrics.histograms['parse'].count == 1
+
+
+def test_nothing_is_recorded_while_disabled():
+    metrics = Metrics()
+    metrics.inc('crags_stored')
+    metrics.set_gauge('backlog', 5)
+    metrics.observe('fetch', 0.1)
+    with metrics.timer('fetch') as timer:
+        pass
+    assert timer is metrics.timer('other')
+    assert (metrics.counters, metrics.gauges, metrics.histograms) == ({}, {}, {})
+
+
+def test_a_failing_gauge_function_is_left_out(metrics):
+    metrics.gauge_fn('request_rate', lambda: 1.5)
+    metrics.gauge_fn('broken', lambda: 1 / 0)
+    assert metrics.snapshot()['gauges'] == {'request_rate': 1.5}
@@ -0,0 +1,104 @@
+"""Pulling the data literals and crag details out of raw crag pages"""
+import json
+
+import pytest
+
+from climb_scraper.scraper.page_parser import detect_encoding, extract_json_literal, parse_crag_page, \
+    scan_coordinates
+from climb_scraper.scraper.scraper_functions import string_processor_climbs, string_processor_grades
+
+CLIMBS = [{'id': 1, 'name': 'The {Brace}; Route', 'desc': 'Pull on at "}" and step left;\nthen up'},
+          {'id': 2, 'name': 'Second', 'desc': '}]};'}]
+GRADES = {'2': {'45': {'id': 45, 'name': 'E1', 'score': 450}}}
+
+
+def script(*statements: str) -> str:
+    return '\n'.join(statements)
+
+
+def test_a_literal_spanning_several_lines_is_decoded_whole():
+    text = script('var table_data = ' + json.dumps(CLIMBS, indent=2) + ';', 'var other = 1;')
+    climbs, end = extract_json_literal(text, 'table_data = ')
+    assert climbs == CLIMBS
+    assert text[end] == ';'
+
+
+def test_braces_and_semicolons_inside_strings_do_not_end_the_literal():
+    text = script('table_data = ' + json.dumps(CLIMBS) + '; grades_list = ' + json.dumps(GRADES) + ';')
+    assert string_processor_climbs(text) == CLIMBS
+    assert string_processor_grades(text) == GRADES
+
+
+def test_a_missing_marker_is_not_an_error():
+    assert extract_json_literal('var nothing = 1;', 'table_data = ') == (None, None)
+    assert string_processor_climbs('var nothing = 1;') is None
+
+
+def test_malformed_json_raises_from_the_extractor_only():
+    text = 'table_data = [{"id": 1,;'
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_literal(text, 'table_data = ')
+    assert string_processor_climbs(text) is None
+
+
+def test_a_page_decodes_its_literals_once_on_demand():
+    body = ('<html><head><title>UKC Logbook - Crag</title></head><body><script>\n'
+            + script('table_data = ' + json.dumps(CLIMBS, indent=1) + ';',
+                     'grades_list = ' + json.dumps(GRADES) + ';')
+            + '\n</script></body></html>').encode('utf-8')
+    page = parse_crag_page(body)
+    assert page.climbs is None
+    assert page.load_data().climbs == CLIMBS
+    assert page.grades == GRADES
+
+
+@pytest.mark.parametrize('page, expected', [
+    (b'<script>var map = {"latitude": 53.35, "longitude": -1.65};</script>', (53.35, -1.65)),
+    (b"<script>lat = 53.35; lng = -1.65;</script>", (53.35, -1.65)),
+    (b'<script>var lat = "54.5"; var lon = "-3.1";</script>', (54.5, -3.1)),
+    (b'<head><meta name="geo.position" content="53.35;-1.65"></head>', (53.35, -1.65)),
+    (b'<head><meta name="ICBM" content="53.35, -1.65"></head>', (53.35, -1.65)),
+    (b'<a href="https://maps.google.com/maps?q=45.92,6.87">Map</a>', (45.92, 6.87)),
+    (b'<a href="https://www.google.com/maps/@?api=1&center=45.92%2C6.87">Map</a>', (45.92, 6.87)),
+])
+def test_coordinates_in_each_form_the_pages_use(page, expected):
+    assert scan_coordinates(page) == expected
+
+
+@pytest.mark.parametrize('page', [
+    b'<p>No map here</p>',
+    # An unset map widget, and values that aren't on the globe
+    b'<script>lat = 0; lng = 0;</script>',
+    b'<script>lat = 95.0; lng = 10.0;</script>',
+    # Meta tags only count in the head
+    b'<head></head><body><meta name="geo.position" content="53.35;-1.65"></body>',
+])
+def test_pages_without_sensible_coordinates(page):
+    assert scan_coordinates(page) == (None, None)
+
+
+def test_the_first_sensible_match_wins():
+    page = b'<script>lat = 0; lng = 0; var pos = {"latitude": 53.35, "longitude": -1.65}</script>'
+    assert scan_coordinates(page) == (53.35, -1.65)
+
+
+def first_decodable(content: bytes) -> str:
+    for encoding in ('utf-8', 'windows-1252'):
+        try:
+            content.decode(encoding)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return 'iso-8859-1'
+
+
+@pytest.mark.parametrize('byte', range(256))
+def test_encoding_matches_trying_each_decode_in_turn(byte):
+    for content in (bytes([byte]), b'<title>Caf\xc3\xa9</title>' + bytes([byte])):
+        assert detect_encoding(content) == first_decodable(content)
+
+
+def test_each_encoding_is_picked_for_the_pages_that_need_it():
+    assert detect_encoding('Café'.encode('utf-8')) == 'utf-8'
+    assert detect_encoding('Café – Crag'.encode('windows-1252')) == 'windows-1252'
+    assert detect_encoding(b'Caf\xe9 \x81') == 'iso-8859-1'
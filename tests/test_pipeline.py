@@ -0,0 +1,98 @@
+"""ScrapePipeline against the replay server: failures in the writer must not stall the run"""
+import asyncio
+
+import pytest
+
+from benchmarks.replay import ReplayConfig, ReplayServer
+from builders import crag_page
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.scraper.fetcher import FetchEngine
+from climb_scraper.scraper.pipeline import ScrapePipeline
+from climb_scraper.scraper.route_scraper import scrape_batch
+
+CRAG_IDS = list(range(1, 7))
+
+
+@pytest.fixture(scope='module')
+def server():
+    with ReplayServer({crag_id: crag_page(crag_id) for crag_id in CRAG_IDS},
+                      ReplayConfig(latency=0.0, jitter=0.0)) as server:
+        yield server
+
+
+@pytest.fixture
+def crag_ids():
+    return CRAG_IDS
+
+
+@pytest.fixture
+def scrape(server, db):
+    """Run the crag IDs through a fresh pipeline, failing rather than hanging if it stalls"""
+    engine = FetchEngine(url_template=server.url_template, concurrency=4, rate=100.0, adaptive=False)
+    pipeline = ScrapePipeline(db, engine.fetcher, parsers=1, write_batch=2)
+
+    def run():
+        return engine.run(asyncio.wait_for(pipeline.run(CRAG_IDS), timeout=20))
+
+    yield db, pipeline, run
+    pipeline.close()
+    engine.stop()
+
+
+def attempts(db: ClimbingDatabase) -> dict:
+    return dict(db.connect().execute("SELECT crag_id, attempts FROM crag_ids").fetchall())
+
+
+def test_pipeline_stores_every_crag(scrape):
+    db, pipeline, run = scrape
+    assert run() == (len(CRAG_IDS), 0)
+    assert db.get_processing_stats() == (len(CRAG_IDS), 0)
+
+
+def test_failed_batches_are_recorded_and_the_run_finishes(scrape, monkeypatch):
+    db, pipeline, run = scrape
+
+    def broken_write(batch):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(pipeline, '_write', broken_write)
+    assert run() == (0, len(CRAG_IDS))
+    assert attempts(db) == {crag_id: 1 for crag_id in CRAG_IDS}
+
+
+def test_a_crag_that_fails_to_write_only_fails_itself(scrape, monkeypatch):
+    db, pipeline, run = scrape
+    insert_crag = db.insert_crag
+
+    def insert_crag_failing_for_3(crag_id, *args):
+        if crag_id == 3:
+            raise TypeError("unexpected page shape")
+        return insert_crag(crag_id, *args)
+
+    monkeypatch.setattr(db, 'insert_crag', insert_crag_failing_for_3)
+    assert run() == (len(CRAG_IDS) - 1, 1)
+    assert attempts(db)[3] == 1
+    assert db.get_processing_stats() == (len(CRAG_IDS) - 1, 1)
+
+
+def test_a_failed_lease_is_not_mistaken_for_other_workers_holding_the_crags(scrape, monkeypatch):
+    db, pipeline, run = scrape
+    monkeypatch.setattr(db, 'claim_batch', lambda *args: None)
+    with pytest.raises(RuntimeError):
+        scrape_batch(db, None, pipeline, 'worker')
+
+
+def test_a_failing_fetcher_leaves_no_stage_running(db):
+    class BrokenFetcher:
+        concurrency = 2
+
+        async def fetch(self, crag_id):
+            raise ValueError("session closed")
+
+    async def run(pipeline):
+        with pytest.raises(ValueError):
+            await pipeline.run(CRAG_IDS)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    with ScrapePipeline(db, BrokenFetcher(), parsers=2) as pipeline:
+        assert asyncio.run(run(pipeline)) == []
@@ -0,0 +1,72 @@
+"""CragQueries answers from its cache until the scraper commits a change to the crag"""
+import pytest
+
+from builders import climb
+from climb_scraper.data.queries import _MISSING, CragQueries, QueryCache
+
+
+@pytest.fixture
+def db(db):
+    db.insert_crag(1, 'Stanage', 53.35, -1.65)
+    db.insert_crag(2, 'Froggatt', 53.29, -1.62)
+    db.insert_climbs([climb(1), climb(2)], 1)
+    db.insert_climbs([climb(10)], 2)
+    return db
+
+
+@pytest.fixture
+def queries(db):
+    with CragQueries(db.db_path, pool_size=2, poll_interval=0) as queries:
+        yield queries
+
+
+def test_repeat_queries_come_from_the_cache(queries):
+    assert queries.crag_summary(1)['routes'] == 2
+    assert queries.crag_summary(1)['routes'] == 2
+    assert (queries.cache.hits, queries.cache.misses) == (1, 1)
+
+
+def test_a_commit_drops_only_the_changed_crag(db, queries):
+    assert queries.crag_summary(1)['routes'] == 2
+    assert [route['climb_id'] for route in queries.routes(2)] == [10]
+    db.insert_climbs([climb(3, score=50.0)], 1)
+    assert queries.crag_summary(1)['routes'] == 3
+    assert queries.routes(2) and queries.cache.hits == 1
+
+
+def test_nothing_is_dropped_without_a_commit(db, queries):
+    queries.crag_summary(1)
+    assert queries.sync() == 0
+    with db.transaction():
+        db.insert_climbs([climb(3)], 1)
+        # Uncommitted: data_version hasn't moved and the cached answer still holds
+        assert queries.crag_summary(1)['routes'] == 2
+    assert queries.crag_summary(1)['routes'] == 3
+
+
+def test_a_reset_clears_the_whole_cache(db, queries):
+    queries.crag_summary(1)
+    queries.crag_summary(2)
+    db.reset_crag_ids(100)
+    assert queries.crag_summary(1) is None
+    assert queries.crag_summary(2) is None
+
+
+def test_a_result_read_before_an_invalidation_is_not_cached():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate([1])
+    cache.put('key', 1, 'stale', generation)
+    assert len(cache) == 0
+
+
+def test_entries_expire_and_the_least_recent_is_evicted():
+    cache = QueryCache(max_entries=2, ttl=10.0)
+    cache.put('a', 1, 'A', now=0.0)
+    cache.put('b', 1, 'B', now=0.0)
+    assert cache.get('a', now=1.0) == 'A'
+    cache.put('c', 2, 'C', now=1.0)
+    assert [cache.get(key, now=2.0) for key in ('a', 'c')] == ['A', 'C']
+    assert cache.get('b', now=2.0) is _MISSING
+    assert cache.get('a', now=11.0) is _MISSING
+    assert cache.invalidate([2]) == 1 and len(cache) == 0
@@ -0,0 +1,90 @@
+"""The DataFrame and ClimbRecord ingest paths must write the same climbs rows"""
+import pytest
+
+from builders import page_climbs
+from climb_scraper.data.database import ClimbingDatabase, climb_rows
+from climb_scraper.scraper.records import ClimbRecord, climb_records_creation
+
+pd = pytest.importorskip('pandas')
+from climb_scraper.scraper.scraper_functions import climbs_dataframe_creation  # noqa: E402
+
+# The site leaves grades and scores unset on some climbs
+SPARSE = [dict(page_climbs(1, 1)[0], id=10, grade=None, techgrade=None, gradescore=None),
+          dict(page_climbs(1, 1)[0], id=11, gradetype=None, techgrade=''),
+          dict(page_climbs(1, 1)[0], id=12, name='Ünïcode “Route”', gradescore=0.0)]
+
+
+def stored(db: ClimbingDatabase, crag_id: int) -> list:
+    return db.connect().execute('''
+    SELECT climb_id, name, grade, tech_grade, grade_score, grade_type, typeof(grade_score), typeof(grade_type)
+    FROM climbs WHERE crag_id = ? ORDER BY climb_id
+    ''', (crag_id,)).fetchall()
+
+
+def renumbered(climbs: list, offset: int) -> list:
+    """The same climbs under other ids, so a second crag can hold them too"""
+    return [dict(climb, id=climb['id'] + offset) for climb in climbs]
+
+
+def rows_by_path(db: ClimbingDatabase, climbs: list):
+    """Insert the climbs as a DataFrame, as ClimbRecords and as plain dicts, one crag each"""
+    results = (db.insert_climbs(climbs_dataframe_creation(climbs), 1),
+               db.insert_climbs(climb_records_creation(renumbered(climbs, 10000)), 2),
+               db.insert_climbs(renumbered(climbs, 20000), 3))
+    return results, [[(row[0] % 10000,) + row[1:] for row in stored(db, crag_id)] for crag_id in (1, 2, 3)]
+
+
+@pytest.mark.parametrize('climbs', [page_climbs(1, 5), SPARSE, page_climbs(1, 5) + SPARSE],
+                         ids=['complete', 'sparse', 'mixed'])
+def test_both_paths_write_the_same_rows(db, climbs):
+    results, (from_dataframe, from_records, from_dicts) = rows_by_path(db, climbs)
+    assert results == (True, True, True)
+    assert len(from_dataframe) == len(climbs)
+    assert from_dataframe == from_records == from_dicts
+
+
+def test_unset_fields_are_stored_as_null(db):
+    db.insert_climbs(climbs_dataframe_creation(SPARSE), 1)
+    rows = {row[0]: row for row in stored(db, 1)}
+    assert rows[10][2:5] == (None, None, None)
+    assert rows[11][5] is None and rows[11][3] == ''
+    assert rows[12][1] == 'Ünïcode “Route”'
+
+
+def test_record_rows_match_dict_rows():
+    records = climb_records_creation(SPARSE)
+    assert all(isinstance(record, ClimbRecord) for record in records)
+    assert [record.as_row(7) for record in records] == list(climb_rows(SPARSE, 7))
+
+
+@pytest.mark.parametrize('field', ['grade', 'techgrade', 'gradesystem', 'gradetype', 'gradescore'])
+def test_a_field_missing_from_some_climbs_is_stored_as_null(db, field):
+    climbs = page_climbs(1, 3)
+    del climbs[1][field]
+    results, (from_dataframe, from_records, _) = rows_by_path(db, climbs)
+    assert results[:2] == (True, True)
+    assert from_dataframe == from_records
+
+
+def test_a_climb_without_a_name_fails_either_way(db):
+    climbs = page_climbs(1, 3)
+    del climbs[1]['name']
+    results, rows = rows_by_path(db, climbs)
+    assert results[:2] == (False, False)
+    assert rows[:2] == [[], []]
+
+
+@pytest.mark.parametrize('field', ['id', 'name', 'grade', 'techgrade', 'gradesystem', 'gradetype', 'gradescore'])
+def test_both_paths_reject_a_field_missing_from_every_climb(field):
+    climbs = page_climbs(1, 3)
+    for climb in climbs:
+        del climb[field]
+    assert climb_records_creation(climbs) is None
+    assert climbs_dataframe_creation(climbs) is None
+
+
+def test_a_dataframe_without_a_stored_column_is_rejected(db):
+    frame = climbs_dataframe_creation(page_climbs(1, 2)).drop(columns=['gradescore'])
+    with pytest.raises(KeyError):
+        list(climb_rows(frame, 1))
+    assert not db.insert_climbs(frame, 1)
@@ -0,0 +1,114 @@
+"""RecrawlScheduler intervals and due order, and how a recrawl uses them"""
+from builders import crag_page
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.scraper.fetcher import FetchResult
+from climb_scraper.scraper.recrawl import DAY, RecrawlScheduler
+from climb_scraper.scraper.route_scraper import process_crag, recrawl_crags
+from climb_scraper.scraper.scraper_functions import check_fetch_result, url_builder
+
+
+def interval(db: ClimbingDatabase, crag_id: int) -> float:
+    return db.get_crawl_state(crag_id)[1]
+
+
+def test_unchanged_crawls_stretch_the_interval_up_to_the_maximum(db):
+    scheduler = RecrawlScheduler(db, initial_interval=10 * DAY, max_interval=30 * DAY)
+    scheduler.record(1, 'a', changed=True, now=0)
+    assert interval(db, 1) == 10 * DAY
+    scheduler.record(1, 'a', changed=False, now=0)
+    assert 10 * DAY < interval(db, 1) < 20 * DAY
+    for _ in range(10):
+        scheduler.record(1, 'a', changed=False, now=0)
+    assert interval(db, 1) == 30 * DAY
+
+
+def test_changes_halve_the_interval_down_to_the_minimum(db):
+    scheduler = RecrawlScheduler(db, initial_interval=8 * DAY, min_interval=3 * DAY)
+    scheduler.record(1, 'a', changed=True, now=0)
+    scheduler.record(1, 'b', changed=True, now=0)
+    assert interval(db, 1) == 4 * DAY
+    scheduler.record(1, 'c', changed=True, now=0)
+    assert interval(db, 1) == 3 * DAY
+    assert db.get_crawl_state(1)[2:] == (3, 2)
+
+
+def test_a_crag_that_often_changes_stretches_more_slowly(db):
+    scheduler = RecrawlScheduler(db, initial_interval=10 * DAY)
+    busy = scheduler.next_interval(10 * DAY, crawls=10, changes=9, changed=False)
+    quiet = scheduler.next_interval(10 * DAY, crawls=10, changes=0, changed=False)
+    assert 10 * DAY < busy < quiet
+
+
+def test_a_failed_fetch_keeps_the_hash_and_retries_soon(db):
+    scheduler = RecrawlScheduler(db, min_interval=DAY)
+    scheduler.record(1, 'a', changed=True, now=0)
+    assert scheduler.record(1, None, changed=False, now=100) == 100 + DAY
+    assert db.get_crawl_state(1)[0] == 'a'
+    assert not scheduler.has_changed(1, 'a')
+
+
+def test_pop_due_returns_the_most_overdue_crags_once(db):
+    scheduler = RecrawlScheduler(db)
+    for crag_id, due in ((1, 30), (2, 10), (3, 20)):
+        db.save_crawl_state(crag_id, 'a', DAY, due, 1, 0)
+    assert scheduler.pop_due(2, now=25) == [2, 3]
+    # Recrawling them pushes their next due time back
+    for crag_id in (2, 3):
+        scheduler.record(crag_id, 'a', changed=False, now=25)
+    assert scheduler.pop_due(2, now=25) == []
+    assert scheduler.pop_due(2, now=35) == [1]
+
+
+def test_a_recrawl_compares_the_page_hash_once(db, monkeypatch):
+    scheduler = RecrawlScheduler(db)
+    page = crag_page(1)
+    lookups = []
+    has_changed = scheduler.has_changed
+
+    def counted(crag_id, page_hash):
+        lookups.append(crag_id)
+        return has_changed(crag_id, page_hash)
+
+    monkeypatch.setattr(scheduler, 'has_changed', counted)
+    for _ in range(2):
+        url_data = check_fetch_result(FetchResult(crag_id=1, url=url_builder(1), status=200, content=page))
+        assert process_crag(db, 1, url_data, scheduler)
+    assert lookups == [1, 1]
+    assert db.get_crawl_state(1)[2:] == (2, 0)
+
+
+def test_a_failed_write_of_an_unchanged_crag_is_not_counted_as_stored(db, monkeypatch):
+    scheduler = RecrawlScheduler(db)
+    url_data = check_fetch_result(FetchResult(crag_id=1, url=url_builder(1), status=200,
+                                              content=crag_page(1)))
+    assert process_crag(db, 1, url_data, scheduler)
+    crawl_state = db.get_crawl_state(1)
+    monkeypatch.setattr(db, 'mark_crag_processed', lambda crag_id, success=True: False)
+    assert not process_crag(db, 1, url_data, scheduler)
+    assert db.get_crawl_state(1) == crawl_state
+
+
+class PageEngine:
+    """Stands in for FetchEngine, answering every crag with its page"""
+
+    def fetch_many(self, crag_ids):
+        return [FetchResult(crag_id=crag_id, url=url_builder(crag_id), status=200,
+                            content=crag_page(crag_id)) for crag_id in crag_ids]
+
+
+def test_a_crag_that_fails_to_write_does_not_roll_back_the_recrawl(db, monkeypatch):
+    scheduler = RecrawlScheduler(db)
+    insert_climbs = db.insert_climbs
+
+    def failing_for_crag_2(records, crag_id):
+        if crag_id == 2:
+            raise TypeError("unexpected climb record")
+        return insert_climbs(records, crag_id)
+
+    monkeypatch.setattr(db, 'insert_climbs', failing_for_crag_2)
+    recrawl_crags(db, PageEngine(), scheduler, [1, 2, 3])
+    conn = db.connect()
+    assert [row[0] for row in conn.execute("SELECT DISTINCT crag_id FROM climbs ORDER BY crag_id")] == [1, 3]
+    assert conn.execute("SELECT attempts, last_error FROM crag_ids WHERE crag_id = 2").fetchone() == \
+        (1, 'Write failed: unexpected climb record')
+    assert db.get_crawl_state(2)[0] is None
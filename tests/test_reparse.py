@@ -0,0 +1,55 @@
+"""Offline reparse of cached pages into the climbs table"""
+from builders import crag_page, invalid_page
+from climb_scraper.data.database import ClimbingDatabase
+from climb_scraper.data.page_cache import PageCache
+from climb_scraper.scraper.route_scraper import reparse_from_cache
+
+ROUTES = 5
+
+
+def cache_with(directory, pages) -> PageCache:
+    cache = PageCache(str(directory))
+    for crag_id, body in pages.items():
+        cache.put(crag_id, body)
+    return cache
+
+
+def climbs_per_crag(db: ClimbingDatabase) -> dict:
+    return dict(db.connect().execute("SELECT crag_id, COUNT(*) FROM climbs GROUP BY crag_id").fetchall())
+
+
+def test_reparse_rebuilds_cached_crags(db, tmp_path):
+    cache = cache_with(tmp_path / 'all', {crag_id: crag_page(crag_id, ROUTES) for crag_id in (1, 2, 3)})
+    assert reparse_from_cache(db, cache) == 3
+    assert climbs_per_crag(db) == {1: ROUTES, 2: ROUTES, 3: ROUTES}
+    cache.close()
+
+
+def test_reparse_keeps_climbs_of_evicted_and_unparseable_pages(db, tmp_path):
+    full = cache_with(tmp_path / 'all', {crag_id: crag_page(crag_id, ROUTES) for crag_id in (1, 2, 3)})
+    reparse_from_cache(db, full)
+    full.close()
+
+    # Crag 2 has been evicted, and crag 3's cached page no longer parses
+    partial = cache_with(tmp_path / 'partial', {1: crag_page(1, ROUTES), 3: invalid_page()})
+    assert reparse_from_cache(db, partial) == 1
+    assert climbs_per_crag(db) == {1: ROUTES, 2: ROUTES, 3: ROUTES}
+    assert db.check_grade_aggregates() == []
+    partial.close()
+
+
+def test_a_crag_that_fails_to_reparse_does_not_roll_back_the_others(db, tmp_path, monkeypatch):
+    cache = cache_with(tmp_path / 'all', {crag_id: crag_page(crag_id, ROUTES) for crag_id in (1, 2, 3)})
+    insert_climbs = db.insert_climbs
+
+    def failing_for_crag_2(records, crag_id):
+        if crag_id == 2:
+            raise TypeError("unexpected climb record")
+        return insert_climbs(records, crag_id)
+
+    monkeypatch.setattr(db, 'insert_climbs', failing_for_crag_2)
+    assert reparse_from_cache(db, cache) == 2
+    assert climbs_per_crag(db) == {1: ROUTES, 3: ROUTES}
+    assert db.connect().execute("SELECT attempts, last_error FROM crag_ids WHERE crag_id = 2").fetchone() == \
+        (1, 'Reparse failed: unexpected climb record')
+    cache.close()
@@ -0,0 +1,40 @@
+"""Typeahead name search returns the best-ranked matches, not the first ones found"""
+import pytest
+
+from builders import climb
+from climb_scraper.data.search import fts_query
+
+
+@pytest.fixture
+def db(db):
+    db.insert_crag(1, 'Burbage')
+    return db
+
+
+def test_the_best_match_wins_however_many_match_before_it(db):
+    # Long names rank below a short one; they also take the lowest rowids
+    db.insert_climbs([climb(climb_id, f'Crack Of The Long Wandering Line Number {climb_id}')
+                      for climb_id in range(1, 1501)] + [climb(5000, 'Crack')], 1)
+    results = db.search_climbs('cra', limit=3)
+    assert [row[0] for row in results][0] == 5000
+    assert len(results) == 3
+
+
+def test_crag_names_are_ranked_too(db):
+    db.add_crag_id_list(range(2, 1503))
+    with db.transaction():
+        for crag_id in range(2, 1502):
+            db.insert_crag(crag_id, f'Stanage Edge Far Northern Section Number {crag_id}')
+        db.insert_crag(1502, 'Stanage')
+    assert db.search_crags('stan', limit=1)[0][0] == 1502
+
+
+@pytest.mark.parametrize('text, query', [
+    ('s', None),
+    ('crack of', 'name : "crack" name : "of"*'),
+    ('crack o', 'name : "crack"'),
+    ('crack ', 'name : "crack"'),
+    ('"wall" OR', 'name : "wall" name : "OR"*'),
+])
+def test_typed_text_becomes_a_quoted_prefix_query(text, query):
+    assert fts_query(text) == query